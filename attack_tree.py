@@ -1,13 +1,18 @@
-import re
 import requests
 import streamlit as st
-from anthropic import Anthropic
-from mistralai import Mistral
-from openai import OpenAI, AzureOpenAI
-from groq import Groq
 from utils import process_groq_response, create_reasoning_system_prompt, extract_mermaid_code
+from clients import get_openai_client, get_azure_openai_client, get_anthropic_client, get_mistral_client, get_groq_client, get_lm_studio_client, get_http_session, configure_google
+from local_models import ollama_request_fields
+from token_budget import THINKING_BUDGET_TOKENS
+from prompt_cache import record_usage
+from retry_policy import is_retryable_error
+from instrumentation import record_error
+from json_repair import parse_json_response
+from schemas import openai_model_response_format, openai_response_format, azure_response_format, anthropic_tool_kwargs, get_anthropic_output, gemini_generation_config, ollama_format
 import json
-import google.generativeai as genai
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
 
 # Function to create a prompt to generate an attack tree
 def create_attack_tree_prompt(app_type, authentication, internet_facing, sensitive_data, app_input, operation_enviroment):
@@ -21,6 +26,9 @@ OPERATING ENVIRONMENT: {operation_enviroment}
 """
     return prompt
 
+# Top-level keys every attack tree response must contain
+ATTACK_TREE_KEYS = ("nodes",)
+
 def convert_tree_to_mermaid(tree_data):
     """
     Convert structured tree data to Mermaid syntax.
@@ -97,34 +105,9 @@ Rules:
 
 ONLY RESPOND WITH THE JSON STRUCTURE, NO ADDITIONAL TEXT."""
 
-def clean_json_response(response_text):
-    """
-    Clean JSON response by removing any markdown code block markers and finding the JSON content.
-    
-    Args:
-        response_text (str): The raw response text that might contain JSON
-        
-    Returns:
-        str: Cleaned JSON string
-    """
-    # Remove markdown JSON code block if present
-    json_pattern = r'```json\s*(.*?)\s*```'
-    match = re.search(json_pattern, response_text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    
-    # If no JSON code block, try to find content between any code blocks
-    code_pattern = r'```\s*(.*?)\s*```'
-    match = re.search(code_pattern, response_text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    
-    # If no code blocks, return the original text
-    return response_text.strip()
-
 # Function to get attack tree from the GPT response.
-def get_attack_tree(api_key, model_name, prompt):
-    client = OpenAI(api_key=api_key)
+def get_attack_tree(api_key, model_name, prompt, max_tokens=4000):
+    client = get_openai_client(api_key)
 
     # For models that support JSON output format
     if model_name in ["o1", "o3-mini"]:
@@ -167,65 +150,63 @@ ONLY RESPOND WITH THE JSON STRUCTURE, NO ADDITIONAL TEXT."""
         
         response = client.chat.completions.create(
             model=model_name,
-            response_format=create_attack_tree_schema(),
+            response_format=openai_response_format("attack_tree"),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            max_completion_tokens=4000
+            max_completion_tokens=max_tokens
         )
+        record_usage(response)
     else:
-        # For other models, try to get JSON output without format parameter
         system_prompt = create_json_structure_prompt()
         response = client.chat.completions.create(
             model=model_name,
+            response_format=openai_model_response_format("attack_tree", model_name),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=4000
+            max_tokens=max_tokens
         )
+        record_usage(response)
 
     # Try to parse JSON response
     try:
-        # Clean the response text first
-        cleaned_response = clean_json_response(response.choices[0].message.content)
-        tree_data = json.loads(cleaned_response)
+        tree_data = parse_json_response(response.choices[0].message.content, ATTACK_TREE_KEYS)
         return convert_tree_to_mermaid(tree_data)
     except json.JSONDecodeError:
         # Fallback: try to extract Mermaid code if JSON parsing fails
         return extract_mermaid_code(response.choices[0].message.content)
 
 # Function to get attack tree from the Azure OpenAI response.
-def get_attack_tree_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt):
-    client = AzureOpenAI(
-        azure_endpoint = azure_api_endpoint,
-        api_key = azure_api_key,
-        api_version = azure_api_version,
-    )
+def get_attack_tree_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt, max_tokens=4000):
+    client = get_azure_openai_client(azure_api_endpoint, azure_api_key, azure_api_version)
 
     # Try to get JSON output
     system_prompt = create_json_structure_prompt()
     response = client.chat.completions.create(
         model = azure_deployment_name,
+        response_format=azure_response_format("attack_tree", azure_api_version),
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Try to parse JSON response
     try:
-        cleaned_response = clean_json_response(response.choices[0].message.content)
-        tree_data = json.loads(cleaned_response)
+        tree_data = parse_json_response(response.choices[0].message.content, ATTACK_TREE_KEYS)
         return convert_tree_to_mermaid(tree_data)
     except json.JSONDecodeError:
         # Fallback: try to extract Mermaid code if JSON parsing fails
         return extract_mermaid_code(response.choices[0].message.content)
 
 # Function to get attack tree from the Mistral model's response.
-def get_attack_tree_mistral(mistral_api_key, mistral_model, prompt):
-    client = Mistral(api_key=mistral_api_key)
+def get_attack_tree_mistral(mistral_api_key, mistral_model, prompt, max_tokens=4000):
+    client = get_mistral_client(mistral_api_key)
 
     # Try to get JSON output
     system_prompt = create_json_structure_prompt()
@@ -234,20 +215,21 @@ def get_attack_tree_mistral(mistral_api_key, mistral_model, prompt):
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Try to parse JSON response
     try:
-        cleaned_response = clean_json_response(response.choices[0].message.content)
-        tree_data = json.loads(cleaned_response)
+        tree_data = parse_json_response(response.choices[0].message.content, ATTACK_TREE_KEYS)
         return convert_tree_to_mermaid(tree_data)
     except json.JSONDecodeError:
         # Fallback: try to extract Mermaid code if JSON parsing fails
         return extract_mermaid_code(response.choices[0].message.content)
 
 # Function to get attack tree from Ollama hosted LLM.
-def get_attack_tree_ollama(ollama_endpoint, ollama_model, prompt):
+def get_attack_tree_ollama(ollama_endpoint, ollama_model, prompt, max_tokens=4000, num_ctx=None, keep_alive=None):
     """
     Get attack tree from Ollama hosted LLM.
     
@@ -255,6 +237,9 @@ def get_attack_tree_ollama(ollama_endpoint, ollama_model, prompt):
         ollama_endpoint (str): The URL of the Ollama endpoint (e.g., 'http://localhost:11434')
         ollama_model (str): The name of the model to use
         prompt (str): The prompt to send to the model
+        max_tokens (int): The output token limit (Ollama's num_predict)
+        num_ctx (int): The context window to load the model with
+        keep_alive (str or int): How long Ollama keeps the model loaded afterwards
         
     Returns:
         dict: The parsed JSON response from the model
@@ -276,17 +261,18 @@ def get_attack_tree_ollama(ollama_endpoint, ollama_model, prompt):
         "model": ollama_model,
         "prompt": full_prompt,
         "stream": False,
-        "format": "json"
+        **ollama_request_fields(max_tokens, num_ctx, keep_alive),
+        "format": ollama_format("attack_tree")
     }
 
     try:
-        response = requests.post(url, json=data, timeout=60)  # Add timeout
+        response = get_http_session().post(url, json=data, timeout=60)  # Add timeout
         response.raise_for_status()  # Raise exception for bad status codes
         outer_json = response.json()
         
         try:
             # Parse the JSON response from the model's response field
-             inner_json = json.loads(outer_json['response'])
+             inner_json = parse_json_response(outer_json['response'], ATTACK_TREE_KEYS)
              return inner_json
         except (json.JSONDecodeError, KeyError):
             # Handle error without printing debug info
@@ -297,8 +283,8 @@ def get_attack_tree_ollama(ollama_endpoint, ollama_model, prompt):
         raise
 
 # Function to get attack tree from Anthropic's Claude model.
-def get_attack_tree_anthropic(anthropic_api_key, anthropic_model, prompt):
-    client = Anthropic(api_key=anthropic_api_key)
+def get_attack_tree_anthropic(anthropic_api_key, anthropic_model, prompt, max_tokens=4096):
+    client = get_anthropic_client(anthropic_api_key)
     
     # Check if we're using extended thinking mode
     is_thinking_mode = "thinking" in anthropic_model.lower()
@@ -315,10 +301,10 @@ def get_attack_tree_anthropic(anthropic_api_key, anthropic_model, prompt):
         if is_thinking_mode:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=24000,
+                max_tokens=THINKING_BUDGET_TOKENS + max_tokens,
                 thinking={
                     "type": "enabled",
-                    "budget_tokens": 16000
+                    "budget_tokens": THINKING_BUDGET_TOKENS
                 },
                 system=system_prompt,
                 messages=[
@@ -326,16 +312,19 @@ def get_attack_tree_anthropic(anthropic_api_key, anthropic_model, prompt):
                 ],
                 timeout=600  # 10-minute timeout
             )
+            record_usage(response)
         else:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=4096,
+                max_tokens=max_tokens,
                 system=system_prompt,
                 messages=[
                     {"role": "user", "content": prompt}
                 ],
-                timeout=300  # 5-minute timeout
+                timeout=300,  # 5-minute timeout
+                **anthropic_tool_kwargs("attack_tree")
             )
+            record_usage(response)
  
         # Try to parse JSON response
         try:
@@ -348,11 +337,11 @@ def get_attack_tree_anthropic(anthropic_api_key, anthropic_model, prompt):
                 if thinking_content:
                     st.session_state['last_thinking_content'] = thinking_content
                      
-                cleaned_response = clean_json_response(text_content)
+                tree_data = parse_json_response(text_content, ATTACK_TREE_KEYS)
             else:
-                cleaned_response = clean_json_response(response.content[0].text)
+                # Outside thinking mode the answer arrives as the forced tool call's input
+                tree_data = parse_json_response(get_anthropic_output(response), ATTACK_TREE_KEYS)
                  
-            tree_data = json.loads(cleaned_response)
             return convert_tree_to_mermaid(tree_data)
         except (json.JSONDecodeError, IndexError, AttributeError):
             # Fallback: try to extract Mermaid code if JSON parsing fails
@@ -360,8 +349,13 @@ def get_attack_tree_anthropic(anthropic_api_key, anthropic_model, prompt):
                 text_content = ''.join(block.text for block in response.content if block.type == "text")
                 return extract_mermaid_code(text_content)
             else:
-                return extract_mermaid_code(response.content[0].text)
+                return extract_mermaid_code(str(get_anthropic_output(response)))
     except Exception as e:
+        # Let retry_policy retry rate limits, timeouts and overloads
+        if is_retryable_error(e):
+            raise
+        # The fallback answer hides the failure from the caller, so record it
+        record_error(e)
         # Handle timeout and other errors
         error_message = str(e)
         st.error(f"Error with Anthropic API: {error_message}")
@@ -380,35 +374,33 @@ graph TD
         return fallback_mermaid
 
 # Function to get attack tree from LM Studio Server response.
-def get_attack_tree_lm_studio(lm_studio_endpoint, model_name, prompt):
-    client = OpenAI(
-        base_url=f"{lm_studio_endpoint}/v1",
-        api_key="not-needed"  # LM Studio Server doesn't require an API key
-    )
+def get_attack_tree_lm_studio(lm_studio_endpoint, model_name, prompt, max_tokens=4000):
+    client = get_lm_studio_client(lm_studio_endpoint)
 
     # Try to get JSON output
     system_prompt = create_json_structure_prompt()
     response = client.chat.completions.create(
         model=model_name,
-        response_format=create_attack_tree_schema_lm_studio(),  # Use LM Studio specific schema
+        response_format=openai_response_format("attack_tree", inline_refs=True),  # LM Studio cannot follow recursive schemas
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Try to parse JSON response
     try:
-        cleaned_response = clean_json_response(response.choices[0].message.content)
-        tree_data = json.loads(cleaned_response)
+        tree_data = parse_json_response(response.choices[0].message.content, ATTACK_TREE_KEYS)
         return convert_tree_to_mermaid(tree_data)
     except json.JSONDecodeError:
         # Fallback: try to extract Mermaid code if JSON parsing fails
         return extract_mermaid_code(response.choices[0].message.content)
 
 # Function to get attack tree from the Groq model's response.
-def get_attack_tree_groq(groq_api_key, groq_model, prompt):
-    client = Groq(api_key=groq_api_key)
+def get_attack_tree_groq(groq_api_key, groq_model, prompt, max_tokens=4000):
+    client = get_groq_client(groq_api_key)
 
     # Try to get JSON output
     system_prompt = create_json_structure_prompt()
@@ -417,8 +409,10 @@ def get_attack_tree_groq(groq_api_key, groq_model, prompt):
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Process the response using our utility function
     reasoning, content = process_groq_response(
@@ -434,150 +428,18 @@ def get_attack_tree_groq(groq_api_key, groq_model, prompt):
 
     # Try to parse JSON response
     try:
-        if isinstance(content, dict):  # If already parsed by process_groq_response
-            tree_data = content
-        else:
-            cleaned_response = clean_json_response(content)
-            tree_data = json.loads(cleaned_response)
+        # content may already have been parsed by process_groq_response
+        tree_data = parse_json_response(content, ATTACK_TREE_KEYS)
         return convert_tree_to_mermaid(tree_data)
     except (json.JSONDecodeError, TypeError):
         # Fallback: try to extract Mermaid code if JSON parsing fails
         return extract_mermaid_code(content)
 
-def create_attack_tree_schema():
-    """
-    Creates a JSON schema for attack tree structure.
-    """
-    return {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "attack_tree",
-            "description": "A structured representation of an attack tree",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "nodes": {
-                        "type": "array",
-                        "items": {
-                            "$ref": "#/$defs/node"
-                        }
-                    }
-                },
-                "$defs": {
-                    "node": {
-                        "type": "object",
-                        "properties": {
-                            "id": {
-                                "type": "string",
-                                "description": "Simple alphanumeric identifier for the node"
-                            },
-                            "label": {
-                                "type": "string",
-                                "description": "Description of the attack vector or goal"
-                            },
-                            "children": {
-                                "type": "array",
-                                "items": {
-                                    "$ref": "#/$defs/node"
-                                }
-                            }
-                        },
-                        "required": ["id", "label", "children"],
-                        "additionalProperties": False
-                    }
-                },
-                "required": ["nodes"],
-                "additionalProperties": False
-            },
-            "strict": True
-        }
-    }
-
-def create_attack_tree_schema_lm_studio():
-    """
-    Creates a non-recursive JSON schema for attack tree structure specifically for LM Studio.
-    Limits the depth to 3 levels to avoid circular references.
-    """
-    return {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "attack_tree",
-            "description": "A structured representation of an attack tree",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "nodes": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "id": {
-                                    "type": "string",
-                                    "description": "Simple alphanumeric identifier for the root node"
-                                },
-                                "label": {
-                                    "type": "string",
-                                    "description": "Description of the attack vector or goal"
-                                },
-                                "children": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "object",
-                                        "properties": {
-                                            "id": {
-                                                "type": "string",
-                                                "description": "Simple alphanumeric identifier for the level 1 node"
-                                            },
-                                            "label": {
-                                                "type": "string",
-                                                "description": "Description of the attack vector or goal"
-                                            },
-                                            "children": {
-                                                "type": "array",
-                                                "items": {
-                                                    "type": "object",
-                                                    "properties": {
-                                                        "id": {
-                                                            "type": "string",
-                                                            "description": "Simple alphanumeric identifier for the leaf node"
-                                                        },
-                                                        "label": {
-                                                            "type": "string",
-                                                            "description": "Description of the attack vector or goal"
-                                                        },
-                                                        "children": {
-                                                            "type": "array",
-                                                            "items": {},
-                                                            "default": []
-                                                        }
-                                                    },
-                                                    "required": ["id", "label", "children"],
-                                                    "additionalProperties": False
-                                                }
-                                            }
-                                        },
-                                        "required": ["id", "label", "children"],
-                                        "additionalProperties": False
-                                    }
-                                }
-                            },
-                            "required": ["id", "label", "children"],
-                            "additionalProperties": False
-                        }
-                    }
-                },
-                "required": ["nodes"],
-                "additionalProperties": False
-            },
-            "strict": True
-        }
-    }
-
 # Function to get attack tree from the Google model's response.
-def get_attack_tree_google(google_api_key, google_model, prompt):
-    genai.configure(api_key=google_api_key)
+def get_attack_tree_google(google_api_key, google_model, prompt, max_tokens=4000):
+    configure_google(google_api_key)
     
-    model = genai.GenerativeModel(google_model)
+    model = genai.GenerativeModel(google_model, generation_config={**gemini_generation_config("attack_tree"), "max_output_tokens": max_tokens})
     
     # Create the system message
     system_message = create_json_structure_prompt()
@@ -600,9 +462,7 @@ def get_attack_tree_google(google_api_key, google_model, prompt):
     response = chat.send_message(prompt, safety_settings=safety_settings)
     
     try:
-        # Clean the response text and try to parse as JSON
-        cleaned_response = clean_json_response(response.text)
-        tree_data = json.loads(cleaned_response)
+        tree_data = parse_json_response(response.text, ATTACK_TREE_KEYS)
         return convert_tree_to_mermaid(tree_data)
     except (json.JSONDecodeError, AttributeError):
         # Fallback: try to extract Mermaid code if JSON parsing fails
@@ -0,0 +1,403 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from clients import get_openai_client, get_anthropic_client
+from threat_model import create_threat_model_prompt, json_to_markdown, THREAT_MODEL_KEYS
+from dread import create_dread_assessment_prompt, dread_json_to_markdown, DREAD_KEYS
+from json_repair import parse_json_response
+from schemas import openai_model_response_format, anthropic_tool_kwargs, get_anthropic_output
+from retry_policy import is_retryable_error
+from prompt_cache import anthropic_content
+from token_budget import plan_request
+from providers import get_provider_config, call_stage
+
+# --------- Offline Batch Mode --------- #
+
+# Threat-models many applications through provider batch APIs, which are cheaper than
+# interactive calls and have separate rate limits, at the cost of results arriving later.
+# Usage: python batch.py applications.json --backend openai --model gpt-4o-mini
+
+BATCH_SYSTEM_PROMPT = "You are a helpful assistant designed to output JSON."
+POLL_INTERVAL_SECONDS = float(os.getenv("LLM_BATCH_POLL_INTERVAL", "60"))
+
+# The application details each entry of the input file provides, as in the Threat Model tab
+APPLICATION_FIELDS = ("app_type", "authentication", "internet_facing", "sensitive_data", "app_input", "operation_environment")
+
+# Top-level keys each batched stage's output must contain
+STAGE_KEYS = {
+    "threat_model": THREAT_MODEL_KEYS,
+    "dread_assessment": DREAD_KEYS,
+}
+
+# Batch statuses reported by poll functions
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# The directory the local backend keeps its jobs in
+LOCAL_BATCH_DIR = os.getenv("LLM_LOCAL_BATCH_DIR", os.path.join(".cache", "batches"))
+
+
+# Function to submit a batch of requests to the OpenAI Batch API
+def submit_openai_batch(requests, settings):
+    client = get_openai_client(settings["credential"])
+    lines = []
+    for request in requests:
+        prompt, max_tokens = plan_request(request["stage"], request["prompt"], {"provider": "OpenAI API", "model": settings["model"]})
+        lines.append(json.dumps({
+            "custom_id": request["custom_id"],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": settings["model"],
+                "response_format": openai_model_response_format(request["stage"], settings["model"]),
+                "messages": [
+                    {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                "max_completion_tokens": max_tokens
+            }
+        }))
+    input_file = client.files.create(file=("batch_input.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    return batch.id
+
+
+# Function to check the status of an OpenAI batch
+def poll_openai_batch(job_id, settings):
+    batch = get_openai_client(settings["credential"]).batches.retrieve(job_id)
+    if batch.status == "completed":
+        return COMPLETED
+    if batch.status in ("failed", "expired", "cancelled"):
+        return FAILED
+    return IN_PROGRESS
+
+
+# Function to download the results of a completed OpenAI batch
+def get_openai_batch_results(job_id, settings):
+    client = get_openai_client(settings["credential"])
+    batch = client.batches.retrieve(job_id)
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            if response.get("status_code") == 200:
+                results[entry["custom_id"]] = {"output": response["body"]["choices"][0]["message"]["content"], "error": None}
+            else:
+                error = entry.get("error") or response.get("body", {}).get("error") or "Request failed"
+                results[entry["custom_id"]] = {"output": None, "error": str(error)}
+    return results
+
+
+# Function to submit a batch of requests to the Anthropic Message Batches API
+def submit_anthropic_batch(requests, settings):
+    client = get_anthropic_client(settings["credential"])
+    params = []
+    for request in requests:
+        prompt, max_tokens = plan_request(request["stage"], request["prompt"], {"provider": "Anthropic API", "model": settings["model"]})
+        params.append({
+            "custom_id": request["custom_id"],
+            "params": {
+                "model": settings["model"],
+                "max_tokens": max_tokens,
+                "system": BATCH_SYSTEM_PROMPT,
+                "messages": [{"role": "user", "content": anthropic_content(prompt)}],
+                **anthropic_tool_kwargs(request["stage"])
+            }
+        })
+    batch = client.messages.batches.create(requests=params)
+    return batch.id
+
+
+# Function to check the status of an Anthropic message batch
+def poll_anthropic_batch(job_id, settings):
+    batch = get_anthropic_client(settings["credential"]).messages.batches.retrieve(job_id)
+    return COMPLETED if batch.processing_status == "ended" else IN_PROGRESS
+
+
+# Function to download the results of a completed Anthropic message batch
+def get_anthropic_batch_results(job_id, settings):
+    results = {}
+    for entry in get_anthropic_client(settings["credential"]).messages.batches.results(job_id):
+        if entry.result.type == "succeeded":
+            results[entry.custom_id] = {"output": get_anthropic_output(entry.result.message), "error": None}
+        else:
+            error = getattr(entry.result, "error", None) or entry.result.type
+            results[entry.custom_id] = {"output": None, "error": str(error)}
+    return results
+
+
+def _local_job_dir(job_id):
+    return os.path.join(LOCAL_BATCH_DIR, job_id)
+
+
+# Function to queue a batch in the local stand-in backend
+def submit_local_batch(requests, settings):
+    job_id = f"local_{uuid.uuid4().hex}"
+    os.makedirs(_local_job_dir(job_id), exist_ok=True)
+    with open(os.path.join(_local_job_dir(job_id), "requests.jsonl"), "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request) + "\n")
+    return job_id
+
+
+# Function to run a queued local batch. The stand-in processes the whole batch on the first poll,
+# one request at a time, through the interactive provider configured in settings.
+def poll_local_batch(job_id, settings):
+    results_path = os.path.join(_local_job_dir(job_id), "results.jsonl")
+    if os.path.exists(results_path):
+        return COMPLETED
+
+    session_state = {
+        "selected_model": settings["model"],
+        "ollama_endpoint": settings.get("endpoint") or os.getenv("OLLAMA_ENDPOINT", "http://localhost:11434"),
+        "lm_studio_endpoint": settings.get("endpoint") or os.getenv("LM_STUDIO_ENDPOINT", "http://localhost:1234"),
+    }
+    config = get_provider_config(settings["provider"], session_state, include_fallback=False)
+
+    with open(os.path.join(_local_job_dir(job_id), "requests.jsonl"), encoding="utf-8") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    # Write to a temporary file so an interrupted run is not mistaken for a completed one
+    with open(results_path + ".tmp", "w", encoding="utf-8") as f:
+        for request in requests:
+            try:
+                result = {"output": call_stage(request["stage"], request["prompt"], config), "error": None}
+            except Exception as e:
+                result = {"output": None, "error": str(e)}
+            f.write(json.dumps({"custom_id": request["custom_id"], **result}) + "\n")
+    os.replace(results_path + ".tmp", results_path)
+    return COMPLETED
+
+
+# Function to read the results of a completed local batch
+def get_local_batch_results(job_id, settings):
+    results = {}
+    with open(os.path.join(_local_job_dir(job_id), "results.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                results[entry["custom_id"]] = {"output": entry["output"], "error": entry["error"]}
+    return results
+
+
+# The submit, poll and result functions of each batch backend
+BATCH_BACKENDS = {
+    "openai": {"submit": submit_openai_batch, "poll": poll_openai_batch, "results": get_openai_batch_results},
+    "anthropic": {"submit": submit_anthropic_batch, "poll": poll_anthropic_batch, "results": get_anthropic_batch_results},
+    "local": {"submit": submit_local_batch, "poll": poll_local_batch, "results": get_local_batch_results},
+}
+
+
+def load_applications(path):
+    """
+    Load the applications to threat-model from a JSON list or a JSON Lines file.
+
+    Args:
+        path (str): The input file. Each entry has the APPLICATION_FIELDS and optionally a 'name'.
+
+    Returns:
+        list: The application dicts
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        applications = json.loads(text)
+    else:
+        applications = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for index, application in enumerate(applications):
+        missing = [field for field in APPLICATION_FIELDS if field not in application]
+        if missing:
+            raise ValueError(f"Application {index} in {path} is missing {', '.join(missing)}")
+    return applications
+
+
+def _load_state(output_dir):
+    path = os.path.join(output_dir, "batch_state.json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(output_dir, state):
+    path = os.path.join(output_dir, "batch_state.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _requests_hash(requests):
+    return hashlib.sha256(json.dumps(requests, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def run_stage_batch(stage, prompts, settings, state, output_dir, poll_interval=POLL_INTERVAL_SECONDS):
+    """
+    Submit one stage's prompts as a batch job (or resume the job recorded in state for the same
+    backend, model and prompts), wait for it to finish and parse the results.
+
+    Args:
+        stage (str): The pipeline stage, a key of STAGE_KEYS
+        prompts (dict): Maps application index to prompt
+        settings (dict): The backend, model, credential and, for the local backend, provider and endpoint
+        state (dict): The run's saved state, updated in place and written to output_dir
+        output_dir (str): Where the run's state is kept
+        poll_interval (float): Seconds between status checks
+
+    Returns:
+        dict: Maps application index to the parsed output, or to an error message (str)
+    """
+    backend = BATCH_BACKENDS[settings["backend"]]
+    # custom_ids must match ^[a-zA-Z0-9_-]{1,64}$ for Anthropic
+    requests = [{"custom_id": f"{stage}-{index}", "stage": stage, "prompt": prompt} for index, prompt in prompts.items()]
+
+    requests_hash = _requests_hash(requests)
+    job = state.get(stage)
+    if job is None or (job["backend"], job.get("model"), job.get("requests_hash")) != (settings["backend"], settings["model"], requests_hash):
+        job = {
+            "backend": settings["backend"],
+            "model": settings["model"],
+            "requests_hash": requests_hash,
+            "job_id": backend["submit"](requests, settings),
+        }
+        state[stage] = job
+        _save_state(output_dir, state)
+        print(f"Submitted {len(requests)} {stage} requests as batch {job['job_id']}")
+    else:
+        print(f"Resuming {stage} batch {job['job_id']}")
+
+    while True:
+        try:
+            status = backend["poll"](job["job_id"], settings)
+        except Exception as e:
+            if not is_retryable_error(e):
+                raise
+            status = IN_PROGRESS
+        if status == COMPLETED:
+            break
+        if status == FAILED:
+            # Submit a new batch when the run is started again
+            del state[stage]
+            _save_state(output_dir, state)
+            raise RuntimeError(f"{stage} batch {job['job_id']} failed")
+        time.sleep(poll_interval)
+
+    outputs = {}
+    results = backend["results"](job["job_id"], settings)
+    for index in prompts:
+        result = results.get(f"{stage}-{index}")
+        if result is None:
+            outputs[index] = "No result returned"
+        elif result["error"] is not None:
+            outputs[index] = result["error"]
+        else:
+            try:
+                outputs[index] = parse_json_response(result["output"], STAGE_KEYS[stage], stage)
+            except json.JSONDecodeError as e:
+                outputs[index] = f"Could not parse the model's output: {e}"
+    return outputs
+
+
+def _report_filename(application, index):
+    # Prefixed with the index, since different names can reduce to the same slug
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "-", application.get("name") or "").strip("-.")
+    return f"{index:03d}-{slug}.md" if slug else f"application-{index}.md"
+
+
+def run_batch(applications, settings, output_dir, include_dread=True, poll_interval=POLL_INTERVAL_SECONDS):
+    """
+    Threat-model every application (and optionally assess the threats with DREAD) through a
+    batch backend, writing one Markdown report per application to output_dir. Interrupted runs
+    resume their submitted batches when started again with the same output_dir.
+
+    Args:
+        applications (list): Application dicts from load_applications()
+        settings (dict): The backend, model, credential and, for the local backend, provider and endpoint
+        output_dir (str): Where reports and the run's state are written
+        include_dread (bool): Whether to run the DREAD assessment batch after the threat models
+        poll_interval (float): Seconds between status checks
+
+    Returns:
+        dict: Number of reports written and of applications whose threat model failed
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state = _load_state(output_dir)
+
+    prompts = {
+        str(index): create_threat_model_prompt(*(application[field] for field in APPLICATION_FIELDS))
+        for index, application in enumerate(applications)
+    }
+    threat_models = run_stage_batch("threat_model", prompts, settings, state, output_dir, poll_interval)
+
+    dread_assessments = {}
+    if include_dread:
+        dread_prompts = {
+            index: create_dread_assessment_prompt(json_to_markdown(threat_model["threat_model"], []))
+            for index, threat_model in threat_models.items()
+            if isinstance(threat_model, dict)
+        }
+        if dread_prompts:
+            dread_assessments = run_stage_batch("dread_assessment", dread_prompts, settings, state, output_dir, poll_interval)
+
+    failures = 0
+    for index, application in enumerate(applications):
+        threat_model = threat_models[str(index)]
+        title = application.get("name") or f"Application {index}"
+        report = f"# {title}\n\n"
+        if isinstance(threat_model, dict):
+            report += json_to_markdown(threat_model["threat_model"], threat_model.get("improvement_suggestions", []))
+        else:
+            failures += 1
+            report += f"Threat model generation failed: {threat_model}\n"
+        dread_assessment = dread_assessments.get(str(index))
+        if isinstance(dread_assessment, dict):
+            report += "\n## DREAD Risk Assessment\n\n" + dread_json_to_markdown(dread_assessment)
+        elif dread_assessment is not None:
+            report += f"\nDREAD assessment failed: {dread_assessment}\n"
+        with open(os.path.join(output_dir, _report_filename(application, index)), "w", encoding="utf-8") as f:
+            f.write(report)
+
+    return {"reports": len(applications), "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Threat-model many applications through provider batch APIs.")
+    parser.add_argument("applications", help="JSON list or JSON Lines file of applications with the fields " + ", ".join(APPLICATION_FIELDS))
+    parser.add_argument("--backend", choices=sorted(BATCH_BACKENDS), default="openai", help="Batch API to use; 'local' runs the batch through an interactive provider")
+    parser.add_argument("--model", required=True, help="Model to use")
+    parser.add_argument("--provider", default="Ollama", help="Provider the local backend calls, as named in the sidebar (default: Ollama)")
+    parser.add_argument("--endpoint", help="Endpoint of the local backend's provider")
+    parser.add_argument("--output-dir", default="batch_output", help="Where reports and the run's state are written")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL_SECONDS, help="Seconds between status checks")
+    parser.add_argument("--skip-dread", action="store_true", help="Only generate threat models")
+    args = parser.parse_args()
+
+    load_dotenv(".env")
+    credentials = {"openai": os.getenv("OPENAI_API_KEY"), "anthropic": os.getenv("ANTHROPIC_API_KEY")}
+    settings = {
+        "backend": args.backend,
+        "model": args.model,
+        "credential": credentials.get(args.backend),
+        "provider": args.provider,
+        "endpoint": args.endpoint,
+    }
+    if args.backend in credentials and not settings["credential"]:
+        parser.error(f"Set {args.backend.upper()}_API_KEY to use the {args.backend} backend")
+
+    summary = run_batch(load_applications(args.applications), settings, args.output_dir, not args.skip_dread, args.poll_interval)
+    print(f"Wrote {summary['reports']} reports to {args.output_dir} ({summary['failures']} failed)")
+
+
+if __name__ == "__main__":
+    main()
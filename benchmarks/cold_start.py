@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# --------- Cold Start Benchmark --------- #
+
+# Measures how long a fresh Python process takes to start the app and render its first page,
+# and which heavy libraries that first render loads. Compare against an earlier revision with
+# --baseline, e.g.:
+#   python benchmarks/cold_start.py --baseline HEAD~1
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries the app only needs for one provider, the GitHub analysis or the PDF export
+HEAVY_MODULES = ("anthropic", "openai", "mistralai", "groq", "google.generativeai", "github", "tiktoken", "weasyprint", "markdown")
+
+# Runs in a fresh interpreter inside the checkout being measured and prints one JSON line
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+streamlit_loaded = time.perf_counter()
+app = AppTest.from_file("main.py", default_timeout=120)
+app.run()
+rendered = time.perf_counter()
+print(json.dumps({
+    "streamlit_import": streamlit_loaded - started,
+    "first_render": rendered - streamlit_loaded,
+    "exceptions": [str(e.value) for e in app.exception],
+    "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+}))
+"""
+
+
+def run_probe(repo_dir):
+    """
+    Start the app once in a new process.
+
+    Args:
+        repo_dir (str): The checkout to run main.py from
+
+    Returns:
+        dict: Seconds to import Streamlit and to render the first page, total process time,
+              script exceptions, and the heavy modules loaded by the first render
+    """
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n{PROBE}"
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=repo_dir, capture_output=True, text=True, check=True)
+    total = time.perf_counter() - started
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample["total"] = total
+    return sample
+
+
+def measure(repo_dir, runs):
+    """
+    Run the probe several times and summarise it.
+
+    Args:
+        repo_dir (str): The checkout to measure
+        runs (int): How many fresh processes to start
+
+    Returns:
+        dict: Median timings in seconds, plus the exceptions and heavy modules of the last run
+    """
+    samples = [run_probe(repo_dir) for _ in range(runs)]
+    summary = {key: statistics.median(sample[key] for sample in samples) for key in ("total", "streamlit_import", "first_render")}
+    summary["exceptions"] = samples[-1]["exceptions"]
+    summary["heavy_modules"] = samples[-1]["heavy_modules"]
+    return summary
+
+
+def print_summary(label, summary):
+    print(f"{label}:")
+    print(f"  cold start (process start to first render): {summary['total']:.2f}s")
+    print(f"  streamlit import:                           {summary['streamlit_import']:.2f}s")
+    print(f"  first render of main.py:                    {summary['first_render']:.2f}s")
+    print(f"  heavy modules loaded: {', '.join(summary['heavy_modules']) or 'none'}")
+    if summary["exceptions"]:
+        print(f"  script exceptions: {summary['exceptions']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the app's cold start and first render time.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes to start per revision (default: 5)")
+    parser.add_argument("--baseline", help="Git revision to measure as well, for comparison (e.g. HEAD~1)")
+    args = parser.parse_args()
+
+    current = measure(REPO_DIR, args.runs)
+    print_summary("Working tree", current)
+
+    if args.baseline:
+        worktree = tempfile.mkdtemp(prefix="cold_start_")
+        try:
+            subprocess.run(["git", "worktree", "add", "--detach", worktree, args.baseline], cwd=REPO_DIR, capture_output=True, check=True)
+            baseline = measure(worktree, args.runs)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=REPO_DIR, capture_output=True)
+            shutil.rmtree(worktree, ignore_errors=True)
+        print_summary(f"Baseline ({args.baseline})", baseline)
+        print(f"Cold start: {baseline['total']:.2f}s -> {current['total']:.2f}s, "
+              f"first render: {baseline['first_render']:.2f}s -> {current['first_render']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
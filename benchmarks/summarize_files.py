@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import queue
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# --------- File Summary Benchmark --------- #
+
+# Measures how much CPU time summarize_file spends per file of a repository, on a corpus of
+# generated files: large but ordinary source files in each summarized language, and
+# pathological ones (minified code, very long lines and long runs of whitespace) that make
+# backtracking regular expressions slow. A directory of real code can be added with --corpus.
+# Compare against an earlier revision with --baseline, e.g.:
+#   python benchmarks/summarize_files.py --baseline HEAD~1
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CODE_EXTENSIONS = ('.py', '.js', '.ts', '.java', '.go', '.c', '.cpp', '.cs')
+
+# Runs in a fresh interpreter inside the checkout being measured. Reads one path per line and
+# prints one JSON line per file once it is summarized.
+PROBE = """
+import json, sys, time
+from repo_analysis import summarize_file
+for line in sys.stdin:
+    path = line.rstrip("\\n")
+    with open(path, encoding="utf-8", errors="replace") as f:
+        content = f.read()
+    started = time.perf_counter()
+    summarize_file(path, content)
+    print(json.dumps({"seconds": time.perf_counter() - started}), flush=True)
+"""
+
+
+def generate_corpus(directory, scale):
+    """
+    Write the generated files.
+
+    Args:
+        directory (str): Where to write them
+        scale (int): Roughly the number of declarations per ordinary file
+
+    Returns:
+        list: The paths written
+    """
+    rng = random.Random(0)
+    names = [f"name{i}" for i in range(scale)]
+    files = {
+        "large.py": "import os\nfrom typing import List\n\n" + "".join(
+            f"class Model{i}(Base):\n    def method_{i}(self, value: int = {i}) -> List[int]:\n        return [value] * {i}\n\n\n"
+            f"def function_{i}(a, b, *args, **kwargs):\n    return a + b\n\n\n" for i in range(scale)),
+        "large.js": "const fs = require('fs');\nimport x from 'y';\n" + "".join(
+            f"function {name}(a, b) {{\n  return a + b;\n}}\nconst arrow_{name} = (a) => a * 2;\n" for name in names),
+        "large.ts": "".join(
+            f"export class C{i} {{\n  method{i}(value: number): number {{\n    return value;\n  }}\n}}\n" for i in range(scale)),
+        "Large.java": "import java.util.List;\n" + "".join(
+            f"public class C{i} {{\n    public static List<String> method{i}(int a, String b) {{\n        return null;\n    }}\n}}\n" for i in range(scale)),
+        "large.go": "import (\n\t\"fmt\"\n)\n" + "".join(
+            f"func {name}(a int) int {{\n\treturn a\n}}\n" for name in names),
+        "large.c": "".join(
+            f"static int {name}(int a, char *b)\n{{\n    return a;\n}}\n" for name in names),
+        # A bundle on one line, as shipped in dist/ directories
+        "minified.js": "".join(f"var {name}=function(a){{return a}};obj={{k{i}: function(b){{return b}}}};" for i, name in enumerate(names * 20)),
+        # Long declarations that never close their parenthesis
+        "long_lines.java": "".join("public static int f" + "(int a, " * 100 + "\n" for _ in range(scale)),
+        # Long runs of whitespace between words
+        "whitespace.cs": "".join("static" + " " * 3000 + "x\n" for _ in range(scale // 10)),
+        # Deeply nested calls on long lines
+        "nested.c": "".join("int main(" + "f(" * 500 + ")" * 500 + "\n" for _ in range(scale // 10)),
+        "random.cpp": "".join(
+            " ".join(rng.choice(("static", "int", "(", "x", "<T>", "::", "{", "}", " ")) for _ in range(rng.randint(1, 400))) + "\n"
+            for _ in range(scale)),
+    }
+    paths = []
+    for name, content in files.items():
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        paths.append(path)
+    return paths
+
+
+def collect_corpus(directory, limit):
+    """
+    Args:
+        directory (str): A directory of real code
+        limit (int): The most files to take
+
+    Returns:
+        list: Paths of up to limit code files under the directory
+    """
+    paths = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        paths.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(CODE_EXTENSIONS))
+        if len(paths) >= limit:
+            break
+    return paths[:limit]
+
+
+def _write_paths(stream, paths):
+    try:
+        stream.write("".join(path + "\n" for path in paths))
+        stream.close()
+    except (BrokenPipeError, ValueError):
+        # The probe was restarted
+        pass
+
+
+def _read_lines(stream, lines):
+    # Pass the probe's output on, then None when it exits
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+def run_probe(repo_dir, paths, file_timeout):
+    """
+    Summarize the files in a new process, restarting it when one file takes too long.
+
+    Args:
+        repo_dir (str): The checkout to import repo_analysis from
+        paths (list): The files to summarize
+        file_timeout (float): Seconds after which a file counts as stalled
+
+    Returns:
+        dict: path -> seconds, or None for files that stalled
+    """
+    timings = {}
+    pending = list(paths)
+    while pending:
+        process = subprocess.Popen([sys.executable, "-c", PROBE], cwd=repo_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        # Written from a thread, since a stalled probe stops reading its input
+        threading.Thread(target=_write_paths, args=(process.stdin, list(pending)), daemon=True).start()
+        lines = queue.Queue()
+        threading.Thread(target=_read_lines, args=(process.stdout, lines), daemon=True).start()
+        while pending:
+            try:
+                line = lines.get(timeout=file_timeout)
+            except queue.Empty:
+                line = None
+            if line is None:
+                # Stalled (or crashed) on the next file: skip it and start a new process
+                timings[pending.pop(0)] = None
+                break
+            # The probe handles the files in order
+            timings[pending.pop(0)] = json.loads(line)["seconds"]
+        process.kill()
+        process.wait()
+    return timings
+
+
+def print_summary(label, timings, file_timeout):
+    finished = [seconds for seconds in timings.values() if seconds is not None]
+    stalled = [path for path, seconds in timings.items() if seconds is None]
+    print(f"{label}:")
+    print(f"  files summarized: {len(finished)} of {len(timings)}")
+    if finished:
+        print(f"  total:  {sum(finished):.3f}s")
+        print(f"  median: {statistics.median(finished) * 1000:.2f}ms per file")
+        slowest = max((path for path in timings if timings[path] is not None), key=timings.get)
+        print(f"  slowest: {timings[slowest]:.3f}s ({os.path.basename(slowest)})")
+    for path in stalled:
+        print(f"  stalled for over {file_timeout}s: {os.path.basename(path)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the CPU time of summarizing repository files.")
+    parser.add_argument("--corpus", help="Directory of real code to summarize as well")
+    parser.add_argument("--limit", type=int, default=2000, help="Files to take from --corpus at most (default: 2000)")
+    parser.add_argument("--scale", type=int, default=2000, help="Declarations per generated file (default: 2000)")
+    parser.add_argument("--file-timeout", type=float, default=10, help="Seconds after which a file counts as stalled (default: 10)")
+    parser.add_argument("--baseline", help="Git revision to measure as well, for comparison (e.g. HEAD~1)")
+    args = parser.parse_args()
+
+    corpus_dir = tempfile.mkdtemp(prefix="summarize_corpus_")
+    try:
+        paths = generate_corpus(corpus_dir, args.scale)
+        if args.corpus:
+            paths += collect_corpus(args.corpus, args.limit)
+
+        current = run_probe(REPO_DIR, paths, args.file_timeout)
+        print_summary("Working tree", current, args.file_timeout)
+
+        if args.baseline:
+            worktree = tempfile.mkdtemp(prefix="summarize_files_")
+            try:
+                subprocess.run(["git", "worktree", "add", "--detach", worktree, args.baseline], cwd=REPO_DIR, capture_output=True, check=True)
+                baseline = run_probe(worktree, paths, args.file_timeout)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=REPO_DIR, capture_output=True)
+                shutil.rmtree(worktree, ignore_errors=True)
+            print_summary(f"Baseline ({args.baseline})", baseline, args.file_timeout)
+    finally:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
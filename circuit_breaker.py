@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+
+from clients import credential_fingerprint
+from retry_policy import is_retryable_error, EmptyResponseError
+
+# --------- Circuit Breaker --------- #
+
+# Consecutive failures (errors or slow responses) that open a provider's circuit
+FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+# Seconds an open circuit rejects calls before letting a trial call through
+COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+# Calls (or time to first token for streams) slower than this count as failures
+SLOW_CALL_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "120"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_circuits = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+
+def is_upstream_failure(error):
+    """
+    Check whether an error points at an unhealthy provider (rate limits, timeouts, server errors,
+    open circuits) rather than at the request or the model's output.
+
+    Args:
+        error (Exception): The error raised by a provider call
+
+    Returns:
+        bool: True if the error should count against the provider, or trigger a failover
+    """
+    if isinstance(error, CircuitOpenError):
+        return True
+    if isinstance(error, (json.JSONDecodeError, EmptyResponseError)):
+        return False
+    return is_retryable_error(error)
+
+
+def _circuit_key(config):
+    namespace = credential_fingerprint(config["credential"]) if config.get("credential") else config.get("endpoint") or ""
+    return (config["provider"], config["model"], namespace)
+
+
+def _get_circuit(key):
+    circuit = _circuits.get(key)
+    if circuit is None:
+        circuit = {"state": CLOSED, "failures": 0, "opened_at": 0.0, "trial_in_flight": False}
+        _circuits[key] = circuit
+    return circuit
+
+
+def before_call(config):
+    """
+    Check that a provider may be called.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+
+    Raises:
+        CircuitOpenError: If the circuit is open, or half-open with a trial call already running
+    """
+    with _lock:
+        circuit = _get_circuit(_circuit_key(config))
+        if circuit["state"] == OPEN:
+            remaining = COOLDOWN_SECONDS - (time.monotonic() - circuit["opened_at"])
+            if remaining > 0:
+                raise CircuitOpenError(f"{config['provider']} ({config['model']}) is unavailable after repeated failures; retrying in {remaining:.0f}s")
+            circuit["state"] = HALF_OPEN
+            circuit["trial_in_flight"] = False
+        if circuit["state"] == HALF_OPEN:
+            if circuit["trial_in_flight"]:
+                raise CircuitOpenError(f"{config['provider']} ({config['model']}) is being tested after repeated failures")
+            circuit["trial_in_flight"] = True
+
+
+def record_success(config, elapsed):
+    """
+    Record a completed call. Calls slower than SLOW_CALL_SECONDS count as failures.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        elapsed (float): Seconds the call took (time to first token for streams)
+    """
+    if elapsed > SLOW_CALL_SECONDS:
+        record_failure(config)
+        return
+    with _lock:
+        circuit = _get_circuit(_circuit_key(config))
+        circuit.update(state=CLOSED, failures=0, trial_in_flight=False)
+
+
+def record_failure(config, error=None):
+    """
+    Record a failed call. Only errors that point at an unhealthy upstream (see
+    is_upstream_failure) count; e.g. a wrong API key does not open the circuit.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        error (Exception): The error raised by the call, or None for a slow call
+    """
+    with _lock:
+        circuit = _get_circuit(_circuit_key(config))
+        if error is not None and not is_upstream_failure(error):
+            # The provider answered, so as far as availability goes this call succeeded
+            circuit.update(state=CLOSED, failures=0, trial_in_flight=False)
+            return
+        circuit["failures"] += 1
+        circuit["trial_in_flight"] = False
+        if circuit["state"] == HALF_OPEN or circuit["failures"] >= FAILURE_THRESHOLD:
+            circuit["state"] = OPEN
+            circuit["opened_at"] = time.monotonic()
+
+
+def release_trial(config):
+    """
+    Let another trial call through after one was interrupted (e.g. by a Streamlit rerun)
+    before it had an outcome. Nothing is recorded against the provider.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+    """
+    with _lock:
+        _get_circuit(_circuit_key(config))["trial_in_flight"] = False
+
+
+def guarded_call(config, func):
+    """
+    Call a provider through its circuit breaker.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        func (callable): Makes the provider call
+
+    Returns:
+        The result of func
+
+    Raises:
+        CircuitOpenError: If the circuit is open
+    """
+    before_call(config)
+    started = time.monotonic()
+    try:
+        result = func()
+    except Exception as e:
+        record_failure(config, e)
+        raise
+    except BaseException:
+        # Streamlit's RerunException and StopException are not Exceptions
+        release_trial(config)
+        raise
+    record_success(config, time.monotonic() - started)
+    return result
+
+
+def guarded_stream(config, open_stream):
+    """
+    Streaming counterpart of guarded_call(): the outcome is recorded when the first event arrives.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        open_stream (callable): Returns a new iterator of (kind, text) events
+
+    Yields:
+        tuple: The stream's (kind, text) events
+    """
+    before_call(config)
+    started = time.monotonic()
+    try:
+        events = iter(open_stream())
+        first_event = next(events)
+    except StopIteration:
+        record_success(config, time.monotonic() - started)
+        return
+    except Exception as e:
+        record_failure(config, e)
+        raise
+    except BaseException:
+        # Streamlit's RerunException and StopException are not Exceptions
+        release_trial(config)
+        raise
+    record_success(config, time.monotonic() - started)
+    yield first_event
+    yield from events
+
+
+def get_open_circuits():
+    """
+    Returns:
+        list: (provider, model, seconds until a trial call is allowed) for every circuit that is not closed
+    """
+    now = time.monotonic()
+    with _lock:
+        return [
+            (provider, model, max(0.0, COOLDOWN_SECONDS - (now - circuit["opened_at"])))
+            for (provider, model, _), circuit in _circuits.items()
+            if circuit["state"] != CLOSED
+        ]
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from lazy_imports import lazy_import
+
+# Provider SDKs are imported when the first client is created (see lazy_imports)
+httpx = lazy_import("httpx")
+anthropic = lazy_import("anthropic")
+mistralai = lazy_import("mistralai")
+openai = lazy_import("openai")
+groq = lazy_import("groq")
+genai = lazy_import("google.generativeai")
+
+# --------- Shared Provider Clients --------- #
+
+# Connection pool sizing for every provider client. These can be tuned with environment
+# variables when many Streamlit sessions share one process.
+POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "10"))
+POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+
+# The SDKs' built-in retries are disabled (max_retries=0) because retry_policy retries
+# every provider call with shared rate limits instead.
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+_http_session = None
+_google_api_key_fingerprint = None
+
+
+def credential_fingerprint(credential):
+    """
+    Create a short, non-reversible fingerprint of a credential so it can be used in cache keys
+    without keeping the raw secret around.
+
+    Args:
+        credential (str): The API key or other secret
+
+    Returns:
+        str: A hex digest identifying the credential, or an empty string if there is none
+    """
+    if not credential:
+        return ""
+    return hashlib.sha256(credential.encode("utf-8")).hexdigest()[:16]
+
+
+def _httpx_limits():
+    return httpx.Limits(
+        max_connections=POOL_MAXSIZE,
+        max_keepalive_connections=POOL_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_or_create_client(provider, endpoint, credential, factory):
+    """
+    Return the process-wide client for (provider, endpoint, credential), creating it on first use.
+
+    Args:
+        provider (str): The provider name, e.g. 'openai'
+        endpoint (str): The base URL of the API, or None for the provider default
+        credential (str): The credential used to authenticate
+        factory (callable): Zero-argument callable that builds a new client
+
+    Returns:
+        The cached client instance
+    """
+    key = (provider, endpoint or "", credential_fingerprint(credential))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+    return client
+
+
+def get_openai_client(api_key, base_url=None):
+    return _get_or_create_client(
+        "openai", base_url, api_key,
+        lambda: openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=openai.DefaultHttpxClient(limits=_httpx_limits()))
+    )
+
+
+def get_lm_studio_client(lm_studio_endpoint):
+    # LM Studio Server doesn't require an API key
+    return get_openai_client("not-needed", base_url=f"{lm_studio_endpoint}/v1")
+
+
+def get_azure_openai_client(azure_api_endpoint, azure_api_key, azure_api_version):
+    return _get_or_create_client(
+        "azure", f"{azure_api_endpoint}#{azure_api_version}", azure_api_key,
+        lambda: openai.AzureOpenAI(
+            azure_endpoint=azure_api_endpoint,
+            api_key=azure_api_key,
+            api_version=azure_api_version,
+            max_retries=0,
+            http_client=openai.DefaultHttpxClient(limits=_httpx_limits()),
+        )
+    )
+
+
+def get_anthropic_client(anthropic_api_key):
+    return _get_or_create_client(
+        "anthropic", None, anthropic_api_key,
+        lambda: anthropic.Anthropic(api_key=anthropic_api_key, max_retries=0, http_client=anthropic.DefaultHttpxClient(limits=_httpx_limits()))
+    )
+
+
+def get_mistral_client(mistral_api_key):
+    return _get_or_create_client(
+        "mistral", None, mistral_api_key,
+        lambda: mistralai.Mistral(api_key=mistral_api_key, client=httpx.Client(limits=_httpx_limits(), follow_redirects=True))
+    )
+
+
+def get_groq_client(groq_api_key):
+    return _get_or_create_client(
+        "groq", None, groq_api_key,
+        lambda: groq.Groq(api_key=groq_api_key, max_retries=0, http_client=groq.DefaultHttpxClient(limits=_httpx_limits()))
+    )
+
+
+def get_http_session():
+    """
+    Get the shared requests session used for plain HTTP calls (Ollama, image analysis).
+    The session keeps connections alive between calls and across pipeline stages.
+
+    Returns:
+        requests.Session: The process-wide session
+    """
+    global _http_session
+    with _clients_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+    return _http_session
+
+
+def configure_google(google_api_key):
+    """
+    Configure the Google AI SDK, only resetting its clients when the API key changes.
+    genai.configure() discards the SDK's cached clients, so calling it before every request
+    throws away warm connections.
+
+    Args:
+        google_api_key (str): The Google AI API key
+    """
+    global _google_api_key_fingerprint
+    fingerprint = credential_fingerprint(google_api_key)
+    with _clients_lock:
+        if fingerprint != _google_api_key_fingerprint:
+            genai.configure(api_key=google_api_key)
+            _google_api_key_fingerprint = fingerprint
@@ -0,0 +1,132 @@
+import asyncio
+import functools
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# --------- Concurrent Provider Calls --------- #
+
+# Upper bound on blocking provider calls running at the same time in this process.
+MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+_call_slots = threading.BoundedSemaphore(MAX_CONCURRENT_CALLS)
+
+
+def start_thread(target, *args, **kwargs):
+    """
+    Start a daemon thread that can use Streamlit APIs on behalf of the current script run.
+    Provider functions write to st.session_state and render expanders, which only works from
+    threads that carry the session's ScriptRunContext.
+
+    Args:
+        target (callable): The function to run
+        *args, **kwargs: Arguments passed to the function
+
+    Returns:
+        threading.Thread: The started thread
+    """
+    thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is not None:
+        add_script_run_ctx(thread, ctx)
+    thread.start()
+    return thread
+
+
+def make_async(func):
+    """
+    Create an async variant of a blocking function, such as providers.call_stage().
+    The call runs on its own thread (bounded by MAX_CONCURRENT_CALLS) so that several
+    SDK requests can be in flight at once while the event loop waits on all of them.
+
+    Args:
+        func (callable): The blocking function to wrap
+
+    Returns:
+        callable: A coroutine function with the same signature
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run():
+            result, error = None, None
+            with _call_slots:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    error = e
+            try:
+                loop.call_soon_threadsafe(resolve, result, error)
+            except RuntimeError:
+                # The event loop has already been closed, nobody is waiting for the result
+                pass
+
+        start_thread(run)
+        return await future
+
+    return wrapper
+
+
+def run_async(coro):
+    """
+    Run a coroutine to completion from synchronous code such as the Streamlit script.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        The coroutine's result
+    """
+    return asyncio.run(coro)
+
+
+def map_ordered(func, items, max_workers):
+    """
+    Apply a blocking function to items on a pool of threads, yielding the results in the order
+    of the items. Only a window of items ahead of the consumer is in flight, so a consumer that
+    stops early (e.g. when a token budget is used up) does not pay for the rest; closing the
+    generator cancels the calls that have not started.
+
+    Args:
+        func (callable): Called with one item
+        items (iterable): The inputs, in the order the results are wanted
+        max_workers (int): The maximum number of calls running at the same time
+
+    Yields:
+        tuple: (item, result, error) where error is the exception func raised, or None
+    """
+    items = iter(items)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit_next():
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            return
+
+    try:
+        # Keep the workers busy while the consumer handles the oldest result
+        for _ in range(max_workers * 2):
+            submit_next()
+        while pending:
+            item, future = pending.popleft()
+            submit_next()
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
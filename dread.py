@@ -1,15 +1,23 @@
 import json
 import requests
-import time
-from anthropic import Anthropic
-from mistralai import Mistral, UserMessage
-from openai import OpenAI, AzureOpenAI
-import re
 import streamlit as st
 
-import google.generativeai as genai
-from groq import Groq
 from utils import process_groq_response, create_reasoning_system_prompt
+from clients import get_openai_client, get_azure_openai_client, get_anthropic_client, get_mistral_client, get_groq_client, get_lm_studio_client, get_http_session, configure_google
+from local_models import ollama_request_fields
+from token_budget import THINKING_BUDGET_TOKENS
+from prompt_cache import register_static_prefix, anthropic_content, record_usage
+from retry_policy import is_retryable_error
+from instrumentation import record_error
+from json_repair import parse_json_response
+from schemas import openai_model_response_format, openai_response_format, azure_response_format, anthropic_tool_kwargs, get_anthropic_output, gemini_generation_config, ollama_format
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
+mistralai = lazy_import("mistralai")
+
+# Top-level keys every DREAD assessment response must contain
+DREAD_KEYS = ("Risk Assessment",)
 
 def dread_json_to_markdown(dread_assessment):
     # Create a clean Markdown table with proper spacing
@@ -62,13 +70,11 @@ def dread_json_to_markdown(dread_assessment):
     return markdown_output
 
 
-# Function to create a prompt to generate mitigating controls
-def create_dread_assessment_prompt(threats):
-    prompt = f"""
+# Static instructions every DREAD prompt starts with; the threats follow them so providers
+# can cache this prefix
+DREAD_INSTRUCTIONS = register_static_prefix("""
 Act as a cyber security expert with more than 20 years of experience in threat modeling using STRIDE and DREAD methodologies.
 Your task is to produce a DREAD risk assessment for the threats identified in a threat model.
-Below is the list of identified threats:
-{threats}
 When providing the risk assessment, use a JSON formatted response with a top-level key "Risk Assessment" and a list of threats, each with the following sub-keys:
 - "Threat Type": A string representing the type of threat (e.g., "Spoofing").
 - "Scenario": A string describing the threat scenario.
@@ -82,9 +88,9 @@ Assign a value between 1 and 10 for each sub-key based on the DREAD methodology.
 - 4-6: Medium
 - 7-10: High
 Ensure the JSON response is correctly formatted and does not contain any additional text. Here is an example of the expected JSON response format:
-{{
+{
   "Risk Assessment": [
-    {{
+    {
       "Threat Type": "Spoofing",
       "Scenario": "An attacker could create a fake OAuth2 provider and trick users into logging in through it.",
       "Damage Potential": 8,
@@ -92,8 +98,8 @@ Ensure the JSON response is correctly formatted and does not contain any additio
       "Exploitability": 5,
       "Affected Users": 9,
       "Discoverability": 7
-    }},
-    {{
+    },
+    {
       "Threat Type": "Spoofing",
       "Scenario": "An attacker could intercept the OAuth2 token exchange process through a Man-in-the-Middle (MitM) attack.",
       "Damage Potential": 8,
@@ -101,15 +107,22 @@ Ensure the JSON response is correctly formatted and does not contain any additio
       "Exploitability": 6,
       "Affected Users": 8,
       "Discoverability": 6
-    }}
+    }
   ]
-}}
+}
+
+Below is the list of identified threats:
+""")
+
+# Function to create a prompt for the DREAD risk assessment
+def create_dread_assessment_prompt(threats):
+    prompt = f"""{DREAD_INSTRUCTIONS}{threats}
 """
     return prompt
 
 # Function to get DREAD risk assessment from the GPT response.
-def get_dread_assessment(api_key, model_name, prompt):
-    client = OpenAI(api_key=api_key)
+def get_dread_assessment(api_key, model_name, prompt, max_tokens=4000):
+    client = get_openai_client(api_key)
 
     # For reasoning models (o1, o3-mini), use a structured system prompt
     if model_name in ["o1", "o3-mini"]:
@@ -142,16 +155,18 @@ def get_dread_assessment(api_key, model_name, prompt):
 
     response = client.chat.completions.create(
         model=model_name,
-        response_format={"type": "json_object"},
+        response_format=openai_model_response_format("dread_assessment", model_name),
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_completion_tokens=max_tokens
     )
+    record_usage(response)
     
     # Convert the JSON string in the 'content' field to a Python dictionary
     try:
-        dread_assessment = json.loads(response.choices[0].message.content)
+        dread_assessment = parse_json_response(response.choices[0].message.content, DREAD_KEYS, "dread_assessment")
     except json.JSONDecodeError:
         # Handle error silently
         dread_assessment = {}
@@ -159,25 +174,23 @@ def get_dread_assessment(api_key, model_name, prompt):
     return dread_assessment
 
 # Function to get DREAD risk assessment from the Azure OpenAI response.
-def get_dread_assessment_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt):
-    client = AzureOpenAI(
-        azure_endpoint = azure_api_endpoint,
-        api_key = azure_api_key,
-        api_version = azure_api_version,
-    )
+def get_dread_assessment_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt, max_tokens=4000):
+    client = get_azure_openai_client(azure_api_endpoint, azure_api_key, azure_api_version)
 
     response = client.chat.completions.create(
         model = azure_deployment_name,
-        response_format={"type": "json_object"},
+        response_format=azure_response_format("dread_assessment", azure_api_version),
         messages=[
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Convert the JSON string in the 'content' field to a Python dictionary
     try:
-        dread_assessment = json.loads(response.choices[0].message.content)
+        dread_assessment = parse_json_response(response.choices[0].message.content, DREAD_KEYS, "dread_assessment")
     except json.JSONDecodeError:
         # Handle error silently
         dread_assessment = {}
@@ -185,10 +198,10 @@ def get_dread_assessment_azure(azure_api_endpoint, azure_api_key, azure_api_vers
     return dread_assessment
 
 # Function to get DREAD risk assessment from the Google model's response.
-def get_dread_assessment_google(google_api_key, google_model, prompt):
-    genai.configure(api_key=google_api_key)
+def get_dread_assessment_google(google_api_key, google_model, prompt, max_tokens=4000):
+    configure_google(google_api_key)
     
-    model = genai.GenerativeModel(google_model)
+    model = genai.GenerativeModel(google_model, generation_config={**gemini_generation_config("dread_assessment"), "max_output_tokens": max_tokens})
     
     # Create the system message
     system_message = "You are a helpful assistant designed to output JSON. Only provide the DREAD risk assessment in JSON format with no additional text. Do not wrap the output in a code block."
@@ -209,33 +222,35 @@ def get_dread_assessment_google(google_api_key, google_model, prompt):
     
     try:
         # Access the JSON content from the response
-        dread_assessment = json.loads(response.text)
+        dread_assessment = parse_json_response(response.text, DREAD_KEYS, "dread_assessment")
         return dread_assessment
     except json.JSONDecodeError:
         return {}
 
 # Function to get DREAD risk assessment from the Mistral model's response.
-def get_dread_assessment_mistral(mistral_api_key, mistral_model, prompt):
-    client = Mistral(api_key=mistral_api_key)
+def get_dread_assessment_mistral(mistral_api_key, mistral_model, prompt, max_tokens=4000):
+    client = get_mistral_client(mistral_api_key)
 
     response = client.chat.complete(
         model=mistral_model,
         response_format={"type": "json_object"},
         messages=[
-            UserMessage(content=prompt)
-        ]
+            mistralai.UserMessage(content=prompt)
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     try:
         # Convert the JSON string in the 'content' field to a Python dictionary
-        dread_assessment = json.loads(response.choices[0].message.content)
+        dread_assessment = parse_json_response(response.choices[0].message.content, DREAD_KEYS, "dread_assessment")
     except json.JSONDecodeError:
         dread_assessment = {}
 
     return dread_assessment
 
 # Function to get DREAD risk assessment from Ollama hosted LLM.
-def get_dread_assessment_ollama(ollama_endpoint, ollama_model, prompt):
+def get_dread_assessment_ollama(ollama_endpoint, ollama_model, prompt, max_tokens=4000, num_ctx=None, keep_alive=None):
     """
     Get DREAD risk assessment from Ollama hosted LLM.
     
@@ -243,6 +258,9 @@ def get_dread_assessment_ollama(ollama_endpoint, ollama_model, prompt):
         ollama_endpoint (str): The URL of the Ollama endpoint (e.g., 'http://localhost:11434')
         ollama_model (str): The name of the model to use
         prompt (str): The prompt to send to the model
+        max_tokens (int): The output token limit (Ollama's num_predict)
+        num_ctx (int): The context window to load the model with
+        keep_alive (str or int): How long Ollama keeps the model loaded afterwards
         
     Returns:
         dict: The parsed JSON response containing the DREAD assessment
@@ -257,13 +275,11 @@ def get_dread_assessment_ollama(ollama_endpoint, ollama_model, prompt):
     
     url = ollama_endpoint + "api/chat"
 
-    max_retries = 3
-    retry_delay = 2 # seconds
-
     data = {
         "model": ollama_model,
         "stream": False,
-        "format": "json",
+        **ollama_request_fields(max_tokens, num_ctx, keep_alive),
+        "format": ollama_format("dread_assessment"),
         "messages": [
             {
                 "role": "system", 
@@ -271,18 +287,20 @@ def get_dread_assessment_ollama(ollama_endpoint, ollama_model, prompt):
 
 Please provide your response in JSON format with the following structure:
 {
-    "dread_assessment": [
+    "Risk Assessment": [
         {
-            "threat": "Description of the threat",
-            "damage": "Score and explanation",
-            "reproducibility": "Score and explanation",
-            "exploitability": "Score and explanation",
-            "affected_users": "Score and explanation",
-            "discoverability": "Score and explanation",
-            "risk_score": "Calculated total score"
+            "Threat Type": "The STRIDE category of the threat",
+            "Scenario": "Description of the threat",
+            "Damage Potential": 8,
+            "Reproducibility": 6,
+            "Exploitability": 5,
+            "Affected Users": 9,
+            "Discoverability": 7
         }
     ]
-}"""
+}
+
+Each score is an integer from 1 to 10."""
             },
             {
                 "role": "user",
@@ -291,39 +309,22 @@ Please provide your response in JSON format with the following structure:
         ]
     }
 
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=data, timeout=60)  # Add timeout
-            response.raise_for_status()  # Raise exception for bad status codes
-            outer_json = response.json()
-            
-            try:
-                # Access the 'content' attribute of the 'message' dictionary and parse as JSON
-                dread_assessment = json.loads(outer_json["message"]["content"])
-                return dread_assessment
-                
-            except (json.JSONDecodeError, KeyError):
-                if attempt == max_retries - 1:  # Last attempt
-                    raise
-                time.sleep(retry_delay)
-                continue
-                
-        except requests.exceptions.RequestException:
-            if attempt == max_retries - 1:  # Last attempt
-                raise
-            time.sleep(retry_delay)
-            continue
+    # Transient failures and unparseable JSON are retried by retry_policy
+    response = get_http_session().post(url, json=data, timeout=60)  # Add timeout
+    response.raise_for_status()  # Raise exception for bad status codes
+    outer_json = response.json()
+
+    # Access the 'content' attribute of the 'message' dictionary and parse as JSON
+    dread_assessment = parse_json_response(outer_json["message"]["content"], DREAD_KEYS, "dread_assessment")
+    return dread_assessment
 
 # Function to get DREAD risk assessment from the Anthropic model's response.
-def get_dread_assessment_anthropic(anthropic_api_key, anthropic_model, prompt):
-    client = Anthropic(api_key=anthropic_api_key)
+def get_dread_assessment_anthropic(anthropic_api_key, anthropic_model, prompt, max_tokens=4096):
+    client = get_anthropic_client(anthropic_api_key)
         
     # Check if we're using extended thinking mode
     is_thinking_mode = "thinking" in anthropic_model.lower()
      
-    # Check if we're using Claude 3.7
-    is_claude_3_7 = "claude-3-7" in anthropic_model.lower()
-     
     # If using thinking mode, use the actual model name without the "thinking" suffix
     actual_model = "claude-3-7-sonnet-latest" if is_thinking_mode else anthropic_model
     
@@ -332,27 +333,30 @@ def get_dread_assessment_anthropic(anthropic_api_key, anthropic_model, prompt):
         if is_thinking_mode:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=24000,
+                max_tokens=THINKING_BUDGET_TOKENS + max_tokens,
                 thinking={
                     "type": "enabled",
-                    "budget_tokens": 16000
+                    "budget_tokens": THINKING_BUDGET_TOKENS
                 },
                 system="You are a JSON-generating assistant. You must ONLY output valid, parseable JSON with no additional text or formatting.",
                 messages=[
-                    {"role": "user", "content": prompt + "\n\nIMPORTANT: Your response MUST be a valid JSON object with the exact structure shown in the example above. Do not include any explanatory text, markdown formatting, or code blocks. Return only the raw JSON object."}
+                    {"role": "user", "content": anthropic_content(prompt + "\n\nIMPORTANT: Your response MUST be a valid JSON object with the exact structure shown in the example above. Do not include any explanatory text, markdown formatting, or code blocks. Return only the raw JSON object.")}
                 ],
                 timeout=600  # 10-minute timeout
             )
+            record_usage(response)
         else:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=4096,
+                max_tokens=max_tokens,
                 system="You are a JSON-generating assistant. You must ONLY output valid, parseable JSON with no additional text or formatting.",
                 messages=[
-                    {"role": "user", "content": prompt}
+                    {"role": "user", "content": anthropic_content(prompt)}
                 ],
-                timeout=300  # 5-minute timeout
+                timeout=300,  # 5-minute timeout
+                **anthropic_tool_kwargs("dread_assessment")
             )
+            record_usage(response)
         try:
             # Extract the text content
             if is_thinking_mode:
@@ -364,22 +368,10 @@ def get_dread_assessment_anthropic(anthropic_api_key, anthropic_model, prompt):
                 if thinking_content:
                     st.session_state['last_thinking_content'] = thinking_content
             else:
-                # Standard handling for regular responses
-                response_text = response.content[0].text
-            # Check for and fix common JSON formatting issues
-            if is_claude_3_7:
-                # Sometimes Claude 3.7 adds trailing commas which are invalid in JSON
-                response_text = response_text.replace(",\n  ]", "\n  ]").replace(",\n]", "\n]")
-                 
-                # Sometimes it adds comments which are invalid in JSON
-                response_text = re.sub(r'//.*?\n', '\n', response_text)
-             
-            # Check if the JSON is complete (should end with a closing brace)
-            if not response_text.strip().endswith('}'):
-                raise json.JSONDecodeError("Incomplete JSON response", response_text, len(response_text))
-                 
-            # Parse the JSON string
-            dread_assessment = json.loads(response_text)
+                # Outside thinking mode the answer arrives as the forced tool call's input
+                response_text = get_anthropic_output(response)
+            # Trailing commas, comments and truncated output are repaired by the parser
+            dread_assessment = parse_json_response(response_text, DREAD_KEYS, "dread_assessment")
             return dread_assessment
         except (json.JSONDecodeError, IndexError, AttributeError) as e:
             # Create a fallback response with a proper DREAD structure
@@ -398,6 +390,11 @@ def get_dread_assessment_anthropic(anthropic_api_key, anthropic_model, prompt):
             }
             return fallback_assessment
     except Exception as e:
+        # Let retry_policy retry rate limits, timeouts and overloads
+        if is_retryable_error(e):
+            raise
+        # The fallback answer hides the failure from the caller, so record it
+        record_error(e)
         # Handle timeout and other errors
         error_message = str(e)
         st.error(f"Error with Anthropic API: {error_message}")
@@ -420,54 +417,23 @@ def get_dread_assessment_anthropic(anthropic_api_key, anthropic_model, prompt):
  
 
 # Function to get DREAD risk assessment from LM Studio Server response.
-def get_dread_assessment_lm_studio(lm_studio_endpoint, model_name, prompt):
-    client = OpenAI(
-        base_url=f"{lm_studio_endpoint}/v1",
-        api_key="not-needed"  # LM Studio Server doesn't require an API key
-    )
-
-    # Define the expected response structure
-    dread_schema = {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "dread_assessment_response",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "Risk Assessment": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "Threat Type": {"type": "string"},
-                                "Scenario": {"type": "string"},
-                                "Damage Potential": {"type": "integer", "minimum": 1, "maximum": 10},
-                                "Reproducibility": {"type": "integer", "minimum": 1, "maximum": 10},
-                                "Exploitability": {"type": "integer", "minimum": 1, "maximum": 10},
-                                "Affected Users": {"type": "integer", "minimum": 1, "maximum": 10},
-                                "Discoverability": {"type": "integer", "minimum": 1, "maximum": 10}
-                            },
-                            "required": ["Threat Type", "Scenario", "Damage Potential", "Reproducibility", "Exploitability", "Affected Users", "Discoverability"]
-                        }
-                    }
-                },
-                "required": ["Risk Assessment"]
-            }
-        }
-    }
+def get_dread_assessment_lm_studio(lm_studio_endpoint, model_name, prompt, max_tokens=4000):
+    client = get_lm_studio_client(lm_studio_endpoint)
 
     response = client.chat.completions.create(
         model=model_name,
-        response_format=dread_schema,
+        response_format=openai_response_format("dread_assessment", inline_refs=True),
         messages=[
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Convert the JSON string in the 'content' field to a Python dictionary
     try:
-        dread_assessment = json.loads(response.choices[0].message.content)
+        dread_assessment = parse_json_response(response.choices[0].message.content, DREAD_KEYS, "dread_assessment")
     except json.JSONDecodeError:
         # Handle error silently
         dread_assessment = {}
@@ -475,16 +441,18 @@ def get_dread_assessment_lm_studio(lm_studio_endpoint, model_name, prompt):
     return dread_assessment
 
 # Function to get DREAD risk assessment from the Groq model's response.
-def get_dread_assessment_groq(groq_api_key, groq_model, prompt):
-    client = Groq(api_key=groq_api_key)
+def get_dread_assessment_groq(groq_api_key, groq_model, prompt, max_tokens=4000):
+    client = get_groq_client(groq_api_key)
     response = client.chat.completions.create(
         model=groq_model,
         response_format={"type": "json_object"},
         messages=[
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Process the response using our utility function
     reasoning, dread_assessment = process_groq_response(
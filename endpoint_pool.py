@@ -0,0 +1,313 @@
+import functools
+import os
+import statistics
+import threading
+import time
+
+from clients import get_http_session
+from concurrency import start_thread
+from circuit_breaker import is_upstream_failure
+
+# --------- Local Endpoint Pool --------- #
+
+# The Ollama and LM Studio Server endpoint fields accept several servers, separated by commas,
+# each optionally followed by #N for the number of requests it serves in parallel (Ollama's
+# OLLAMA_NUM_PARALLEL), e.g. "http://gpu1:11434#4, http://gpu2:11434#2". Every request goes
+# to the server with the fewest outstanding requests per slot, preferring servers that already
+# have the model loaded. Servers are health checked in the background; servers that fail
+# repeatedly or are much slower than the rest of the pool are ejected for a while.
+
+PROVIDERS = ("Ollama", "LM Studio Server")
+
+# Parallel slots of a server listed without #N
+DEFAULT_SLOTS = int(os.getenv("LOCAL_ENDPOINT_SLOTS", "1"))
+# Seconds between health checks of a server
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv("LOCAL_HEALTH_CHECK_INTERVAL", "30"))
+HEALTH_CHECK_TIMEOUT_SECONDS = 5
+# Consecutive failures that eject a server
+EJECT_FAILURES = int(os.getenv("LOCAL_EJECT_FAILURES", "2"))
+# A server is ejected when its average latency exceeds the median of the other servers by this factor
+EJECT_SLOW_FACTOR = float(os.getenv("LOCAL_EJECT_SLOW_FACTOR", "3"))
+# Latencies a server needs before it can be ejected as slow
+EJECT_MIN_SAMPLES = 5
+# Seconds an ejected server receives no requests
+EJECT_SECONDS = float(os.getenv("LOCAL_EJECT_SECONDS", "60"))
+# Weight of the newest latency in a server's moving average
+LATENCY_SMOOTHING = 0.2
+
+_hosts = {}
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=64)
+def parse_endpoints(spec):
+    """
+    Parse an endpoint field into the servers of the pool.
+
+    Args:
+        spec (str): One or more URLs separated by commas, each optionally followed by #slots
+
+    Returns:
+        tuple: (url, slots) per server, in the order given
+
+    Raises:
+        ValueError: If a URL does not start with http:// or https://, or a slot count is invalid
+    """
+    endpoints = []
+    for item in spec.replace("\n", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, slots = item.partition("#")
+        url = url.strip().rstrip("/")
+        if not url.startswith(("http://", "https://")):
+            raise ValueError(f"Endpoint URL must start with http:// or https://: {url}")
+        if slots and (not slots.strip().isdigit() or int(slots) < 1):
+            raise ValueError(f"Invalid number of parallel requests for {url}: {slots}")
+        endpoints.append((url, int(slots) if slots else DEFAULT_SLOTS))
+    if not endpoints:
+        raise ValueError("Enter at least one endpoint URL")
+    return tuple(endpoints)
+
+
+def get_pool_endpoints(config):
+    """
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+
+    Returns:
+        list: The URLs of the configured servers; empty for hosted providers or an invalid field
+    """
+    return [url for url, _ in _config_endpoints(config)]
+
+
+def _config_endpoints(config):
+    if config["provider"] not in PROVIDERS or not config.get("endpoint"):
+        return ()
+    try:
+        return parse_endpoints(config["endpoint"])
+    except ValueError:
+        return ()
+
+
+def _get_host(provider, url, slots):
+    host = _hosts.get((provider, url))
+    if host is None:
+        host = _hosts[(provider, url)] = {
+            "outstanding": 0,
+            "slots": slots,
+            "failures": 0,
+            "ejected_until": 0.0,
+            "latency": {},
+            "samples": {},
+            "loaded_models": None,
+            "checked_at": None,
+        }
+    host["slots"] = slots
+    return host
+
+
+# Function to ask a server which models it has loaded, and whether it answers at all
+def _fetch_loaded_models(provider, url):
+    session = get_http_session()
+    if provider == "Ollama":
+        response = session.get(url + "/api/ps", timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return {model["name"] for model in response.json().get("models", [])}
+    response = session.get(url + "/api/v0/models", timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+    if response.status_code == 404:
+        # Older LM Studio versions only have the OpenAI-compatible list, without load states
+        response = session.get(url + "/v1/models", timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return None
+    response.raise_for_status()
+    return {model["id"] for model in response.json().get("data", []) if model.get("state") == "loaded"}
+
+
+def _check_health(provider, url):
+    try:
+        loaded_models = _fetch_loaded_models(provider, url)
+        healthy = True
+    except Exception:
+        loaded_models, healthy = None, False
+    with _lock:
+        host = _hosts[(provider, url)]
+        host["checked_at"] = time.monotonic()
+        host["loaded_models"] = loaded_models
+        if not healthy:
+            _eject(provider, host)
+
+
+def _eject(provider, host):
+    # Keep at least one server in rotation; the circuit breaker handles a pool that is down
+    now = time.monotonic()
+    others = [other for (other_provider, _), other in _hosts.items()
+              if other_provider == provider and other is not host and other["ejected_until"] <= now]
+    if others:
+        host["ejected_until"] = now + EJECT_SECONDS
+
+
+def _schedule_health_checks(provider, endpoints, now):
+    for url, _ in endpoints:
+        host = _hosts[(provider, url)]
+        if host["checked_at"] is None or now - host["checked_at"] >= HEALTH_CHECK_INTERVAL_SECONDS:
+            # Marks the check as started so one check runs at a time
+            host["checked_at"] = now
+            start_thread(_check_health, provider, url)
+
+
+def _acquire(config, endpoints):
+    provider, model = config["provider"], config["model"]
+    now = time.monotonic()
+    with _lock:
+        hosts = [(url, _get_host(provider, url, slots)) for url, slots in endpoints]
+        _schedule_health_checks(provider, endpoints, now)
+        available = [(url, host) for url, host in hosts if host["ejected_until"] <= now] or hosts
+
+        def load(item):
+            url, host = item
+            loaded = host["loaded_models"] is None or model in host["loaded_models"]
+            return (host["outstanding"] >= host["slots"], not loaded, host["outstanding"] / host["slots"], host["latency"].get("call", 0.0))
+
+        url, host = min(available, key=load)
+        host["outstanding"] += 1
+    return url, host
+
+
+def _record_latency(provider, host, kind, seconds):
+    # Called with _lock held
+    average = host["latency"].get(kind)
+    host["latency"][kind] = seconds if average is None else average + LATENCY_SMOOTHING * (seconds - average)
+    host["samples"][kind] = host["samples"].get(kind, 0) + 1
+    if host["samples"][kind] < EJECT_MIN_SAMPLES:
+        return
+    peers = [other["latency"][kind] for (other_provider, _), other in _hosts.items()
+             if other_provider == provider and other is not host and other["samples"].get(kind, 0) >= EJECT_MIN_SAMPLES]
+    if peers and host["latency"][kind] > EJECT_SLOW_FACTOR * statistics.median(peers):
+        _eject(provider, host)
+        # Start afresh when the server is back in rotation
+        host["latency"].pop(kind)
+        host["samples"][kind] = 0
+
+
+def _release(config, host, error=None, latency=None, kind="call"):
+    with _lock:
+        host["outstanding"] -= 1
+        if error is not None:
+            if is_upstream_failure(error):
+                host["failures"] += 1
+                if host["failures"] >= EJECT_FAILURES:
+                    host["failures"] = 0
+                    _eject(config["provider"], host)
+            return
+        host["failures"] = 0
+        if host["loaded_models"] is not None:
+            # The server loads the model on its first request
+            host["loaded_models"].add(config["model"])
+        if latency is not None:
+            _record_latency(config["provider"], host, kind, latency)
+
+
+def _host_config(config, url):
+    return dict(config, endpoint=url, args=(url,) + tuple(config["args"][1:]))
+
+
+def pooled_call(config, func):
+    """
+    Run a provider call against one server of the configured pool.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        func (callable): Makes the call, given the settings of the chosen server
+
+    Returns:
+        The result of func
+    """
+    endpoints = _config_endpoints(config)
+    if not endpoints:
+        return func(config)
+    if len(endpoints) == 1:
+        return func(_host_config(config, endpoints[0][0]))
+    url, host = _acquire(config, endpoints)
+    started = time.monotonic()
+    try:
+        result = func(_host_config(config, url))
+    except Exception as e:
+        _release(config, host, error=e)
+        raise
+    except BaseException:
+        # Interrupted call (e.g. a Streamlit rerun): free the slot without judging the server
+        _release(config, host)
+        raise
+    _release(config, host, latency=time.monotonic() - started)
+    return result
+
+
+def pooled_stream(config, open_stream):
+    """
+    Streaming counterpart of pooled_call(): the server's slot is held until the stream ends,
+    and its time to first event counts as its latency.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        open_stream (callable): Returns an iterator of events, given the settings of the chosen server
+
+    Yields:
+        The stream's events
+    """
+    endpoints = _config_endpoints(config)
+    if not endpoints:
+        yield from open_stream(config)
+        return
+    if len(endpoints) == 1:
+        yield from open_stream(_host_config(config, endpoints[0][0]))
+        return
+    url, host = _acquire(config, endpoints)
+    started = time.monotonic()
+    latency = None
+    try:
+        for event in open_stream(_host_config(config, url)):
+            if latency is None:
+                latency = time.monotonic() - started
+            yield event
+    except Exception as e:
+        _release(config, host, error=e)
+        raise
+    except BaseException:
+        # Abandoned stream: free the slot without judging the server
+        _release(config, host)
+        raise
+    _release(config, host, latency=latency, kind="stream")
+
+
+def get_pool_status(provider, spec):
+    """
+    Args:
+        provider (str): 'Ollama' or 'LM Studio Server'
+        spec (str): The endpoint field
+
+    Returns:
+        list: One dict per server with its URL, outstanding requests, slots, whether it is
+              ejected, its loaded models (None if unknown) and average latency in seconds
+    """
+    try:
+        endpoints = parse_endpoints(spec)
+    except ValueError:
+        return []
+    now = time.monotonic()
+    with _lock:
+        for url, slots in endpoints:
+            _get_host(provider, url, slots)
+        _schedule_health_checks(provider, endpoints, now)
+        rows = []
+        for url, slots in endpoints:
+            host = _hosts[(provider, url)]
+            rows.append({
+                "endpoint": url,
+                "outstanding": host["outstanding"],
+                "slots": host["slots"],
+                "ejected": host["ejected_until"] > now,
+                "loaded_models": sorted(host["loaded_models"]) if host["loaded_models"] is not None else None,
+                "latency_seconds": host["latency"].get("call"),
+            })
+    return rows
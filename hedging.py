@@ -0,0 +1,127 @@
+import math
+import os
+import queue
+import threading
+from collections import deque
+
+from concurrency import start_thread
+
+# --------- Hedged Requests --------- #
+
+# Delay before hedging while there are fewer than HEDGE_MIN_SAMPLES latencies for a stage
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "30"))
+# Never hedge sooner than this, however fast the provider usually is
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY", "5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "10"))
+# Number of recent latencies kept per provider, model and stage
+LATENCY_WINDOW = 200
+
+_latencies = {}
+_lock = threading.Lock()
+_stats = {"calls": 0, "hedged": 0, "hedge_wins": 0}
+
+
+def record_latency(config, stage, seconds):
+    """
+    Record how long a successful call took, for the hedging threshold.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        stage (str): The pipeline stage
+        seconds (float): The call's duration
+    """
+    key = (config["provider"], config["model"], stage)
+    with _lock:
+        _latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def hedge_delay(config, stage, percentile=95):
+    """
+    Get how long to wait for a provider before sending the hedge request.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        stage (str): The pipeline stage
+        percentile (float): The latency percentile to wait for (e.g. 95 for p95)
+
+    Returns:
+        float: Seconds to wait
+    """
+    with _lock:
+        samples = sorted(_latencies.get((config["provider"], config["model"], stage), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY_SECONDS
+    index = min(len(samples) - 1, math.ceil(percentile / 100 * len(samples)) - 1)
+    return max(HEDGE_MIN_DELAY_SECONDS, samples[index])
+
+
+def hedged_call(primary, hedge, delay, is_valid):
+    """
+    Call primary and, if it has not finished after `delay` seconds, also call hedge; return the
+    first result that passes is_valid. The slower call cannot be interrupted mid-request, so it
+    is abandoned: it finishes in the background and its result is ignored.
+
+    Args:
+        primary (callable): Makes the primary request
+        hedge (callable): Makes the duplicate request to the secondary provider
+        delay (float): Seconds to wait for primary before hedging
+        is_valid (callable): Returns True if a result is usable
+
+    Returns:
+        tuple: (result, hedge_won) where hedge_won is True if the hedge request's result was used
+
+    Raises:
+        Exception: The primary's error if neither call produced a valid result
+    """
+    results = queue.Queue()
+
+    def run(is_hedge, func):
+        try:
+            results.put((is_hedge, func(), None))
+        except Exception as e:
+            results.put((is_hedge, None, e))
+
+    with _lock:
+        _stats["calls"] += 1
+    start_thread(run, False, primary)
+
+    try:
+        is_hedge, result, error = results.get(timeout=delay)
+    except queue.Empty:
+        pass
+    else:
+        # The primary finished in time, so behave exactly like an unhedged call
+        if error is not None:
+            raise error
+        return result, False
+
+    with _lock:
+        _stats["hedged"] += 1
+    start_thread(run, True, hedge)
+
+    outcomes = {}
+    for _ in range(2):
+        is_hedge, result, error = results.get()
+        if error is None and is_valid(result):
+            if is_hedge:
+                with _lock:
+                    _stats["hedge_wins"] += 1
+            return result, is_hedge
+        outcomes[is_hedge] = (result, error)
+
+    # Neither result is usable: report the primary's outcome
+    result, error = outcomes[False]
+    if error is not None:
+        raise error
+    return result, False
+
+
+def get_hedge_stats():
+    """
+    Returns:
+        dict: Hedged calls made, how many sent a hedge request, how many the hedge won, and the hedge rate
+    """
+    with _lock:
+        stats = dict(_stats)
+    stats["hedge_rate"] = stats["hedged"] / stats["calls"] if stats["calls"] else 0.0
+    return stats
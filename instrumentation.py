@@ -0,0 +1,246 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# --------- LLM Call Instrumentation --------- #
+
+# Every upstream LLM request (see providers.call_stage and stream_stage) produces one record:
+# wall time including retries and rate-limit waits, time to first token for streams, the input,
+# output and cached tokens reported in response.usage, attempts, whether the JSON had to be
+# repaired, and the outcome with the error class. Records are appended to a JSON Lines file
+# and aggregated per provider, model and stage for the sidebar.
+# Providers that report no usage (Ollama, Google) leave the token fields empty.
+
+# Where records are written; set LLM_METRICS_PATH to an empty string to disable the file
+METRICS_PATH = os.getenv("LLM_METRICS_PATH", os.path.join(".cache", "llm_calls.jsonl"))
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+# Number of recent latencies kept per provider, model and stage for percentiles
+LATENCY_WINDOW = 500
+
+# Outcomes of a call
+OK = "ok"
+ERROR = "error"
+CANCELLED = "cancelled"
+
+# (record, start time) of the call running in the current thread or stream, if any
+_current_call = contextvars.ContextVar("llm_call", default=(None, None))
+
+_aggregates = {}
+_lock = threading.Lock()
+_file_lock = threading.Lock()
+
+
+def _new_aggregate():
+    return {
+        "calls": 0,
+        "errors": 0,
+        "retries": 0,
+        "json_repairs": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cached_tokens": 0,
+        "ttft": deque(maxlen=LATENCY_WINDOW),
+        "latencies": deque(maxlen=LATENCY_WINDOW),
+        "histogram": [0] * (len(LATENCY_BUCKETS) + 1),
+        "error_classes": {},
+    }
+
+
+def _percentile(samples, percentile):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))]
+
+
+def _finish(record):
+    key = (record["provider"], record["model"], record["stage"])
+    with _lock:
+        aggregate = _aggregates.get(key)
+        if aggregate is None:
+            aggregate = _aggregates[key] = _new_aggregate()
+        aggregate["calls"] += 1
+        aggregate["retries"] += record["retries"]
+        aggregate["json_repairs"] += int(record["json_repaired"])
+        for field in ("input_tokens", "output_tokens", "cached_tokens"):
+            aggregate[field] += record[field] or 0
+        if record["outcome"] == ERROR:
+            aggregate["errors"] += 1
+            aggregate["error_classes"][record["error"]] = aggregate["error_classes"].get(record["error"], 0) + 1
+        if record["ttft_seconds"] is not None:
+            aggregate["ttft"].append(record["ttft_seconds"])
+        aggregate["latencies"].append(record["wall_seconds"])
+        aggregate["histogram"][bisect.bisect_left(LATENCY_BUCKETS, record["wall_seconds"])] += 1
+
+    if METRICS_PATH:
+        try:
+            with _file_lock:
+                os.makedirs(os.path.dirname(METRICS_PATH) or ".", exist_ok=True)
+                with open(METRICS_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+        except OSError:
+            # Metrics must never break a call, e.g. on a read-only file system
+            pass
+
+
+@contextlib.contextmanager
+def instrument_call(config, stage, streaming=False, max_tokens=None):
+    """
+    Record one upstream LLM request. Code running inside the block (in the same thread, or
+    the same stream) adds to the record through the record_* and mark_* functions below.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        stage (str): The pipeline stage, e.g. 'threat_model'
+        streaming (bool): Whether the response is streamed
+        max_tokens (int): The output token limit the request was sent with
+
+    Yields:
+        dict: The record, written when the block exits
+    """
+    record = {
+        "timestamp": time.time(),
+        "provider": config["provider"],
+        "model": config["model"],
+        "stage": stage,
+        "streaming": streaming,
+        "outcome": OK,
+        "error": None,
+        "wall_seconds": None,
+        "ttft_seconds": None,
+        "attempts": 0,
+        "retries": 0,
+        "input_tokens": None,
+        "output_tokens": None,
+        "cached_tokens": None,
+        "max_tokens": max_tokens,
+        "json_repaired": False,
+    }
+    started = time.monotonic()
+    token = _current_call.set((record, started))
+    try:
+        yield record
+    except Exception as e:
+        record["outcome"] = ERROR
+        record["error"] = type(e).__name__
+        raise
+    except BaseException:
+        # e.g. GeneratorExit when a stream is abandoned
+        if record["outcome"] == OK:
+            record["outcome"] = CANCELLED
+        raise
+    finally:
+        try:
+            _current_call.reset(token)
+        except ValueError:
+            # An abandoned stream is closed from a different context
+            pass
+        record["wall_seconds"] = time.monotonic() - started
+        record["retries"] = max(0, record["attempts"] - 1)
+        _finish(record)
+
+
+def mark_attempt():
+    """Count an attempt (the first call or a retry) of the current call."""
+    record, _ = _current_call.get()
+    if record is not None:
+        record["attempts"] += 1
+
+
+def mark_first_token():
+    """Record the time to first token of the current streamed call, once."""
+    record, started = _current_call.get()
+    if record is not None and record["ttft_seconds"] is None:
+        record["ttft_seconds"] = time.monotonic() - started
+
+
+def record_tokens(input_tokens, output_tokens, cached_tokens):
+    """
+    Add the token usage reported by a provider response to the current call.
+
+    Args:
+        input_tokens (int): Prompt tokens, including cached ones
+        output_tokens (int): Completion tokens, or None if not reported
+        cached_tokens (int): Prompt tokens served from the provider's prompt cache
+    """
+    record, _ = _current_call.get()
+    if record is None:
+        return
+    for field, value in (("input_tokens", input_tokens), ("output_tokens", output_tokens), ("cached_tokens", cached_tokens)):
+        if value is not None:
+            record[field] = (record[field] or 0) + value
+
+
+def record_json_repair():
+    """Note that the current call's JSON only parsed after repair (see json_repair)."""
+    record, _ = _current_call.get()
+    if record is not None:
+        record["json_repaired"] = True
+
+
+def record_error(error):
+    """
+    Mark the current call as failed, for errors that are handled rather than raised.
+
+    Args:
+        error (Exception): The error
+    """
+    record, _ = _current_call.get()
+    if record is not None:
+        record["outcome"] = ERROR
+        record["error"] = type(error).__name__
+
+
+def get_call_stats():
+    """
+    Returns:
+        list: One dict per provider, model and stage with the number of calls, errors, retries
+              and JSON repairs, p50/p95 latency and mean time to first token in seconds, token
+              totals and the most common error class, slowest p95 first
+    """
+    with _lock:
+        items = [(key, dict(aggregate, latencies=list(aggregate["latencies"]), ttft=list(aggregate["ttft"]), error_classes=dict(aggregate["error_classes"])))
+                 for key, aggregate in _aggregates.items()]
+    rows = []
+    for (provider, model, stage), aggregate in items:
+        top_error = max(aggregate["error_classes"], key=aggregate["error_classes"].get) if aggregate["error_classes"] else None
+        rows.append({
+            "provider": provider,
+            "model": model,
+            "stage": stage,
+            "calls": aggregate["calls"],
+            "errors": aggregate["errors"],
+            "retries": aggregate["retries"],
+            "json_repairs": aggregate["json_repairs"],
+            "p50_seconds": _percentile(aggregate["latencies"], 50),
+            "p95_seconds": _percentile(aggregate["latencies"], 95),
+            "mean_ttft_seconds": sum(aggregate["ttft"]) / len(aggregate["ttft"]) if aggregate["ttft"] else None,
+            "input_tokens": aggregate["input_tokens"],
+            "output_tokens": aggregate["output_tokens"],
+            "cached_tokens": aggregate["cached_tokens"],
+            "top_error": top_error,
+        })
+    rows.sort(key=lambda row: row["p95_seconds"] or 0, reverse=True)
+    return rows
+
+
+def get_latency_histogram():
+    """
+    Returns:
+        dict: Maps each latency bucket label (e.g. "≤5s", ">300s") to the number of calls in it,
+              over all providers, models and stages
+    """
+    labels = [f"≤{bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+    counts = [0] * len(labels)
+    with _lock:
+        for aggregate in _aggregates.values():
+            counts = [total + count for total, count in zip(counts, aggregate["histogram"])]
+    return dict(zip(labels, counts))
@@ -0,0 +1,286 @@
+import json
+
+from instrumentation import record_json_repair
+from schemas import SCHEMAS
+
+# --------- Tolerant JSON Parsing --------- #
+
+# Bare words models write in place of JSON literals
+LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+
+# Characters that may appear in an unquoted key, number or literal
+BARE_WORD_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$+-.")
+
+# How many opening brackets to try before giving up on a response
+MAX_CANDIDATES = 3
+
+
+def _find_start(text):
+    # Reasoning models may put draft JSON in their <think> block; only the answer after it counts
+    think_end = text.rfind("</think>")
+    start = think_end + len("</think>") if think_end != -1 else 0
+
+    # Prefer the content of a ```json fence when there is one
+    fence = text.find("```json", start)
+    if fence != -1:
+        start = fence + len("```json")
+    return start
+
+
+def _scan(text, start):
+    """
+    Copy the JSON value starting at text[start] into valid JSON in a single pass: comments and
+    trailing commas are dropped, keys and single-quoted strings are double-quoted, Python literals
+    are translated, and a value cut off by max_tokens is closed after its last complete member.
+    Scanning stops at the end of the outermost value, so any prose after it is ignored.
+
+    Returns:
+        tuple: (repaired JSON string, or "" if nothing usable was found; index where scanning stopped)
+    """
+    out = []
+    # One entry per open container: [closing bracket, expecting an object key, length of out
+    # where its current member starts (before the comma that separates it from the last one)]
+    stack = []
+    # Length of out and open containers after the last complete value, for closing truncated output
+    safe_point = None
+    pending_comma = False
+    length = len(text)
+    i = start
+
+    def mark_safe():
+        nonlocal safe_point
+        safe_point = (len(out), [(entry[0], entry[2]) for entry in stack])
+
+    def emit(token):
+        nonlocal pending_comma
+        if pending_comma:
+            out.append(",")
+            pending_comma = False
+        out.append(token)
+
+    while i < length:
+        char = text[i]
+
+        if char in " \t\r\n":
+            i += 1
+            continue
+
+        # Comments are only recognised outside strings, so URLs in values are left alone
+        if char == "/" and text.startswith("//", i):
+            newline = text.find("\n", i)
+            i = length if newline == -1 else newline + 1
+            continue
+        if char == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = length if end == -1 else end + 2
+            continue
+
+        if char in "{[":
+            emit(char)
+            stack.append(["}" if char == "{" else "]", char == "{", len(out)])
+            mark_safe()
+            i += 1
+            continue
+
+        if char in "}]":
+            if not stack:
+                break
+            # A comma before a closing bracket is a trailing comma, so drop it
+            pending_comma = False
+            out.append(stack.pop()[0])
+            i += 1
+            if not stack:
+                return "".join(out), i
+            mark_safe()
+            continue
+
+        if char == ",":
+            if stack:
+                pending_comma = True
+                stack[-1][1] = stack[-1][0] == "}"
+                stack[-1][2] = len(out)
+            i += 1
+            continue
+
+        if char == ":":
+            out.append(":")
+            if stack:
+                stack[-1][1] = False
+            i += 1
+            continue
+
+        is_key = bool(stack) and stack[-1][1]
+
+        if char in "\"'":
+            # Find the closing quote, skipping escaped characters
+            end = i + 1
+            while end < length and text[end] != char:
+                end += 2 if text[end] == "\\" else 1
+            if end >= length:
+                break
+            body = text[i + 1:end]
+            if char == "'":
+                body = body.replace("\\'", "'").replace('"', '\\"')
+            emit('"' + body + '"')
+            i = end + 1
+            if not is_key:
+                mark_safe()
+            continue
+
+        if char in BARE_WORD_CHARS:
+            end = i
+            while end < length and text[end] in BARE_WORD_CHARS:
+                end += 1
+            if end >= length:
+                # The word may have been cut off
+                break
+            word = text[i:end]
+            if is_key:
+                emit(json.dumps(word))
+            else:
+                emit(LITERALS.get(word, word))
+                mark_safe()
+            i = end
+            continue
+
+        # Anything else is not JSON; stop and close what we have
+        break
+
+    # The response ended (or broke off) inside the value: keep everything up to the last
+    # complete value and close the containers that were open at that point
+    if safe_point is None:
+        return "", i
+    size, containers = safe_point
+    # An array element that was still being written (e.g. a threat with only some of its keys)
+    # is dropped rather than closed, from the innermost array it belongs to
+    for depth in range(len(containers) - 2, -1, -1):
+        closer, member_start = containers[depth]
+        if closer == "]":
+            size = member_start
+            containers = containers[:depth + 1]
+            break
+    if size <= 1:
+        # Only the opening bracket is left: nothing usable was recovered
+        return "", i
+    return "".join(out[:size]) + "".join(closer for closer, _ in reversed(containers)), i
+
+
+def repair_json(text, opener="{["):
+    """
+    Extract the outermost JSON value from a model response and repair common defects: code
+    fences and surrounding prose, // and /* */ comments, trailing commas, unquoted keys,
+    single-quoted strings, Python literals and output truncated at the token limit.
+
+    Args:
+        text (str): The raw model response
+        opener (str): The brackets the value may start with, e.g. "{" for an object
+
+    Yields:
+        str: Candidate JSON strings, one per bracketed value found, in order of appearance
+    """
+    if not text:
+        return
+    position = _find_start(text)
+    for _ in range(MAX_CANDIDATES):
+        indexes = [index for index in (text.find(char, position) for char in opener) if index != -1]
+        if not indexes:
+            return
+        start = min(indexes)
+        candidate, end = _scan(text, start)
+        if candidate:
+            yield candidate
+        # Continue after this value, e.g. when prose before the JSON contained a bracket
+        position = max(end, start + 1)
+
+
+def _drop_incomplete_rows(value, schema, definitions):
+    # Remove array items that lack keys their schema requires; returns how many were removed
+    if "$ref" in schema:
+        schema = definitions[schema["$ref"].rsplit("/", 1)[-1]]
+    dropped = 0
+    if isinstance(value, dict):
+        for key, property_schema in schema.get("properties", {}).items():
+            if key in value:
+                dropped += _drop_incomplete_rows(value[key], property_schema, definitions)
+    elif isinstance(value, list) and "items" in schema:
+        items = schema["items"]
+        if "$ref" in items:
+            items = definitions[items["$ref"].rsplit("/", 1)[-1]]
+        if items.get("type") == "object":
+            # Rows must be objects: a number or string in their place is not a row
+            kept = [item for item in value
+                    if isinstance(item, dict) and all(key in item for key in items.get("required", []))]
+        else:
+            kept = value[:]
+        dropped += len(value) - len(kept)
+        value[:] = kept
+        for item in kept:
+            dropped += _drop_incomplete_rows(item, items, definitions)
+    return dropped
+
+
+def _parse(text, expected_keys):
+    # Well-formed responses (the common case with JSON mode) skip the scanner entirely
+    try:
+        return json.loads(text, strict=False), False
+    except json.JSONDecodeError:
+        pass
+    opener = "{[" if not expected_keys or len(expected_keys) == 1 else "{"
+    fallback = None
+    for candidate in repair_json(text, opener):
+        try:
+            result = json.loads(candidate, strict=False)
+        except json.JSONDecodeError:
+            continue
+        if not expected_keys or (isinstance(result, dict) and all(key in result for key in expected_keys)):
+            record_json_repair()
+            return result, True
+        # A bracketed aside in the prose can come before the real object, so a bare array (or an
+        # object without the expected keys) is only used if no object with the keys follows
+        if fallback is None or (isinstance(result, list) and not isinstance(fallback[0], list)):
+            fallback = (result,)
+    if fallback is not None:
+        record_json_repair()
+        return fallback[0], True
+    raise json.JSONDecodeError("No valid JSON found in model response", text, 0)
+
+
+def parse_json_response(text, expected_keys=None, schema_name=None):
+    """
+    Parse a model response that should contain JSON, repairing it if necessary.
+
+    Args:
+        text (str): The raw model response
+        expected_keys (tuple): Top-level keys the result must contain. When given, the result
+            must be an object; a bare list is accepted for a single expected key and wrapped in it.
+        schema_name (str): The payload schema rows are checked against (see schemas.SCHEMAS);
+            rows missing required keys are dropped, and a result left without any rows is rejected
+
+    Returns:
+        dict or list: The parsed JSON
+
+    Raises:
+        json.JSONDecodeError: If no usable JSON could be recovered, so callers and
+            retry_policy treat it like any other malformed response
+    """
+    if isinstance(text, (dict, list)):
+        # Already parsed, e.g. the input of a forced tool call
+        result, repaired = text, False
+    else:
+        result, repaired = _parse(text or "", expected_keys)
+
+    if expected_keys:
+        if isinstance(result, list) and len(expected_keys) == 1:
+            result = {expected_keys[0]: result}
+        if not isinstance(result, dict):
+            raise json.JSONDecodeError(f"Expected a JSON object with {', '.join(expected_keys)}", str(text), 0)
+        missing = [key for key in expected_keys if key not in result]
+        if missing:
+            raise json.JSONDecodeError(f"JSON response is missing {', '.join(missing)}", str(text), 0)
+    if schema_name and isinstance(result, dict):
+        schema = SCHEMAS[schema_name][2]
+        dropped = _drop_incomplete_rows(result, schema, schema.get("$defs", {}))
+        # A repair that kept no rows recovered nothing worth showing
+        if (dropped or repaired) and not any(isinstance(result.get(key), list) and result[key] for key in expected_keys or result):
+            raise json.JSONDecodeError("JSON response has no complete rows", str(text), 0)
+    return result
@@ -0,0 +1,45 @@
+import importlib
+
+# --------- Lazy Imports --------- #
+
+# A session only ever talks to one provider and rarely exports a PDF, so the provider SDKs,
+# PyGithub, tiktoken and WeasyPrint are imported the first time they are used rather than when
+# the app starts. Modules bind them at the top as usual, e.g. openai = lazy_import("openai"),
+# and use them through the module name (openai.OpenAI(...)).
+
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, then imports it. Import errors
+    (e.g. an SDK that is not installed) surface at that first use.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            # importlib holds the import lock, so concurrent first uses import the module once
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Get a module that is only imported when it is first used.
+
+    Args:
+        name (str): The full module name, e.g. "google.generativeai"
+
+    Returns:
+        LazyModule: A proxy that forwards attribute access to the module
+    """
+    return LazyModule(name)
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from clients import credential_fingerprint
+from similarity import minhash_signature, estimate_jaccard
+from schemas import SCHEMAS
+
+# --------- LLM Response Cache --------- #
+
+# Responses are stored in SQLite so they survive page reloads and app restarts.
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_responses.sqlite3"))
+CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600
+CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "100")) * 1024 * 1024)
+
+# Bump when the format of cached outputs changes, so older entries are no longer returned
+CACHE_FORMAT_VERSION = 1
+
+_lock = threading.Lock()
+_initialized = False
+_stats = {"hits": 0, "misses": 0, "similar_hits": 0}
+
+
+def _connect():
+    global _initialized
+    directory = os.path.dirname(CACHE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(CACHE_PATH, timeout=30)
+    if not _initialized:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                scope TEXT,
+                signature TEXT
+            )
+            """
+        )
+        # Caches created before similarity lookups existed lack the scope and signature columns
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(responses)")]
+        for column in ("scope", "signature"):
+            if column not in columns:
+                connection.execute(f"ALTER TABLE responses ADD COLUMN {column} TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope)")
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        connection.commit()
+        _initialized = True
+    return connection
+
+
+def cache_namespace(config):
+    """
+    Namespace cache entries by credential so that users with different API keys never
+    share responses. Keyless providers (Ollama, LM Studio) are namespaced by endpoint.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+
+    Returns:
+        str: The namespace
+    """
+    if config.get("credential"):
+        return credential_fingerprint(config["credential"])
+    return config.get("endpoint") or "default"
+
+
+def stage_version(stage):
+    """
+    Identify the output format of a stage, so that responses cached before its schema
+    changed are not returned.
+
+    Args:
+        stage (str): The pipeline stage (e.g. 'threat_model')
+
+    Returns:
+        str: CACHE_FORMAT_VERSION and a hash of the stage's registered schema, if it has one
+    """
+    schema = SCHEMAS.get(stage)
+    if schema is None:
+        return str(CACHE_FORMAT_VERSION)
+    digest = hashlib.sha256(json.dumps(schema[2], sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{CACHE_FORMAT_VERSION}:{digest[:16]}"
+
+
+def cache_scope(stage, config):
+    """
+    Identify the request settings without the prompt, so that similar prompts are only
+    compared against responses from the same stage, provider, model, credential and options
+    (e.g. Ollama's num_ctx, below which the server silently cuts the input).
+
+    Args:
+        stage (str): The pipeline stage (e.g. 'threat_model')
+        config (dict): Provider settings from providers.get_provider_config()
+
+    Returns:
+        str: A sha256 hex digest
+    """
+    params = [arg for arg in config["args"] if arg != config.get("credential")]
+    material = json.dumps(
+        [cache_namespace(config), stage, stage_version(stage), config["provider"], config["model"], params, config.get("options", {})],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def cache_key(stage, prompt, config):
+    """
+    Build the content-addressed key for a provider call.
+
+    Args:
+        stage (str): The pipeline stage (e.g. 'threat_model')
+        prompt (str): The prompt sent to the model
+        config (dict): Provider settings from providers.get_provider_config()
+
+    Returns:
+        str: A sha256 hex digest over the namespace, stage and its output format version, provider, model, parameters and prompt
+    """
+    material = cache_scope(stage, config) + "\n" + prompt
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def is_fallback_response(output):
+    """
+    Check whether a provider function returned an error placeholder instead of a real result.
+    These outputs must not be cached, otherwise a transient failure would be replayed.
+
+    Args:
+        output: The value returned by a provider function
+
+    Returns:
+        bool: True if the output is empty or one of the error fallbacks
+    """
+    if not output:
+        return True
+    if isinstance(output, dict):
+        rows = output.get("threat_model", output.get("Risk Assessment"))
+        if rows is None:
+            return False
+        if not rows:
+            return True
+        return any(isinstance(row, dict) and row.get("Threat Type") == "Error" for row in rows)
+    if isinstance(output, str):
+        text = output.strip()
+        return text.startswith("## Error Generating") or "A[Error Generating Attack Tree]" in text
+    return False
+
+
+def cache_get(stage, prompt, config):
+    """
+    Look up a cached response.
+
+    Args:
+        stage (str): The pipeline stage
+        prompt (str): The prompt sent to the model
+        config (dict): Provider settings from providers.get_provider_config()
+
+    Returns:
+        tuple: (hit, value) where value is the cached output when hit is True
+    """
+    key = cache_key(stage, prompt, config)
+    now = time.time()
+    with _lock:
+        connection = _connect()
+        try:
+            row = connection.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > CACHE_TTL_SECONDS:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                connection.commit()
+                row = None
+            if row is None:
+                _stats["misses"] += 1
+                return False, None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            connection.commit()
+            _stats["hits"] += 1
+            return True, json.loads(row[0])
+        finally:
+            connection.close()
+
+
+def cache_put(stage, prompt, config, output, similarity_text=None):
+    """
+    Store a response, then evict expired and least recently used entries to stay within CACHE_MAX_BYTES.
+    Fallback (error) outputs are ignored.
+
+    Args:
+        stage (str): The pipeline stage
+        prompt (str): The prompt sent to the model
+        config (dict): Provider settings from providers.get_provider_config()
+        output: The value returned by the provider function (must be JSON serializable)
+        similarity_text (str): Optional input text to fingerprint for find_similar_response()
+    """
+    if is_fallback_response(output):
+        return
+    key = cache_key(stage, prompt, config)
+    value = json.dumps(output)
+    signature = json.dumps(minhash_signature(similarity_text)) if similarity_text else None
+    now = time.time()
+    with _lock:
+        connection = _connect()
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, namespace, stage, value, size, created_at, accessed_at, scope, signature) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, cache_namespace(config), stage, value, len(value), now, now, cache_scope(stage, config), signature),
+            )
+            connection.execute("DELETE FROM responses WHERE created_at < ?", (now - CACHE_TTL_SECONDS,))
+            total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > CACHE_MAX_BYTES:
+                for old_key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+                    if total_size <= CACHE_MAX_BYTES:
+                        break
+                    connection.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total_size -= size
+            connection.commit()
+        finally:
+            connection.close()
+
+
+def find_similar_response(stage, prompt, similarity_text, config, threshold):
+    """
+    Find the cached response whose input is most similar to similarity_text.
+    Exact matches are left to cache_get(), so a match here always comes from a different prompt.
+
+    Args:
+        stage (str): The pipeline stage
+        prompt (str): The prompt that would be sent to the model
+        similarity_text (str): The input text to compare, see similarity.similarity_text()
+        config (dict): Provider settings from providers.get_provider_config()
+        threshold (float): Minimum estimated Jaccard similarity (0.0 - 1.0)
+
+    Returns:
+        tuple: (similarity, output) for the best match, or None if nothing reaches the threshold
+    """
+    signature = minhash_signature(similarity_text)
+    exact_key = cache_key(stage, prompt, config)
+    now = time.time()
+    best = None
+    with _lock:
+        connection = _connect()
+        try:
+            rows = connection.execute(
+                "SELECT key, value, signature FROM responses WHERE scope = ? AND signature IS NOT NULL AND created_at >= ? ORDER BY accessed_at DESC LIMIT 500",
+                (cache_scope(stage, config), now - CACHE_TTL_SECONDS),
+            ).fetchall()
+            for key, value, stored_signature in rows:
+                if key == exact_key:
+                    continue
+                similarity = estimate_jaccard(signature, json.loads(stored_signature))
+                if similarity >= threshold and (best is None or similarity > best[0]):
+                    best = (similarity, key, value)
+            if best is None:
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, best[1]))
+            connection.commit()
+            _stats["similar_hits"] += 1
+            return best[0], json.loads(best[2])
+        finally:
+            connection.close()
+
+
+def cached_call(stage, prompt, config, func, similarity_text=None):
+    """
+    Return the cached response for a provider call, or call the provider and cache its output.
+
+    Args:
+        stage (str): The pipeline stage
+        prompt (str): The prompt sent to the model
+        config (dict): Provider settings; caching is skipped when config['use_cache'] is False
+        func (callable): Makes the provider call when there is no cached response
+        similarity_text (str): Optional input text to fingerprint for find_similar_response()
+
+    Returns:
+        The provider output
+    """
+    if not config.get("use_cache", True):
+        return func()
+    hit, output = cache_get(stage, prompt, config)
+    if hit:
+        return output
+    output = func()
+    cache_put(stage, prompt, config, output, similarity_text)
+    return output
+
+
+def get_cache_stats():
+    """
+    Returns:
+        dict: Hit, similar hit and miss counts for this process, plus the number of stored entries
+    """
+    with _lock:
+        connection = _connect()
+        try:
+            entries = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        finally:
+            connection.close()
+        return {"hits": _stats["hits"], "similar_hits": _stats["similar_hits"], "misses": _stats["misses"], "entries": entries}
+
+
+def clear_cache():
+    """Delete every cached response."""
+    with _lock:
+        connection = _connect()
+        try:
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+        finally:
+            connection.close()
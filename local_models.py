@@ -0,0 +1,266 @@
+import os
+import re
+import threading
+import time
+
+from clients import get_http_session, get_lm_studio_client
+from concurrency import start_thread
+from endpoint_pool import parse_endpoints, get_pool_endpoints
+from token_budget import get_token_limits
+
+# --------- Model Discovery --------- #
+
+# Streamlit reruns the whole script on every widget interaction, so the model lists of the
+# local servers are cached per endpoint. A stale list is still shown while a background
+# thread fetches a new one; failures are cached too (for a shorter time) so a server that is
+# down does not add a timeout to every rerun. The sidebar's refresh button drops the entry.
+
+# Seconds a model list is used before it is fetched again in the background
+MODEL_LIST_TTL_SECONDS = float(os.getenv("LOCAL_MODELS_TTL", "300"))
+
+# Seconds a failed fetch is remembered before the server is tried again
+MODEL_LIST_ERROR_TTL_SECONDS = float(os.getenv("LOCAL_MODELS_ERROR_TTL", "30"))
+
+# Seconds to wait for a local server to list its models
+MODEL_LIST_TIMEOUT_SECONDS = 10
+
+# (provider, endpoint) -> {"models", "error", "fetched_at", "refreshing"}
+_model_lists = {}
+_model_lists_lock = threading.Lock()
+
+
+# Function to fetch the names of the models pulled into Ollama
+def fetch_ollama_models(ollama_endpoint):
+    if not ollama_endpoint.endswith('/'):
+        ollama_endpoint = ollama_endpoint + '/'
+    response = get_http_session().get(ollama_endpoint + "api/tags", timeout=MODEL_LIST_TIMEOUT_SECONDS)
+    response.raise_for_status()  # Raise exception for bad status codes
+    return [model['name'] for model in response.json()['models']]
+
+
+# Function to fetch the ids of the models loaded in LM Studio Server
+def fetch_lm_studio_models(lm_studio_endpoint):
+    models = get_lm_studio_client(lm_studio_endpoint).models.list(timeout=MODEL_LIST_TIMEOUT_SECONDS)
+    return [model.id for model in models.data]
+
+
+MODEL_FETCHERS = {
+    "Ollama": fetch_ollama_models,
+    "LM Studio Server": fetch_lm_studio_models,
+}
+
+
+def _fetch_model_list(provider, endpoint):
+    try:
+        entry = {"models": MODEL_FETCHERS[provider](endpoint), "error": None}
+    except Exception as e:
+        entry = {"models": None, "error": e}
+    entry["fetched_at"] = time.monotonic()
+    entry["refreshing"] = False
+    with _model_lists_lock:
+        _model_lists[(provider, endpoint)] = entry
+    return entry
+
+
+def _get_host_model_list(provider, endpoint):
+    key = (provider, endpoint)
+    with _model_lists_lock:
+        entry = _model_lists.get(key)
+        if entry is not None:
+            ttl = MODEL_LIST_ERROR_TTL_SECONDS if entry["error"] is not None else MODEL_LIST_TTL_SECONDS
+            if time.monotonic() - entry["fetched_at"] >= ttl and not entry["refreshing"]:
+                entry["refreshing"] = True
+                start_thread(_fetch_model_list, provider, endpoint)
+
+    if entry is None:
+        entry = _fetch_model_list(provider, endpoint)
+    if entry["error"] is not None:
+        raise entry["error"]
+    return entry["models"]
+
+
+def get_model_list(provider, endpoint):
+    """
+    Get the models available on a local server, from the cache where possible. Only the first
+    call for an endpoint (or the first after refresh_model_list) waits for the server. For an
+    endpoint pool (see endpoint_pool), the models of all its servers are listed.
+
+    Args:
+        provider (str): 'Ollama' or 'LM Studio Server'
+        endpoint (str): The endpoint field: a server URL, or several separated by commas
+
+    Returns:
+        list: The model names, possibly empty
+
+    Raises:
+        Exception: The error of the last fetch, if it failed for every server
+    """
+    models = []
+    errors = []
+    urls = [url for url, _ in parse_endpoints(endpoint)]
+    for url in urls:
+        try:
+            host_models = _get_host_model_list(provider, url)
+        except Exception as e:
+            errors.append(e)
+            continue
+        models.extend(model for model in host_models if model not in models)
+    if len(errors) == len(urls):
+        raise errors[0]
+    return models
+
+
+def refresh_model_list(provider, endpoint):
+    """
+    Forget the cached model list of a local server so the next get_model_list fetches it.
+
+    Args:
+        provider (str): 'Ollama' or 'LM Studio Server'
+        endpoint (str): The endpoint field: a server URL, or several separated by commas
+    """
+    with _model_lists_lock:
+        for url, _ in parse_endpoints(endpoint):
+            _model_lists.pop((provider, url), None)
+
+
+# --------- Ollama Runtime Options --------- #
+
+# Ollama loads a model with a small default context (num_ctx) and silently drops whatever
+# does not fit, and unloads it after five idle minutes. Every Ollama request therefore sends
+# a num_ctx sized from the sidebar's token limit and a keep_alive, and the selected model is
+# loaded in the background as soon as it is chosen. Requests must all use the same num_ctx:
+# Ollama reloads the model whenever it changes.
+
+# How long Ollama keeps the model in memory after a request, e.g. "30m", "1h", or -1 for
+# until Ollama restarts. Can be changed per session in the sidebar.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Context added on top of the token limit (the size of the inputs) for the model's answer
+OLLAMA_OUTPUT_HEADROOM_TOKENS = 4096
+
+# A model is loaded again when selected after this many seconds, in case Ollama unloaded it
+PRELOAD_INTERVAL_SECONDS = 60
+
+# A Go duration (Ollama's format), e.g. "30m" or "1h30m", or a plain number of seconds
+_KEEP_ALIVE_PATTERN = re.compile(r"^-?(\d+(\.\d+)?(ns|us|µs|ms|s|m|h))+$|^-?\d+$")
+
+# (endpoint, model, num_ctx, keep_alive) -> when its last preload finished, or _LOADING
+_preloads = {}
+_preloads_lock = threading.Lock()
+_LOADING = object()
+
+
+def parse_keep_alive(value):
+    """
+    Validate a keep_alive setting.
+
+    Args:
+        value (str): A duration such as "30m", or a number of seconds (negative: keep loaded)
+
+    Returns:
+        str or int: The value to send to Ollama; plain numbers are sent as seconds
+
+    Raises:
+        ValueError: If the value is not a duration Ollama accepts
+    """
+    value = str(value).strip()
+    if not _KEEP_ALIVE_PATTERN.match(value):
+        raise ValueError(f"Invalid keep alive duration: '{value}' (use e.g. 30m, 1h or -1)")
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def get_ollama_options(session_state, model):
+    """
+    Work out the context size and keep_alive for Ollama requests from the session settings.
+
+    Args:
+        session_state: Mapping with the sidebar settings ('token_limit', 'ollama_keep_alive')
+        model (str): The Ollama model name
+
+    Returns:
+        dict: 'num_ctx' and 'keep_alive', passed as keyword arguments to the Ollama functions
+    """
+    limits = get_token_limits("Ollama", model)
+    token_limit = session_state.get("token_limit") or limits["default"]
+    try:
+        keep_alive = parse_keep_alive(session_state.get("ollama_keep_alive") or OLLAMA_KEEP_ALIVE)
+    except ValueError:
+        # The sidebar reports the invalid value; requests use the default meanwhile
+        keep_alive = parse_keep_alive(OLLAMA_KEEP_ALIVE)
+    return {
+        "num_ctx": min(limits["max"], token_limit + OLLAMA_OUTPUT_HEADROOM_TOKENS),
+        "keep_alive": keep_alive,
+    }
+
+
+def ollama_request_fields(max_tokens, num_ctx=None, keep_alive=None):
+    """
+    Build the runtime fields of an Ollama /api/generate or /api/chat request.
+
+    Args:
+        max_tokens (int): The output token limit (num_predict)
+        num_ctx (int): The context window to load the model with
+        keep_alive (str or int): How long to keep the model loaded after the request
+
+    Returns:
+        dict: 'options' and, if set, 'keep_alive', to merge into the request body
+    """
+    options = {}
+    if max_tokens:
+        options["num_predict"] = max_tokens
+    if num_ctx:
+        options["num_ctx"] = num_ctx
+    fields = {"options": options}
+    if keep_alive is not None:
+        fields["keep_alive"] = keep_alive
+    return fields
+
+
+# Function to load a model into Ollama's memory with an empty request
+def _load_ollama_model(ollama_endpoint, ollama_model, num_ctx, keep_alive):
+    if not ollama_endpoint.endswith('/'):
+        ollama_endpoint = ollama_endpoint + '/'
+    data = {"model": ollama_model, **ollama_request_fields(None, num_ctx, keep_alive)}
+    # Loading a large model from disk can take minutes
+    response = get_http_session().post(ollama_endpoint + "api/generate", json=data, timeout=300)
+    response.raise_for_status()
+
+
+def preload_ollama_model(config):
+    """
+    Start loading the configured Ollama model in the background on every server of the
+    endpoint pool, with the same context size and keep_alive as the analysis requests, so the
+    first stage does not wait for it. Skips servers that loaded it recently or are loading it.
+
+    Args:
+        config (dict): Ollama settings from providers.get_provider_config()
+
+    Returns:
+        int: The number of servers a load was started on
+    """
+    ollama_model = config["model"]
+    options = config["options"]
+    started = 0
+    for ollama_endpoint in get_pool_endpoints(config):
+        key = (ollama_endpoint, ollama_model, options["num_ctx"], options["keep_alive"])
+        now = time.monotonic()
+        with _preloads_lock:
+            last = _preloads.get(key)
+            if last is not None and (last is _LOADING or now - last < PRELOAD_INTERVAL_SECONDS):
+                continue
+            _preloads[key] = _LOADING
+        start_thread(_preload, key)
+        started += 1
+    return started
+
+
+def _preload(key):
+    ollama_endpoint, ollama_model, num_ctx, keep_alive = key
+    try:
+        _load_ollama_model(ollama_endpoint, ollama_model, num_ctx, keep_alive)
+    except Exception:
+        # Not fatal: the first request loads the model instead, and reports any error.
+        # A failed load is also only retried after PRELOAD_INTERVAL_SECONDS.
+        pass
+    with _preloads_lock:
+        _preloads[key] = time.monotonic()
@@ -3,35 +3,46 @@
 import base64
 import streamlit as st
 import streamlit.components.v1 as components
-from github import Github
-from collections import defaultdict
-import re
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
 import requests
 import json
-import tiktoken
+import time
 
-from threat_model import create_threat_model_prompt, get_threat_model, get_threat_model_azure, get_threat_model_google, get_threat_model_mistral, get_threat_model_ollama, get_threat_model_anthropic, get_threat_model_lm_studio, get_threat_model_groq, json_to_markdown, get_image_analysis, create_image_analysis_prompt
-from attack_tree import create_attack_tree_prompt, get_attack_tree, get_attack_tree_azure, get_attack_tree_mistral, get_attack_tree_ollama, get_attack_tree_anthropic, get_attack_tree_lm_studio, get_attack_tree_groq, get_attack_tree_google
-from mitigations import create_mitigations_prompt, get_mitigations, get_mitigations_azure, get_mitigations_google, get_mitigations_mistral, get_mitigations_ollama, get_mitigations_anthropic, get_mitigations_lm_studio, get_mitigations_groq
-from test_cases import create_test_cases_prompt, get_test_cases, get_test_cases_azure, get_test_cases_google, get_test_cases_mistral, get_test_cases_ollama, get_test_cases_anthropic, get_test_cases_lm_studio, get_test_cases_groq
-from dread import create_dread_assessment_prompt, get_dread_assessment, get_dread_assessment_azure, get_dread_assessment_google, get_dread_assessment_mistral, get_dread_assessment_ollama, get_dread_assessment_anthropic, get_dread_assessment_lm_studio, get_dread_assessment_groq, dread_json_to_markdown
+from threat_model import create_threat_model_prompt, json_to_markdown, get_image_analysis, create_image_analysis_prompt
+from attack_tree import create_attack_tree_prompt
+from mitigations import create_mitigations_prompt, stream_mitigations
+from test_cases import create_test_cases_prompt, stream_test_cases
+from dread import create_dread_assessment_prompt, dread_json_to_markdown
 from report_generator import generate_pdf, generate_report
-from expert_red_agent import run_expert_agent
+from expert_red_agent import stream_expert_agent, create_expert_agent_prompt
+from providers import get_provider_config, call_stage, stream_stage, AZURE_API_VERSION
+from llm_cache import get_cache_stats, clear_cache, find_similar_response
+from similarity import similarity_text
+from singleflight import get_singleflight_stats
+from circuit_breaker import get_open_circuits, CircuitOpenError
+from hedging import get_hedge_stats
+from prompt_cache import get_prompt_cache_stats
+from instrumentation import get_call_stats, get_latency_histogram
+from pipeline import run_full_pipeline_async
+from concurrency import run_async
+from streaming import REASONING
+from token_budget import model_token_limits
+from local_models import OLLAMA_KEEP_ALIVE, parse_keep_alive, preload_ollama_model, get_model_list, refresh_model_list
+from endpoint_pool import parse_endpoints, get_pool_status
+from repo_analysis import analyze_files, read_github_api, read_github_archive, read_local_repository, GITHUB_FETCH_CONCURRENCY, GITHUB_INGESTION, LOCAL_REPOSITORY_ROOTS
+from summary_cache import get_summary_cache_stats, clear_summary_cache
+from lazy_imports import lazy_import
+
+# Only needed for GitHub analysis, so imported on first use
+github = lazy_import("github")
 
 # ------------------ Helper Functions ------------------ #
 
 # Function to get available models from LM Studio Server
 def get_lm_studio_models(endpoint):
     try:
-        client = OpenAI(
-            base_url=f"{endpoint}/v1",
-            api_key="not-needed"
-        )
-        models = client.models.list()
-        return [model.id for model in models.data]
+        return get_model_list("LM Studio Server", endpoint)
     except requests.exceptions.ConnectionError:
         st.error("""Unable to connect to LM Studio Server. Please ensure:
 1. LM Studio is running and the local server is started
@@ -50,28 +61,16 @@ Please check:
 def get_ollama_models(ollama_endpoint):
     """
     Get list of available models from Ollama.
+    The list is cached per endpoint and refreshed in the background (see local_models).
     
     Args:
         ollama_endpoint (str): The URL of the Ollama endpoint (e.g., 'http://localhost:11434')
         
     Returns:
         list: List of available model names
-        
-    Raises:
-        requests.exceptions.RequestException: If there's an error communicating with the Ollama endpoint
     """
-    if not ollama_endpoint.endswith('/'):
-        ollama_endpoint = ollama_endpoint + '/'
-    
-    url = ollama_endpoint + "api/tags"
-    
     try:
-        response = requests.get(url, timeout=10)  # Add timeout
-        response.raise_for_status()  # Raise exception for bad status codes
-        models_data = response.json()
-        
-        # Extract model names from the response
-        model_names = [model['name'] for model in models_data['models']]
+        model_names = get_model_list("Ollama", ollama_endpoint)
         if not model_names:
             st.warning("""No models found in Ollama. Please ensure you have:
 1. Pulled at least one model using 'ollama pull <model_name>'
@@ -105,16 +104,51 @@ Please check:
 3. You have sufficient system resources""")
         return ["local-model"]
 
+# Function to show the state of each server of a local endpoint pool in the sidebar
+def show_endpoint_pool_status(model_provider, endpoint):
+    for host in get_pool_status(model_provider, endpoint):
+        state = "ejected" if host["ejected"] else f"{host['outstanding']}/{host['slots']} busy"
+        if host["loaded_models"]:
+            state += f", loaded: {', '.join(host['loaded_models'])}"
+        if host["latency_seconds"] is not None:
+            state += f", ~{host['latency_seconds']:.1f}s per call"
+        st.caption(f"{host['endpoint']}: {state}")
+
+# Function to check whether the repository input names a local directory rather than a GitHub repository
+def is_local_repository_input(value):
+    if not LOCAL_REPOSITORY_ROOTS or value.startswith(('http://', 'https://')):
+        return False
+    path = os.path.expanduser(value)
+    return os.path.isabs(path) or os.path.exists(path)
+
 # Function to get user input for the application description and key details
 def get_input():
     github_url = st.text_input(
-        label="Enter GitHub repository URL (optional)",
+        label="Enter GitHub repository URL or local path (optional)",
         placeholder="https://github.com/owner/repo",
         key="github_url",
-        help="Enter the URL of the GitHub repository you want to analyze.",
+        help="Enter the URL of the GitHub repository you want to analyze, or the path of a local directory or git repository (when enabled with LOCAL_REPOSITORY_ROOTS).",
     )
 
-    if github_url and github_url != st.session_state.get('last_analyzed_url', ''):
+    # Local directories and git repositories are read from disk instead of GitHub
+    if github_url and is_local_repository_input(github_url):
+        local_ref = st.text_input(
+            label="Git branch, tag or commit to analyze (optional)",
+            key="local_repo_ref",
+            help="Leave empty to analyze the files in the directory as they are, including uncommitted changes. Bare repositories are read at HEAD by default.",
+        )
+        analysis_key = f"{github_url}@{local_ref}"
+        if analysis_key != st.session_state.get('last_analyzed_url', ''):
+            try:
+                with st.spinner('Analyzing local repository...'):
+                    system_description = analyze_local_repo(github_url, local_ref)
+            except (ValueError, OSError) as e:
+                st.error(str(e))
+            else:
+                st.session_state['github_analysis'] = system_description
+                st.session_state['last_analyzed_url'] = analysis_key
+                st.session_state['app_input'] = system_description + "\n\n" + st.session_state.get('app_input', '')
+    elif github_url and github_url != st.session_state.get('last_analyzed_url', ''):
         if 'github_api_key' not in st.session_state or not st.session_state['github_api_key']:
             st.warning("Please enter a GitHub API key to analyze the repository.")
         else:
@@ -137,36 +171,14 @@ def get_input():
 
     return input_text
 
-def estimate_tokens(text, model="gpt-4o"):
-    """
-    Estimate the number of tokens in a text string.
-    Uses tiktoken for OpenAI models, or falls back to a character-based approximation.
-     
-    Args:
-        text: The text to estimate tokens for
-        model: The model to use for estimation (default: gpt-4o)
-         
-    Returns:
-        Estimated token count
-    """
-    try:
-        # Try to use tiktoken for accurate estimation
-        enc = tiktoken.encoding_for_model(model)
-        return len(enc.encode(text))
-    except (ImportError, KeyError, ValueError):
-        # Fall back to character-based approximation
-        # Different languages have different token densities
-        # English: ~4 chars per token, Chinese: ~1-2 chars per token
-        return len(text) // 4  # Conservative estimate for English text
-
 def analyze_github_repo(repo_url):
     # Extract owner and repo name from URL
     parts = repo_url.split('/')
     owner = parts[-2]
     repo_name = parts[-1]
 
-    # Initialize PyGithub
-    g = Github(st.session_state.get('github_api_key', ''))
+    # Initialize PyGithub, with a connection per concurrent file download
+    g = github.Github(st.session_state.get('github_api_key', ''), pool_size=GITHUB_FETCH_CONCURRENCY)
 
     # Get the repository
     repo = g.get_repo(f"{owner}/{repo_name}")
@@ -174,13 +186,24 @@ def analyze_github_repo(repo_url):
     # Get the default branch
     default_branch = repo.default_branch
 
-    # Get the tree of the default branch
-    tree = repo.get_git_tree(default_branch, recursive=True)
+    # Read the whole repository in one download, or file by file through the API
+    def read_repository(token_estimation_model, progress):
+        if st.session_state.get('github_ingestion', GITHUB_INGESTION) == "archive":
+            return read_github_archive(repo, default_branch, token_estimation_model, progress)
+        return read_github_api(repo, default_branch, token_estimation_model)
 
-    # Analyze files
-    file_summaries = defaultdict(list)
-    total_tokens = 0
-     
+    return run_repo_analysis(repo_url, read_repository)
+
+def analyze_local_repo(path, ref=""):
+    # Read the files on disk, or the given ref from git
+    def read_repository(token_estimation_model, progress):
+        return read_local_repository(path, ref, token_estimation_model)
+
+    label = f"{path} ({ref})" if ref else path
+    return run_repo_analysis(label, read_repository)
+
+# Function to summarize a repository within the configured token limit, showing progress
+def run_repo_analysis(repo_label, read_repository):
     # Get the configured token limit from session state, or use a default
     token_limit = st.session_state.get('token_limit', 64000)
      
@@ -193,126 +216,28 @@ def analyze_github_repo(repo_url):
     if model_provider == "OpenAI API":
         token_estimation_model = selected_model
      
-    # Reserve some tokens for the model's response (typically 20-30% of the context window)
-    # This ensures the model has enough space to generate a response
-    analysis_token_limit = int(token_limit * 0.7)
-     
-    # Progress bar for GitHub analysis
+    # Progress bar for repository analysis
     progress_bar = st.progress(0)
     status_text = st.empty()
     status_text.text("Analyzing repository structure...")
-     
-    # First, get the README to prioritize it
-    readme_content = ""
 
-    readme_tokens = 0
-    try:
-        readme_file = repo.get_contents("README.md", ref=default_branch)
-        readme_content = base64.b64decode(readme_file.content).decode()
-        readme_tokens = estimate_tokens(readme_content, token_estimation_model)
-    except:
-        try:
-            # Try lowercase readme.md as fallback
-            readme_file = repo.get_contents("readme.md", ref=default_branch)
-            readme_content = base64.b64decode(readme_file.content).decode()
-            readme_tokens = estimate_tokens(readme_content, token_estimation_model)
-        except:
-            st.warning("No README.md found in the repository.")
-     
-    # Calculate how many tokens we can use for code analysis
-    # Reserve at least 30% of the token limit for code analysis
-    code_token_limit = max(int(analysis_token_limit * 0.3), analysis_token_limit - readme_tokens)
-     
-    # If README is too large, truncate it
-    if readme_tokens > analysis_token_limit * 0.7:
-        # Truncate README to 70% of the analysis token limit
-        truncation_ratio = (analysis_token_limit * 0.7) / readme_tokens
-        max_readme_chars = int(len(readme_content) * truncation_ratio)
-        readme_content = readme_content[:max_readme_chars] + "...\n(README truncated due to length)\n\n"
-        readme_tokens = estimate_tokens(readme_content, token_estimation_model)
-     
+    def progress(fraction, text):
+        progress_bar.progress(min(fraction, 1.0))
+        status_text.text(text)
+
+    readme_content, files, read_files = read_repository(token_estimation_model, progress)
+    if not readme_content:
+        st.warning("No README.md found in the repository.")
+
     # Update progress
-    progress_bar.progress(0.2)
-    status_text.text("Analyzing code files...")
-     
-    # Get all code files
-    code_files = [file for file in tree.tree if file.type == "blob" and file.path.endswith(
-        ('.py', '.js', '.ts', '.html', '.css', '.java', '.go', '.rb', '.c', '.cpp', '.h', '.cs', '.php')
-    )]
-     
-    # Sort files by importance (you can customize this logic)
-    # For example, prioritize main files, configuration files, etc.
-    def file_importance(file):
-        # Lower score means higher importance
-        if file.path.lower() in ['main.py', 'app.py', 'index.js', 'package.json', 'config.json']:
-            return 0
-        if 'test' in file.path.lower() or 'spec' in file.path.lower():
-            return 3
-        if file.path.endswith(('.py', '.js', '.ts', '.java', '.go')):
-            return 1
-        return 2
-     
-    code_files.sort(key=file_importance)
-     
-    # Process files until we reach the token limit
-    total_tokens = readme_tokens
-    file_count = len(code_files)
-    processed_files = 0
-     
-    for i, file in enumerate(code_files):
-        # Update progress
-        progress_percent = 0.2 + (0.8 * (i / file_count))
-        progress_bar.progress(min(progress_percent, 1.0))
-        status_text.text(f"Analyzing file {i+1}/{file_count}: {file.path}")
-         
-        try:
-             
-            content = repo.get_contents(file.path, ref=default_branch)
-            decoded_content = base64.b64decode(content.content).decode()
-            
-            # Summarize the file content
-            summary = summarize_file(file.path, decoded_content)
-            summary_tokens = estimate_tokens(summary, token_estimation_model)
-                        
-            # Check if adding this summary would exceed our token limit
-            if total_tokens + summary_tokens > analysis_token_limit:
-                # If we're about to exceed the limit, add a note and stop processing
-                file_summaries["info"].append(f"Analysis truncated: {file_count - i} more files not analyzed due to token limit.")
-                break
-                        
-            file_summaries[file.path.split('.')[-1]].append(summary)
-            total_tokens += summary_tokens
-            processed_files += 1
-        except Exception as e:
-            # Skip files that can't be decoded
-            continue
+    progress(0.2, "Analyzing code files...")
+
+    system_description, estimated_total_tokens = analyze_files(repo_label, readme_content, files, read_files, token_limit, token_estimation_model, progress)
      
     # Clear progress indicators
     progress_bar.empty()
     status_text.empty()
      
-
-    # Compile the analysis into a system description
-    system_description = f"Repository: {repo_url}\n\n"
-    
-    if readme_content:
-        system_description += "README.md Content:\n"
-        system_description += readme_content + "\n\n"
-
-    for file_type, summaries in file_summaries.items():
-        system_description += f"{file_type.upper()} Files:\n"
-        for summary in summaries:
-            system_description += summary + "\n"
-        system_description += "\n"
-
-    
-    # Add token usage information
-    estimated_total_tokens = estimate_tokens(system_description, token_estimation_model)
-    system_description += f"\nRepository Analysis Summary:\n"
-    system_description += f"- Files analyzed: {processed_files} of {file_count} total files\n"
-    system_description += f"- Token usage estimate: ~{estimated_total_tokens} tokens\n"
-    system_description += f"- Token limit configured: {token_limit} tokens\n"
-     
     # Show a warning if we're close to the token limit
     if estimated_total_tokens > token_limit * 0.9:
         st.warning(f"⚠️ The GitHub analysis is using approximately {estimated_total_tokens} tokens, which is close to your configured limit of {token_limit}. Consider increasing the token limit in the sidebar settings if you need more comprehensive analysis.")
@@ -320,98 +245,6 @@ def analyze_github_repo(repo_url):
 
     return system_description
 
-def summarize_file(file_path, content):
-    """
-    Summarize a file's content by extracting key components.
-    Adapts the level of detail based on file size and importance.
-     
-    Args:
-        file_path: Path to the file
-        content: Content of the file
-         
-    Returns:
-        A string summary of the file
-    """
-    # Determine file type
-    file_ext = file_path.split('.')[-1].lower() if '.' in file_path else ''
-     
-     # Initialize summary
-    summary = f"File: {file_path}\n"
-    
-    # For very large files, be more selective
-    is_large_file = len(content) > 10000
-     
-    # Extract imports based on file type
-    imports = []
-    if file_ext in ['py']:
-        imports = re.findall(r'^import .*|^from .* import .*', content, re.MULTILINE)
-    elif file_ext in ['js', 'ts']:
-        imports = re.findall(r'^import .*|^const .* = require\(.*\)|^import .* from .*', content, re.MULTILINE)
-    elif file_ext in ['java']:
-        imports = re.findall(r'^import .*;', content, re.MULTILINE)
-    elif file_ext in ['go']:
-        imports = re.findall(r'^import \(.*?\)|^import ".*"', content, re.MULTILINE | re.DOTALL)
-     
-    # Extract functions based on file type
-    functions = []
-    if file_ext in ['py']:
-        functions = re.findall(r'def .*\(.*\):', content, re.MULTILINE)
-    elif file_ext in ['js', 'ts']:
-        functions = re.findall(r'function .*\(.*\) {|const .* = \(.*\) =>|.*: function\(.*\)', content, re.MULTILINE)
-    elif file_ext in ['java', 'c', 'cpp', 'cs']:
-        functions = re.findall(r'(public|private|protected|static|\s) +[\w\<\>\[\]]+\s+(\w+) *\([^\)]*\) *(\{?|[^;])', content, re.MULTILINE)
-        functions = [' '.join(f).strip() for f in functions]
-    elif file_ext in ['go']:
-        functions = re.findall(r'func .*\(.*\).*{', content, re.MULTILINE)
-     
-    # Extract classes based on file type
-    classes = []
-    if file_ext in ['py']:
-        classes = re.findall(r'class .*:', content, re.MULTILINE)
-    elif file_ext in ['js', 'ts']:
-        classes = re.findall(r'class .* {', content, re.MULTILINE)
-    elif file_ext in ['java', 'c', 'cpp', 'cs']:
-        classes = re.findall(r'(public|private|protected|static|\s) +(class|interface) +(\w+)', content, re.MULTILINE)
-        classes = [' '.join(c).strip() for c in classes]
-     
-    # Add imports to summary (limit based on file size)
-    import_limit = 5 if not is_large_file else 3
-    
-    if imports: 
-        summary += "Imports:\n" + "\n".join(imports[:import_limit])
-        if len(imports) > import_limit:
-            summary += f"\n... ({len(imports) - import_limit} more imports)"
-        summary += "\n"
-     
-    # Add classes to summary (limit based on file size)
-    class_limit = 5 if not is_large_file else 3
-    if classes:
-        summary += "Classes:\n" + "\n".join(classes[:class_limit])
-        if len(classes) > class_limit:
-            summary += f"\n... ({len(classes) - class_limit} more classes)"
-        summary += "\n"
-     
-    # Add functions to summary (limit based on file size)
-    function_limit = 10 if not is_large_file else 5
-    if functions:
-        summary += "Functions:\n" + "\n".join(functions[:function_limit])
-        if len(functions) > function_limit:
-            summary += f"\n... ({len(functions) - function_limit} more functions)"
-        summary += "\n"
-     
-    # For configuration files (JSON, YAML, etc.), try to extract key information
-    if file_ext in ['json', 'yaml', 'yml', 'toml', 'ini']:
-        # Just include a snippet of the beginning for config files
-        config_preview = content[:500] + ("..." if len(content) > 500 else "")
-        summary += "Configuration Content Preview:\n" + config_preview + "\n"
-     
-    # For README or documentation files, include a brief excerpt
-    if 'readme' in file_path.lower() or file_ext in ['md', 'rst', 'txt']:
-        doc_preview = content[:300] + ("..." if len(content) > 300 else "")
-        summary += "Content Preview:\n" + doc_preview + "\n"
-
-    return summary
-
 # Function to render Mermaid diagram
 def mermaid(code: str, height: int = 500) -> None:
     components.html(
@@ -428,6 +261,189 @@ def mermaid(code: str, height: int = 500) -> None:
         height=height,
     )
 
+# Functions to render each stage's output with its download buttons
+def render_threat_model(markdown_output):
+    # Display the threat model in Markdown
+    st.markdown(markdown_output)
+
+    # Add a button to allow the user to download the output as a Markdown file
+    st.download_button(
+        label="Download Threat Model",
+        data=markdown_output,  # Use the Markdown output
+        file_name="threat_model.md",
+        mime="text/markdown",
+    )
+
+def render_attack_tree(mermaid_code):
+    # Display the generated attack tree code
+    st.write("Attack Tree Code:")
+    st.code(mermaid_code)
+
+    # Visualise the attack tree using the Mermaid custom component
+    st.write("Attack Tree Diagram Preview:")
+    mermaid(mermaid_code)
+
+    col1, col2, col3, col4, col5 = st.columns([1,1,1,1,1])
+
+    with col1:
+        # Add a button to allow the user to download the Mermaid code
+        st.download_button(
+            label="Download Diagram Code",
+            data=mermaid_code,
+            file_name="attack_tree.md",
+            mime="text/plain",
+            help="Download the Mermaid code for the attack tree diagram."
+        )
+
+    with col2:
+        # Add a button to allow the user to open the Mermaid Live editor
+        st.link_button("Open Mermaid Live", "https://mermaid.live")
+
+    with col3:
+        # Blank placeholder
+        st.write("")
+
+    with col4:
+        # Blank placeholder
+        st.write("")
+
+    with col5:
+        # Blank placeholder
+        st.write("")
+
+def render_stream(events):
+    """
+    Render a streamed response progressively and return the final answer text.
+    Reasoning (<think> blocks, Anthropic thinking) is shown in a separate expander.
+
+    Args:
+        events: (kind, text) events from streaming.stream_completion()
+
+    Returns:
+        str: The complete answer text
+    """
+    reasoning_placeholder = st.empty()
+    text_placeholder = st.empty()
+    reasoning = ""
+    text = ""
+    last_render = 0.0
+
+    def render(final=False):
+        if reasoning:
+            with reasoning_placeholder.container():
+                # Keep the reasoning open until the answer starts arriving
+                with st.expander("View the model's reasoning", expanded=not text and not final):
+                    st.markdown(reasoning)
+        text_placeholder.markdown(text if final else text + "▌")
+
+    try:
+        for kind, delta in events:
+            if kind == REASONING:
+                reasoning += delta
+            else:
+                text += delta
+            # Re-rendering on every delta slows the page down, so throttle the updates
+            if time.monotonic() - last_render >= 0.1:
+                render()
+                last_render = time.monotonic()
+    except Exception:
+        # Remove the partial output so a retry starts from a clean slate
+        reasoning_placeholder.empty()
+        text_placeholder.empty()
+        raise
+
+    render(final=True)
+    return text
+
+def offer_similar_result(stage, prompt, input_text, config, regenerate_key):
+    """
+    Look for a cached result whose input is similar to the current one and, if there is one,
+    tell the user and offer to regenerate. Clicking "Regenerate anyway" sets
+    st.session_state[regenerate_key] so the next run skips this lookup.
+
+    Args:
+        stage (str): The pipeline stage (e.g. 'threat_model')
+        prompt (str): The prompt that would be sent to the model
+        input_text (str): The user input to compare, see similarity.similarity_text()
+        config (dict): Provider settings from get_provider_config()
+        regenerate_key (str): Session state flag set by the "Regenerate anyway" button
+
+    Returns:
+        The cached output, or None if no similar result should be used
+    """
+    if not config.get("use_cache", True) or not st.session_state.get("use_similar_cache", True):
+        return None
+    match = find_similar_response(stage, prompt, input_text, config, st.session_state.get("similarity_threshold", 0.8))
+    if match is None:
+        return None
+
+    similarity, output = match
+    st.info(f"Showing a cached result for a {similarity:.0%} similar input.")
+    st.button(
+        "Regenerate anyway",
+        key=f"{regenerate_key}_button",
+        on_click=lambda: st.session_state.update({regenerate_key: True}),
+    )
+    return output
+
+def provider_callbacks(action):
+    # Create the callbacks that tell the user when a provider call is retried or handed to the fallback provider
+    def on_retry(next_attempt, max_attempts, error):
+        st.warning(f"Error {action}. Retrying attempt {next_attempt}/{max_attempts}...")
+
+    def on_failover(config, fallback, error):
+        reason = str(error) if isinstance(error, CircuitOpenError) else f"{config['provider']} ({config['model']}) is unavailable ({error})"
+        st.warning(f"{reason}. Using the fallback {fallback['provider']} ({fallback['model']}) instead.")
+
+    return {"on_retry": on_retry, "on_failover": on_failover}
+
+def render_mitigations(mitigations_markdown, show_markdown=True):
+    # Display the suggested mitigations in Markdown (already on the page when streamed)
+    if show_markdown:
+        st.markdown(mitigations_markdown)
+    st.markdown("")
+
+    # Add a button to allow the user to download the mitigations as a Markdown file
+    st.download_button(
+        label="Download Mitigations",
+        data=mitigations_markdown,
+        file_name="mitigations.md",
+        mime="text/markdown",
+    )
+
+def render_dread_assessment(dread_assessment):
+    # Convert the DREAD assessment JSON to Markdown
+    dread_assessment_markdown = dread_json_to_markdown(dread_assessment)
+
+    # Display the DREAD assessment with a header
+    st.markdown("## DREAD Risk Assessment")
+    st.markdown("The table below shows the DREAD risk assessment for each identified threat. The Risk Score is calculated as the average of the five DREAD categories.")
+
+    # Display the DREAD assessment in Markdown format
+    st.markdown(dread_assessment_markdown, unsafe_allow_html=False)
+
+    # Add a button to allow the user to download the DREAD assessment as a Markdown file
+    st.download_button(
+        label="Download DREAD Risk Assessment",
+        data=dread_assessment_markdown,
+        file_name="dread_assessment.md",
+        mime="text/markdown",
+    )
+
+def render_test_cases(test_cases_markdown, show_markdown=True):
+    # Display the test cases in Markdown (already on the page when streamed)
+    if show_markdown:
+        st.markdown(test_cases_markdown)
+    st.markdown("")
+
+    # Add a button to allow the user to download the test cases as a Markdown file
+    st.download_button(
+        label="Download Test Cases",
+        data=test_cases_markdown,
+        file_name="test_cases.md",
+        mime="text/markdown",
+    )
+
 def load_env_variables():
     # Try to load from .env file
     if os.path.exists('.env'):
@@ -479,53 +495,17 @@ def load_env_variables():
     lm_studio_endpoint = os.getenv('LM_STUDIO_ENDPOINT', 'http://localhost:1234')
     st.session_state['lm_studio_endpoint'] = lm_studio_endpoint
 
+    # Load the fallback provider used when the selected provider is unavailable
+    if 'fallback_provider' not in st.session_state:
+        st.session_state['fallback_provider'] = os.getenv('LLM_FALLBACK_PROVIDER', 'None')
+    if 'fallback_model' not in st.session_state:
+        st.session_state['fallback_model'] = os.getenv('LLM_FALLBACK_MODEL', '')
+
 
 # Call this function at the start of your app
 load_env_variables()
 
 # ------------------ Streamlit UI Configuration ------------------ #
-# ------------------ Model Token Limits ------------------ #
- 
-# Define token limits for specific model+provider combinations
-# Format: {"provider:model": {"default": default_value, "max": max_value}}
-model_token_limits = {
-    # OpenAI models
-    "OpenAI API:gpt-4.5-preview": {"default": 64000, "max": 128000},
-    "OpenAI API:gpt-4o": {"default": 64000, "max": 128000},
-    "OpenAI API:gpt-4o-mini": {"default": 64000, "max": 128000},
-    "OpenAI API:o1": {"default": 64000, "max": 200000},
-    "OpenAI API:o3-mini": {"default": 64000, "max": 200000},
-    
-    # Claude models
-    "Anthropic API:claude-3-7-sonnet-latest": {"default": 64000, "max": 200000},
-    "Anthropic API:claude-3-7-sonnet-thinking": {"default": 64000, "max": 200000},
-    "Anthropic API:claude-3-5-sonnet-latest": {"default": 64000, "max": 200000},
-    "Anthropic API:claude-3-5-haiku-latest": {"default": 64000, "max": 200000},
-    
-    # Mistral models
-    "Mistral API:mistral-large-latest": {"default": 64000, "max": 131000},
-    "Mistral API:mistral-small-latest": {"default": 16000, "max": 32000},
-    
-    # Google models
-    "Google AI API:gemini-2.0-flash": {"default": 120000, "max": 1000000},
-    "Google AI API:gemini-2.0-flash-lite": {"default": 120000, "max": 1000000},
-    "Google AI API:gemini-1.5-pro": {"default": 240000, "max": 2000000},
-    
-    # Groq models
-    "Groq API:deepseek-r1-distill-llama-70b": {"default": 64000, "max": 128000},
-    "Groq API:llama-3.3-70b-versatile": {"default": 64000, "max": 128000},
-    "Groq API:llama-3.1-8b-instant": {"default": 64000, "max": 128000},
-    "Groq API:mixtral-8x7b-32768": {"default": 16000, "max": 32000},
-    "Groq API:gemma-9b-it": {"default": 4000, "max": 8192},
-    
-    # Azure models - conservative defaults
-    "Azure OpenAI Service:default": {"default": 64000, "max": 128000},
-    
-    # Ollama and LM Studio - conservative defaults
-    "Ollama:default": {"default": 8000, "max": 32000},
-    "LM Studio Server:default": {"default": 8000, "max": 32000}
-}
- 
 st.set_page_config(
     page_title="RISK GPT",
     page_icon=":shield:",
@@ -706,7 +686,8 @@ with st.sidebar:
         
         st.info("Please note that you must use an 1106-preview model deployment.")
 
-        azure_api_version = '2023-12-01-preview' # Update this as needed
+        azure_api_version = AZURE_API_VERSION # Update this as needed in providers.py
+        st.session_state['azure_api_version'] = azure_api_version
 
         st.write(f"Azure API Version: {azure_api_version}")
 
@@ -776,26 +757,48 @@ with st.sidebar:
         ollama_endpoint = st.text_input(
             "Enter your Ollama endpoint:",
             value=st.session_state.get('ollama_endpoint', 'http://localhost:11434'),
-            help="The URL of your Ollama instance. Default is http://localhost:11434 for local installations.",
+            help="The URL of your Ollama instance. Default is http://localhost:11434 for local installations. To spread requests over several instances, separate their URLs with commas and add #N to a URL that serves N requests in parallel, e.g. http://gpu1:11434#4, http://gpu2:11434#2.",
         )
+        endpoints = ()
         if ollama_endpoint:
             # Basic URL validation
-            if not ollama_endpoint.startswith(('http://', 'https://')):
-                st.error("Endpoint URL must start with http:// or https://")
-            else:
+            try:
+                endpoints = parse_endpoints(ollama_endpoint)
+            except ValueError as e:
+                st.error(str(e))
+            if endpoints:
                 st.session_state['ollama_endpoint'] = ollama_endpoint
+                # The model list is cached; fetch it again when models were added or removed
+                if st.button("Refresh models", key="refresh_ollama_models", help="Fetch the list of models from Ollama again."):
+                    refresh_model_list("Ollama", ollama_endpoint)
                 # Fetch available models from Ollama
                 available_models = get_ollama_models(ollama_endpoint)
 
         # Add model selection input field
         selected_model = st.selectbox(
             "Select the model you would like to use:",
-            available_models if ollama_endpoint and ollama_endpoint.startswith(('http://', 'https://')) else ["local-model"],
+            available_models if endpoints else ["local-model"],
             key="selected_model",
             on_change=on_model_selection_change,
             help="Select a model from your local Ollama instance. If you don't see any models, make sure Ollama is running and has models installed."
         )
 
+        # Show how requests are spread over the endpoint pool
+        if len(endpoints) > 1:
+            show_endpoint_pool_status("Ollama", st.session_state['ollama_endpoint'])
+
+        # Keep the model in memory between stages and analyses
+        ollama_keep_alive = st.text_input(
+            "Keep the model loaded for:",
+            value=st.session_state.get('ollama_keep_alive', OLLAMA_KEEP_ALIVE),
+            help="How long Ollama keeps the model in memory after each request, e.g. 30m or 1h. Use -1 to keep it loaded until Ollama restarts, or 0 to unload it straight away.",
+        )
+        try:
+            parse_keep_alive(ollama_keep_alive)
+            st.session_state['ollama_keep_alive'] = ollama_keep_alive
+        except ValueError as e:
+            st.error(str(e))
+
     if model_provider == "LM Studio Server":
         st.markdown(
         """
@@ -808,26 +811,36 @@ with st.sidebar:
         lm_studio_endpoint = st.text_input(
             "Enter your LM Studio Server endpoint:",
             value=st.session_state.get('lm_studio_endpoint', 'http://localhost:1234'),
-            help="The URL of your LM Studio Server instance. Default is http://localhost:1234 for local installations.",
+            help="The URL of your LM Studio Server instance. Default is http://localhost:1234 for local installations. To spread requests over several servers, separate their URLs with commas and add #N to a URL that serves N requests in parallel.",
         )
+        endpoints = ()
         if lm_studio_endpoint:
             # Basic URL validation
-            if not lm_studio_endpoint.startswith(('http://', 'https://')):
-                st.error("Endpoint URL must start with http:// or https://")
-            else:
+            try:
+                endpoints = parse_endpoints(lm_studio_endpoint)
+            except ValueError as e:
+                st.error(str(e))
+            if endpoints:
                 st.session_state['lm_studio_endpoint'] = lm_studio_endpoint
+                # The model list is cached; fetch it again when models were added or removed
+                if st.button("Refresh models", key="refresh_lm_studio_models", help="Fetch the list of models from LM Studio Server again."):
+                    refresh_model_list("LM Studio Server", lm_studio_endpoint)
                 # Fetch available models from LM Studio Server
                 available_models = get_lm_studio_models(lm_studio_endpoint)
 
         # Add model selection input field
         selected_model = st.selectbox(
             "Select the model you would like to use:",
-            available_models if lm_studio_endpoint and lm_studio_endpoint.startswith(('http://', 'https://')) else ["local-model"],
+            available_models if endpoints else ["local-model"],
             key="selected_model",
             on_change=on_model_selection_change,
             help="Select a model from your local LM Studio Server. If you don't see any models, make sure LM Studio Server is running with models loaded."
         )
 
+        # Show how requests are spread over the endpoint pool
+        if len(endpoints) > 1:
+            show_endpoint_pool_status("LM Studio Server", st.session_state['lm_studio_endpoint'])
+
     if model_provider == "Groq API":
         st.markdown(
         """
@@ -873,6 +886,16 @@ with st.sidebar:
     if github_api_key:
         st.session_state['github_api_key'] = github_api_key
 
+    # Choose how repositories are read
+    st.radio(
+        "Read GitHub repositories:",
+        ["archive", "api"],
+        index=0 if GITHUB_INGESTION == "archive" else 1,
+        format_func=lambda option: {"archive": "As one archive download", "api": "File by file through the API"}[option],
+        key="github_ingestion",
+        help="Downloading the repository archive takes a single request, however large the repository. Reading file by file only downloads the files that fit in the token limit, but uses one API request per file.",
+    )
+
     # Add Advanced Settings section with token limit configuration
     with st.expander("Advanced Settings"):
      
@@ -918,6 +941,121 @@ with st.sidebar:
         # Store the token limit in session state
         st.session_state['token_limit'] = token_limit
 
+        # Load the selected Ollama model now, with the context size the analysis will use
+        if current_provider == "Ollama" and current_model not in ("", "local-model") and st.session_state.get('ollama_endpoint'):
+            preload_ollama_model(get_provider_config("Ollama"))
+
+        # Stream responses so output appears as soon as the model starts generating
+        st.toggle(
+            "Stream responses",
+            value=True,
+            key="stream_responses",
+            help="Show the Mitigations, Test Cases and Expert Assessment output as it is generated instead of waiting for the complete response.",
+        )
+
+        # Serve repeated requests from the local response cache
+        st.toggle(
+            "Use response cache",
+            value=True,
+            key="use_response_cache",
+            help="Reuse earlier responses for identical requests (same provider, model, settings and prompt) instead of calling the model again. Turn off to always request a fresh response.",
+        )
+
+        # Offer cached results when the input only differs slightly from an earlier one
+        st.toggle(
+            "Offer results for similar inputs",
+            value=True,
+            key="use_similar_cache",
+            help="When a threat model or mitigations were generated for a nearly identical input, show the cached result instantly with an option to regenerate.",
+        )
+        st.slider(
+            "Similarity threshold",
+            min_value=0.5,
+            max_value=1.0,
+            value=0.8,
+            step=0.01,
+            key="similarity_threshold",
+            help="Minimum estimated Jaccard similarity between the current and the cached input (1.0 means identical wording).",
+        )
+        cache_stats = get_cache_stats()
+        st.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['similar_hits']} similar hits, {cache_stats['misses']} misses, {cache_stats['entries']} stored responses")
+        singleflight_stats = get_singleflight_stats()
+        st.caption(f"Coalesced requests: {singleflight_stats['shared']} answered by an identical request already in flight")
+        summary_cache_stats = get_summary_cache_stats()
+        st.caption(f"Repository file summaries: {summary_cache_stats['hits']} reused, {summary_cache_stats['misses']} summarized, {summary_cache_stats['entries']} stored")
+        prompt_cache_stats = get_prompt_cache_stats()
+        st.caption(f"Provider prompt caching: {prompt_cache_stats['cached_tokens']:,} of {prompt_cache_stats['prompt_tokens']:,} prompt tokens served from cache ({prompt_cache_stats['cached_ratio']:.0%})")
+
+        # Fallback provider used when the selected provider keeps failing
+        st.selectbox(
+            "Fallback provider",
+            ["None", "Ollama", "LM Studio Server", "OpenAI API", "Anthropic API", "Azure OpenAI Service", "Google AI API", "Mistral API", "Groq API"],
+            key="fallback_provider",
+            help="When the selected provider fails repeatedly or times out, calls are routed to this provider instead. It uses the API key or endpoint configured for it in the sidebar or .env file.",
+        )
+        st.text_input(
+            "Fallback model",
+            key="fallback_model",
+            help="The model (or Azure deployment name) to use with the fallback provider, e.g. llama3.1 for Ollama.",
+        )
+
+        # Race the fallback provider against slow responses
+        st.toggle(
+            "Hedge slow requests",
+            value=False,
+            key="hedge_requests",
+            help="If the selected provider has not answered within its usual latency, also send the request to the fallback provider and use whichever valid answer arrives first. Costs an extra request whenever a hedge is sent.",
+        )
+        st.slider(
+            "Hedge after latency percentile",
+            min_value=50,
+            max_value=99,
+            value=95,
+            key="hedge_percentile",
+            help="Send the hedge request once the call has taken longer than this percentile of the provider's recent response times for the same stage.",
+        )
+        hedge_stats = get_hedge_stats()
+        st.caption(f"Hedging: {hedge_stats['hedged']} of {hedge_stats['calls']} calls hedged ({hedge_stats['hedge_rate']:.0%}), {hedge_stats['hedge_wins']} won by the fallback provider")
+        for provider, model, retry_in in get_open_circuits():
+            st.warning(f"{provider} ({model}) is paused after repeated failures; it will be tried again in {retry_in:.0f}s.")
+        if st.button("Clear response cache"):
+            clear_cache()
+            st.rerun()
+        if st.button("Clear file summary cache"):
+            clear_summary_cache()
+            st.rerun()
+
+    # Latency, tokens, retries and errors of the LLM calls made by this server process
+    with st.expander("LLM Call Metrics"):
+        call_stats = get_call_stats()
+        if not call_stats:
+            st.caption("No LLM calls yet.")
+        else:
+            st.dataframe(
+                [
+                    {
+                        "Provider": row["provider"],
+                        "Model": row["model"],
+                        "Stage": row["stage"],
+                        "Calls": row["calls"],
+                        "Errors": row["errors"],
+                        "Retries": row["retries"],
+                        "p50 (s)": round(row["p50_seconds"], 1),
+                        "p95 (s)": round(row["p95_seconds"], 1),
+                        "TTFT (s)": round(row["mean_ttft_seconds"], 1) if row["mean_ttft_seconds"] is not None else None,
+                        "Input tokens": row["input_tokens"],
+                        "Output tokens": row["output_tokens"],
+                        "Cached tokens": row["cached_tokens"],
+                        "JSON repairs": row["json_repairs"],
+                        "Top error": row["top_error"],
+                    }
+                    for row in call_stats
+                ],
+                hide_index=True,
+            )
+            histogram = get_latency_histogram()
+            st.caption("Latency histogram: " + " · ".join(f"{bucket}: {count}" for bucket, count in histogram.items() if count))
+
     st.markdown("---")
 
     # Add "About" section to the sidebar
@@ -1114,11 +1252,19 @@ understanding possible vulnerabilities and attack vectors. Use this tab to gener
     # Create a submit button for Threat Modelling
     threat_model_submit_button = st.button(label="Generate Threat Model")
 
+    # Set when the user asks to regenerate a threat model that came from a similar cached input
+    regenerate_threat_model = st.session_state.pop("regenerate_threat_model", False)
+
     # If the Generate Threat Model button is clicked and the user has provided an application description
-    if threat_model_submit_button and st.session_state.get('app_input'):
+    if (threat_model_submit_button or regenerate_threat_model) and st.session_state.get('app_input'):
         app_input = st.session_state['app_input']  # Retrieve from session state
         # Generate the prompt using the create_prompt function
         threat_model_prompt = create_threat_model_prompt(app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment)
+        threat_model_config = get_provider_config(model_provider)
+        threat_model_input = similarity_text(app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment)
+        similar_threat_model = None
+        if not regenerate_threat_model:
+            similar_threat_model = offer_similar_result("threat_model", threat_model_prompt, threat_model_input, threat_model_config, "regenerate_threat_model")
 
         # Clear thinking content when switching models or starting a new operation
         if model_provider != "Anthropic API" or "thinking" not in anthropic_model.lower():
@@ -1126,49 +1272,28 @@ understanding possible vulnerabilities and attack vectors. Use this tab to gener
  
         # Show a spinner while generating the threat model
         with st.spinner("Analysing potential threats..."):
-            max_retries = 3
-            retry_count = 0
-            while retry_count < max_retries:
-                try:
-                    # Call the relevant get_threat_model function with the generated prompt
-                    if model_provider == "Azure OpenAI Service":
-                        model_output = get_threat_model_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, threat_model_prompt)
-                    elif model_provider == "OpenAI API":
-                        model_output = get_threat_model(openai_api_key, selected_model, threat_model_prompt)
-                    elif model_provider == "Google AI API":
-                        model_output = get_threat_model_google(google_api_key, google_model, threat_model_prompt)
-                    elif model_provider == "Mistral API":
-                        model_output = get_threat_model_mistral(mistral_api_key, mistral_model, threat_model_prompt)
-                    elif model_provider == "Ollama":
-                        model_output = get_threat_model_ollama(st.session_state['ollama_endpoint'], selected_model, threat_model_prompt)
-                    elif model_provider == "Anthropic API":
-                        model_output = get_threat_model_anthropic(anthropic_api_key, anthropic_model, threat_model_prompt)
-                        # Check if we got a fallback response
-                        if model_output.get("threat_model") and len(model_output["threat_model"]) == 1 and model_output["threat_model"][0].get("Threat Type") == "Error":
-                            st.warning("⚠️ There was an issue generating the threat model. The model may have returned a response in an unexpected format. You can try:")
-                            st.markdown("1. Running the generation again")
-                            st.markdown("2. Checking the application logs for more details")
-                            st.markdown("3. Using a different model if the issue persists")
-                    elif model_provider == "LM Studio Server":
-                        model_output = get_threat_model_lm_studio(st.session_state['lm_studio_endpoint'], selected_model, threat_model_prompt)
-                    elif model_provider == "Groq API":
-                        model_output = get_threat_model_groq(groq_api_key, groq_model, threat_model_prompt)
-
-                    # Access the threat model and improvement suggestions from the parsed content
-                    threat_model = model_output.get("threat_model", [])
-                    improvement_suggestions = model_output.get("improvement_suggestions", [])
-
-                    # Save the threat model to the session state for later use in mitigations
-                    st.session_state['threat_model'] = threat_model
-                    break  # Exit the loop if successful
-                except Exception as e:
-                    retry_count += 1
-                    if retry_count == max_retries:
-                        st.error(f"Error generating threat model after {max_retries} attempts: {e}")
-                        threat_model = []
-                        improvement_suggestions = []
-                    else:
-                        st.warning(f"Error generating threat model. Retrying attempt {retry_count+1}/{max_retries}...")
+            try:
+                # Call the relevant get_threat_model function with the generated prompt
+                model_output = similar_threat_model or call_stage("threat_model", threat_model_prompt, threat_model_config, threat_model_input, **provider_callbacks("generating threat model"))
+                if model_provider == "Anthropic API":
+                    # Check if we got a fallback response
+                    if model_output.get("threat_model") and len(model_output["threat_model"]) == 1 and model_output["threat_model"][0].get("Threat Type") == "Error":
+                        st.warning("⚠️ There was an issue generating the threat model. The model may have returned a response in an unexpected format. You can try:")
+                        st.markdown("1. Running the generation again")
+                        st.markdown("2. Checking the application logs for more details")
+                        st.markdown("3. Using a different model if the issue persists")
+
+                # Access the threat model and improvement suggestions from the parsed content
+                threat_model = model_output.get("threat_model", [])
+                improvement_suggestions = model_output.get("improvement_suggestions", [])
+
+                # Save the threat model to the session state for later use in mitigations
+                st.session_state['threat_model'] = threat_model
+                st.session_state['improvement_suggestions'] = improvement_suggestions
+            except Exception as e:
+                st.error(f"Error generating threat model: {e}")
+                threat_model = []
+                improvement_suggestions = []
 
         # Convert the threat model JSON to Markdown
         markdown_output = json_to_markdown(threat_model, improvement_suggestions)
@@ -1182,19 +1307,51 @@ understanding possible vulnerabilities and attack vectors. Use this tab to gener
                 st.markdown(st.session_state['last_thinking_content'])
  
 
-        # Display the threat model in Markdown
-        st.markdown(markdown_output)
+        render_threat_model(markdown_output)
 
-        # Add a button to allow the user to download the output as a Markdown file
-        st.download_button(
-            label="Download Threat Model",
-            data=markdown_output,  # Use the Markdown output
-            file_name="threat_model.md",
-            mime="text/markdown",
-       )
+    # ------------------ Generate Everything ------------------ #
+
+    # Create a submit button that runs every stage, in parallel where the stages allow it
+    generate_all_submit_button = st.button(
+        label="Generate Everything",
+        help="Generate the threat model and attack tree, then the mitigations, DREAD risk assessment and test cases, running independent stages concurrently.",
+    )
+
+    if generate_all_submit_button and st.session_state.get('app_input'):
+        # Thinking content from concurrent stages would be interleaved, so don't show any
+        st.session_state.pop('last_thinking_content', None)
+
+        with st.spinner("Generating the threat model, attack tree, mitigations, DREAD risk assessment and test cases..."):
+            pipeline_results = run_async(run_full_pipeline_async(
+                get_provider_config(model_provider),
+                app_type, authentication, internet_facing, sensitive_data, st.session_state['app_input'], operation_environment
+            ))
+
+        stage_labels = {
+            "threat_model": "threat model",
+            "attack_tree": "attack tree",
+            "mitigations": "mitigations",
+            "dread_assessment": "DREAD risk assessment",
+            "test_cases": "test cases",
+        }
+        for stage, result in pipeline_results.items():
+            if isinstance(result, Exception):
+                st.error(f"Error generating {stage_labels[stage]}: {result}")
+                continue
+            if stage == "threat_model":
+                st.session_state['threat_model'] = result.get("threat_model", [])
+                st.session_state['improvement_suggestions'] = result.get("improvement_suggestions", [])
+            else:
+                st.session_state[stage] = result
+
+        if not st.session_state.get('threat_model'):
+            st.error("No threats were generated, so mitigations, DREAD risk assessment and test cases were skipped.")
+        else:
+            render_threat_model(json_to_markdown(st.session_state['threat_model'], st.session_state.get('improvement_suggestions', [])))
+            st.success("Generation complete. The results are available in each tab and in the Report tab.")
 
 # If the submit button is clicked and the user has not provided an application description
-if threat_model_submit_button and not st.session_state.get('app_input'):
+if (threat_model_submit_button or generate_all_submit_button) and not st.session_state.get('app_input'):
     st.error("Please enter your application details before submitting.")
 
 
@@ -1232,22 +1389,7 @@ vulnerabilities and prioritising mitigation efforts.
             with st.spinner("Generating attack tree..."):
                 try:
                     # Call the relevant get_attack_tree function with the generated prompt
-                    if model_provider == "Azure OpenAI Service":
-                        mermaid_code = get_attack_tree_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, attack_tree_prompt)
-                    elif model_provider == "OpenAI API":
-                        mermaid_code = get_attack_tree(openai_api_key, selected_model, attack_tree_prompt)
-                    elif model_provider == "Google AI API":
-                        mermaid_code = get_attack_tree_google(google_api_key, google_model, attack_tree_prompt)
-                    elif model_provider == "Mistral API":
-                        mermaid_code = get_attack_tree_mistral(mistral_api_key, mistral_model, attack_tree_prompt)
-                    elif model_provider == "Ollama":
-                        mermaid_code = get_attack_tree_ollama(st.session_state['ollama_endpoint'], selected_model, attack_tree_prompt)
-                    elif model_provider == "Anthropic API":
-                        mermaid_code = get_attack_tree_anthropic(anthropic_api_key, anthropic_model, attack_tree_prompt)
-                    elif model_provider == "LM Studio Server":
-                        mermaid_code = get_attack_tree_lm_studio(st.session_state['lm_studio_endpoint'], selected_model, attack_tree_prompt)
-                    elif model_provider == "Groq API":
-                        mermaid_code = get_attack_tree_groq(groq_api_key, groq_model, attack_tree_prompt)
+                    mermaid_code = call_stage("attack_tree", attack_tree_prompt, get_provider_config(model_provider), **provider_callbacks("generating attack tree"))
 
                     # Display thinking content in an expander if available and using Claude thinking mode
                     if ('last_thinking_content' in st.session_state and 
@@ -1257,47 +1399,17 @@ vulnerabilities and prioritising mitigation efforts.
                         with st.expander("View Claude's thinking process"):
                             st.markdown(st.session_state['last_thinking_content'])
 
-                    # Display the generated attack tree code
-                    st.write("Attack Tree Code:")
-                    st.code(mermaid_code)
-
-                    # Visualise the attack tree using the Mermaid custom component
-                    st.write("Attack Tree Diagram Preview:")
-                    mermaid(mermaid_code)
                     # Save the attack tree output to session state for report generation:
                     st.session_state["attack_tree"] = mermaid_code
-                    
-                    col1, col2, col3, col4, col5 = st.columns([1,1,1,1,1])
-                    
-                    with col1:              
-                        # Add a button to allow the user to download the Mermaid code
-                        st.download_button(
-                            label="Download Diagram Code",
-                            data=mermaid_code,
-                            file_name="attack_tree.md",
-                            mime="text/plain",
-                            help="Download the Mermaid code for the attack tree diagram."
-                        )
-
-                    with col2:
-                        # Add a button to allow the user to open the Mermaid Live editor
-                        mermaid_live_button = st.link_button("Open Mermaid Live", "https://mermaid.live")
-                    
-                    with col3:
-                        # Blank placeholder
-                        st.write("")
-                    
-                    with col4:
-                        # Blank placeholder
-                        st.write("")
-                    
-                    with col5:
-                        # Blank placeholder
-                        st.write("")
+                    render_attack_tree(mermaid_code)
 
                 except Exception as e:
                     st.error(f"Error generating attack tree: {e}")
 
+        # Show the most recent attack tree, e.g. one produced by Generate Everything
+        elif st.session_state.get("attack_tree"):
+            render_attack_tree(st.session_state["attack_tree"])
+
 
 # ------------------ Mitigations Generation ------------------ #
 
@@ -1312,14 +1424,21 @@ the security posture of the application and protect against potential attacks.
     # Create a submit button for Mitigations
     mitigations_submit_button = st.button(label="Suggest Mitigations")
 
+    # Set when the user asks to regenerate mitigations that came from a similar cached input
+    regenerate_mitigations = st.session_state.pop("regenerate_mitigations", False)
+
     # If the Suggest Mitigations button is clicked and the user has identified threats
-    if mitigations_submit_button:
+    if mitigations_submit_button or regenerate_mitigations:
         # Check if threat_model data exists
         if 'threat_model' in st.session_state and st.session_state['threat_model']:
             # Convert the threat_model data into a Markdown list
             threats_markdown = json_to_markdown(st.session_state['threat_model'], [])
             # Generate the prompt using the create_mitigations_prompt function
             mitigations_prompt = create_mitigations_prompt(threats_markdown)
+            mitigations_config = get_provider_config(model_provider)
+            similar_mitigations = None
+            if not regenerate_mitigations:
+                similar_mitigations = offer_similar_result("mitigations", mitigations_prompt, threats_markdown, mitigations_config, "regenerate_mitigations")
 
             # Clear thinking content when switching models or starting a new operation
             if model_provider != "Anthropic API" or "thinking" not in anthropic_model.lower():
@@ -1327,27 +1446,19 @@ the security posture of the application and protect against potential attacks.
 
             # Show a spinner while suggesting mitigations
             with st.spinner("Suggesting mitigations..."):
-                max_retries = 3
-                retry_count = 0
-                while retry_count < max_retries:
-                    try:
+                try:
+                    if similar_mitigations:
+                        mitigations_markdown = similar_mitigations
+                        st.session_state["mitigations"] = mitigations_markdown
+                        render_mitigations(mitigations_markdown)
+                    elif st.session_state.get("stream_responses", True):
+                        # Render the mitigations as they are generated
+                        mitigations_markdown = render_stream(stream_stage("mitigations", mitigations_prompt, mitigations_config, stream_mitigations, threats_markdown, **provider_callbacks("suggesting mitigations")))
+                        st.session_state["mitigations"] = mitigations_markdown
+                        render_mitigations(mitigations_markdown, show_markdown=False)
+                    else:
                         # Call the relevant get_mitigations function with the generated prompt
-                        if model_provider == "Azure OpenAI Service":
-                            mitigations_markdown = get_mitigations_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, mitigations_prompt)
-                        elif model_provider == "OpenAI API":
-                            mitigations_markdown = get_mitigations(openai_api_key, selected_model, mitigations_prompt)
-                        elif model_provider == "Google AI API":
-                            mitigations_markdown = get_mitigations_google(google_api_key, google_model, mitigations_prompt)
-                        elif model_provider == "Mistral API":
-                            mitigations_markdown = get_mitigations_mistral(mistral_api_key, mistral_model, mitigations_prompt)
-                        elif model_provider == "Ollama":
-                            mitigations_markdown = get_mitigations_ollama(st.session_state['ollama_endpoint'], selected_model, mitigations_prompt)
-                        elif model_provider == "Anthropic API":
-                            mitigations_markdown = get_mitigations_anthropic(anthropic_api_key, anthropic_model, mitigations_prompt)
-                        elif model_provider == "LM Studio Server":
-                            mitigations_markdown = get_mitigations_lm_studio(st.session_state['lm_studio_endpoint'], selected_model, mitigations_prompt)
-                        elif model_provider == "Groq API":
-                            mitigations_markdown = get_mitigations_groq(groq_api_key, groq_model, mitigations_prompt)
+                        mitigations_markdown = call_stage("mitigations", mitigations_prompt, mitigations_config, threats_markdown, **provider_callbacks("suggesting mitigations"))
 
                         # Display thinking content in an expander if available and using Claude thinking mode
                         if ('last_thinking_content' in st.session_state and 
@@ -1357,36 +1468,22 @@ the security posture of the application and protect against potential attacks.
                             with st.expander("View Claude's thinking process"):
                                 st.markdown(st.session_state['last_thinking_content'])
 
-                        # Display the suggested mitigations in Markdown
-                        st.markdown(mitigations_markdown)
                         # Save the mitigation output:
                         st.session_state["mitigations"] = mitigations_markdown
-                        
-                        
-                        st.markdown("")
-                         
-                         # Add a button to allow the user to download the mitigations as a Markdown file
-                        st.download_button(
-                            label="Download Mitigations",
-                            data=mitigations_markdown,
-                            file_name="mitigations.md",
-                            mime="text/markdown",
-                        )
-                                
-                        break  # Exit the loop if successful
-                    except Exception as e:
-                        retry_count += 1
-                        if retry_count == max_retries:
-                            st.error(f"Error suggesting mitigations after {max_retries} attempts: {e}")
-                            mitigations_markdown = ""
-                        else:
-                            st.warning(f"Error suggesting mitigations. Retrying attempt {retry_count+1}/{max_retries}...")
+                        render_mitigations(mitigations_markdown)
+                except Exception as e:
+                    st.error(f"Error suggesting mitigations: {e}")
+                    mitigations_markdown = ""
             
             st.markdown("")
 
         else:
             st.error("Please generate a threat model first before suggesting mitigations.")
 
+    # Show the most recent mitigations, e.g. ones produced by Generate Everything
+    elif st.session_state.get("mitigations"):
+        render_mitigations(st.session_state["mitigations"])
+
 # ------------------ DREAD Risk Assessment Generation ------------------ #
 with tab4:
     st.markdown("""
@@ -1413,43 +1510,18 @@ focusing on the most critical threats first. Use this tab to perform a DREAD ris
                  
             # Show a spinner while generating DREAD Risk Assessment
             with st.spinner("Generating DREAD Risk Assessment..."):
-                max_retries = 3
-                retry_count = 0
-                while retry_count < max_retries:
-                    try:
-                        # Call the relevant get_dread_assessment function with the generated prompt
-                        if model_provider == "Azure OpenAI Service":
-                            dread_assessment = get_dread_assessment_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, dread_assessment_prompt)
-                        elif model_provider == "OpenAI API":
-                            dread_assessment = get_dread_assessment(openai_api_key, selected_model, dread_assessment_prompt)
-                        elif model_provider == "Google AI API":
-                            dread_assessment = get_dread_assessment_google(google_api_key, google_model, dread_assessment_prompt)
-                        elif model_provider == "Mistral API":
-                            dread_assessment = get_dread_assessment_mistral(mistral_api_key, mistral_model, dread_assessment_prompt)
-                        elif model_provider == "Ollama":
-                            dread_assessment = get_dread_assessment_ollama(st.session_state['ollama_endpoint'], selected_model, dread_assessment_prompt)
-                        elif model_provider == "Anthropic API":
-                            dread_assessment = get_dread_assessment_anthropic(anthropic_api_key, anthropic_model, dread_assessment_prompt)
-                        elif model_provider == "LM Studio Server":
-                            dread_assessment = get_dread_assessment_lm_studio(st.session_state['lm_studio_endpoint'], selected_model, dread_assessment_prompt)
-                        elif model_provider == "Groq API":
-                            dread_assessment = get_dread_assessment_groq(groq_api_key, groq_model, dread_assessment_prompt)
-                        
-                        # Save the DREAD assessment to the session state for later use in test cases
-                        st.session_state['dread_assessment'] = dread_assessment
-                        break  # Exit the loop if successful
-                    except Exception as e:
-                        retry_count += 1
-                        if retry_count == max_retries:
-                            st.error(f"Error generating DREAD risk assessment after {max_retries} attempts: {e}")
-                            dread_assessment = {"Risk Assessment": []}
-                            # Add debug information
-                            st.error("Debug: No threats were found in the response. Please try generating the threat model again.")
-                        else:
-                            st.warning(f"Error generating DREAD risk assessment. Retrying attempt {retry_count+1}/{max_retries}...")
-            # Convert the DREAD assessment JSON to Markdown
-            dread_assessment_markdown = dread_json_to_markdown(dread_assessment)
-            
+                try:
+                    # Call the relevant get_dread_assessment function with the generated prompt
+                    dread_assessment = call_stage("dread_assessment", dread_assessment_prompt, get_provider_config(model_provider), **provider_callbacks("generating DREAD risk assessment"))
+                    
+                    # Save the DREAD assessment to the session state for later use in test cases
+                    st.session_state['dread_assessment'] = dread_assessment
+                except Exception as e:
+                    st.error(f"Error generating DREAD risk assessment: {e}")
+                    dread_assessment = {"Risk Assessment": []}
+                    # Add debug information
+                    st.error("Debug: No threats were found in the response. Please try generating the threat model again.")
+
             # Add debug information about the assessment
             if not dread_assessment.get("Risk Assessment"):
                 st.warning("Debug: The DREAD assessment response is empty. Please ensure you have generated a threat model first.")
@@ -1462,23 +1534,14 @@ focusing on the most critical threats first. Use this tab to perform a DREAD ris
                 with st.expander("View Claude's thinking process"):
                     st.markdown(st.session_state['last_thinking_content'])
                      
-            # Display the DREAD assessment with a header
-            st.markdown("## DREAD Risk Assessment")
-            st.markdown("The table below shows the DREAD risk assessment for each identified threat. The Risk Score is calculated as the average of the five DREAD categories.")
-             
-            # Display the DREAD assessment in Markdown format
-            st.markdown(dread_assessment_markdown, unsafe_allow_html=False)
-             
-            # Add a button to allow the user to download the DREAD assessment as a Markdown file
-            st.download_button(
-                label="Download DREAD Risk Assessment",
-                data=dread_assessment_markdown,
-                file_name="dread_assessment.md",
-                mime="text/markdown",
-            )
+            render_dread_assessment(dread_assessment)
         else:
             st.error("Please generate a threat model first before requesting a DREAD risk assessment.")
 
+    # Show the most recent DREAD assessment, e.g. one produced by Generate Everything
+    elif st.session_state.get("dread_assessment"):
+        render_dread_assessment(st.session_state["dread_assessment"])
+
 
 # ------------------ Test Cases Generation ------------------ #
 
@@ -1509,28 +1572,16 @@ scenarios.
  
 
             # Show a spinner while generating test cases
+            test_cases_streamed = False
             with st.spinner("Generating test cases..."):
-                max_retries = 3
-                retry_count = 0
-                while retry_count < max_retries:
-                    try:
+                try:
+                    if st.session_state.get("stream_responses", True):
+                        # Render the test cases as they are generated
+                        test_cases_markdown = render_stream(stream_stage("test_cases", test_cases_prompt, get_provider_config(model_provider), stream_test_cases, **provider_callbacks("generating test cases")))
+                        test_cases_streamed = True
+                    else:
                         # Call to the relevant get_test_cases function with the generated prompt
-                        if model_provider == "Azure OpenAI Service":
-                            test_cases_markdown = get_test_cases_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, test_cases_prompt)
-                        elif model_provider == "OpenAI API":
-                            test_cases_markdown = get_test_cases(openai_api_key, selected_model, test_cases_prompt)
-                        elif model_provider == "Google AI API":
-                            test_cases_markdown = get_test_cases_google(google_api_key, google_model, test_cases_prompt)
-                        elif model_provider == "Mistral API":
-                            test_cases_markdown = get_test_cases_mistral(mistral_api_key, mistral_model, test_cases_prompt)
-                        elif model_provider == "Ollama":
-                            test_cases_markdown = get_test_cases_ollama(st.session_state['ollama_endpoint'], selected_model, test_cases_prompt)
-                        elif model_provider == "Anthropic API":
-                            test_cases_markdown = get_test_cases_anthropic(anthropic_api_key, anthropic_model, test_cases_prompt)
-                        elif model_provider == "LM Studio Server":
-                            test_cases_markdown = get_test_cases_lm_studio(st.session_state['lm_studio_endpoint'], selected_model, test_cases_prompt)
-                        elif model_provider == "Groq API":
-                            test_cases_markdown = get_test_cases_groq(groq_api_key, groq_model, test_cases_prompt)
+                        test_cases_markdown = call_stage("test_cases", test_cases_prompt, get_provider_config(model_provider), **provider_callbacks("generating test cases"))
                             
                         # Display thinking content in an expander if available and using Claude thinking mode
                         if ('last_thinking_content' in st.session_state and 
@@ -1540,36 +1591,20 @@ scenarios.
                             with st.expander("View Claude's thinking process"):
                                 st.markdown(st.session_state['last_thinking_content'])
  
-
-                        # Display the suggested mitigations in Markdown
-                        st.markdown(test_cases_markdown)
-           
-                        st.markdown("")
- 
-                   
-                        # Save the test cases output:
-                        st.session_state["test_cases"] = test_cases_markdown
-                        break  # Exit the loop if successful
-                    except Exception as e:
-                        retry_count += 1
-                        if retry_count == max_retries:
-                            st.error(f"Error generating test cases after {max_retries} attempts: {e}")
-                            test_cases_markdown = ""
-                        else:
-                            st.warning(f"Error generating test cases. Retrying attempt {retry_count+1}/{max_retries}...")
+                    # Save the test cases output:
+                    st.session_state["test_cases"] = test_cases_markdown
+                except Exception as e:
+                    st.error(f"Error generating test cases: {e}")
+                    test_cases_markdown = ""
             
-            st.markdown("")
-
-            # Add a button to allow the user to download the test cases as a Markdown file
-            st.download_button(
-                label="Download Test Cases",
-                data=test_cases_markdown,
-                file_name="test_cases.md",
-                mime="text/markdown",
-            )
+            render_test_cases(test_cases_markdown, show_markdown=not test_cases_streamed)
         else:
             st.error("Please generate a threat model first before requesting test cases.")
 
+    # Show the most recent test cases, e.g. ones produced by Generate Everything
+    elif st.session_state.get("test_cases"):
+        render_test_cases(st.session_state["test_cases"])
+
 # ------------------ RED Expert Analysis Tab ------------------ #
 with tab_red_expert:
     st.markdown("""
@@ -1580,9 +1615,18 @@ with the RED Directive. Use this tab to run an expert assessment of your radio e
     st.markdown("""---""")
     if st.button("Run Expert Assessment"):
         with st.spinner("Generating expert analysis..."):
-            expert_result = run_expert_agent()
-            st.session_state["expert_analysis"] = expert_result
-            st.markdown(expert_result)
+            expert_config = get_provider_config(model_provider)
+            expert_prompt = create_expert_agent_prompt()
+            try:
+                if st.session_state.get("stream_responses", True):
+                    expert_result = render_stream(stream_stage("expert_analysis", expert_prompt, expert_config, stream_expert_agent, **provider_callbacks("generating expert analysis")))
+                    st.session_state["expert_analysis"] = expert_result
+                else:
+                    expert_result = call_stage("expert_analysis", expert_prompt, expert_config, **provider_callbacks("generating expert analysis"))
+                    st.session_state["expert_analysis"] = expert_result
+                    st.markdown(expert_result)
+            except Exception as e:
+                st.error(f"Error generating expert analysis: {e}")
     if st.session_state.get("expert_analysis"):
         st.download_button(
             label="Download Expert Analysis",
@@ -1,16 +1,21 @@
 import requests
-from anthropic import Anthropic
-from mistralai import Mistral
-from openai import OpenAI, AzureOpenAI
 import streamlit as st
 
-import google.generativeai as genai
-from groq import Groq
 from utils import process_groq_response, create_reasoning_system_prompt
-
-# Function to create a prompt to generate mitigating controls
-def create_mitigations_prompt(threats):
-    prompt = f"""
+from clients import get_openai_client, get_azure_openai_client, get_anthropic_client, get_mistral_client, get_groq_client, get_lm_studio_client, get_http_session, configure_google
+from local_models import ollama_request_fields
+from token_budget import THINKING_BUDGET_TOKENS
+from prompt_cache import register_static_prefix, anthropic_content, record_usage
+from retry_policy import is_retryable_error
+from instrumentation import record_error
+from streaming import stream_completion
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
+
+# Static instructions every mitigations prompt starts with; the threats follow them so
+# providers can cache this prefix
+MITIGATIONS_INSTRUCTIONS = register_static_prefix("""
 Act as a cyber security expert with more than 20 years experience of using the STRIDE threat modelling methodology. Your task is to provide potential mitigations for the threats identified in the threat model. It is very important that your responses are tailored to reflect the details of the threats.
 
 Your output should be in the form of a markdown table with the following columns:
@@ -19,22 +24,27 @@ Your output should be in the form of a markdown table with the following columns
     - Column C: Suggested Mitigation(s)
 
 Below is the list of identified threats:
-{threats}
+""")
+
+# Function to create a prompt to generate mitigating controls
+def create_mitigations_prompt(threats):
+    prompt = f"""{MITIGATIONS_INSTRUCTIONS}{threats}
 
 YOUR RESPONSE (do not wrap in a code block):
 """
     return prompt
 
 
-# Function to get mitigations from the GPT response.
-def get_mitigations(api_key, model_name, prompt):
-    client = OpenAI(api_key=api_key)
+# System prompt used with Ollama hosted LLMs
+OLLAMA_MITIGATIONS_SYSTEM_PROMPT = """You are a cyber security expert with more than 20 years experience of implementing security controls for a wide range of applications. Your task is to analyze the provided application description and suggest appropriate security controls and mitigations.
 
-    # For reasoning models (o1, o3-mini), use a structured system prompt
-    if model_name in ["o1", "o3-mini"]:
-        system_prompt = create_reasoning_system_prompt(
-            task_description="Generate effective security mitigations for the identified threats using the STRIDE methodology.",
-            approach_description="""1. Analyze each threat in the provided threat model
+Please provide your response in markdown format with appropriate headings and bullet points."""
+
+# Function to create the system prompt used with reasoning models (o1, o3-mini).
+def create_mitigations_reasoning_system_prompt():
+    return create_reasoning_system_prompt(
+        task_description="Generate effective security mitigations for the identified threats using the STRIDE methodology.",
+        approach_description="""1. Analyze each threat in the provided threat model
 2. For each threat:
    - Understand the threat type and scenario
    - Consider the potential impact
@@ -45,7 +55,16 @@ def get_mitigations(api_key, model_name, prompt):
    - Scenario
    - Suggested Mitigation(s)
 4. Ensure mitigations follow security best practices and industry standards"""
-        )
+    )
+
+
+# Function to get mitigations from the GPT response.
+def get_mitigations(api_key, model_name, prompt, max_tokens=4000):
+    client = get_openai_client(api_key)
+
+    # For reasoning models (o1, o3-mini), use a structured system prompt
+    if model_name in ["o1", "o3-mini"]:
+        system_prompt = create_mitigations_reasoning_system_prompt()
     else:
         system_prompt = "You are a helpful assistant that provides threat mitigation strategies in Markdown format."
 
@@ -54,8 +73,10 @@ def get_mitigations(api_key, model_name, prompt):
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_completion_tokens=max_tokens
     )
+    record_usage(response)
 
     # Access the content directly as the response will be in text format
     mitigations = response.choices[0].message.content
@@ -64,20 +85,18 @@ def get_mitigations(api_key, model_name, prompt):
 
 
 # Function to get mitigations from the Azure OpenAI response.
-def get_mitigations_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt):
-    client = AzureOpenAI(
-        azure_endpoint = azure_api_endpoint,
-        api_key = azure_api_key,
-        api_version = azure_api_version,
-    )
+def get_mitigations_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt, max_tokens=4000):
+    client = get_azure_openai_client(azure_api_endpoint, azure_api_key, azure_api_version)
 
     response = client.chat.completions.create(
         model = azure_deployment_name,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides threat mitigation strategies in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Access the content directly as the response will be in text format
     mitigations = response.choices[0].message.content
@@ -85,11 +104,12 @@ def get_mitigations_azure(azure_api_endpoint, azure_api_key, azure_api_version,
     return mitigations
 
 # Function to get mitigations from the Google model's response.
-def get_mitigations_google(google_api_key, google_model, prompt):
-    genai.configure(api_key=google_api_key)
+def get_mitigations_google(google_api_key, google_model, prompt, max_tokens=4000):
+    configure_google(google_api_key)
     model = genai.GenerativeModel(
         google_model,
         system_instruction="You are a helpful assistant that provides threat mitigation strategies in Markdown format.",
+        generation_config={"max_output_tokens": max_tokens},
     )
     response = model.generate_content(prompt)
     try:
@@ -106,16 +126,18 @@ def get_mitigations_google(google_api_key, google_model, prompt):
     return mitigations
 
 # Function to get mitigations from the Mistral model's response.
-def get_mitigations_mistral(mistral_api_key, mistral_model, prompt):
-    client = Mistral(api_key=mistral_api_key)
+def get_mitigations_mistral(mistral_api_key, mistral_model, prompt, max_tokens=4000):
+    client = get_mistral_client(mistral_api_key)
 
     response = client.chat.complete(
         model = mistral_model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides threat mitigation strategies in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Access the content directly as the response will be in text format
     mitigations = response.choices[0].message.content
@@ -123,7 +145,7 @@ def get_mitigations_mistral(mistral_api_key, mistral_model, prompt):
     return mitigations
 
 # Function to get mitigations from Ollama hosted LLM.
-def get_mitigations_ollama(ollama_endpoint, ollama_model, prompt):
+def get_mitigations_ollama(ollama_endpoint, ollama_model, prompt, max_tokens=4000, num_ctx=None, keep_alive=None):
     """
     Get mitigations from Ollama hosted LLM.
     
@@ -131,6 +153,9 @@ def get_mitigations_ollama(ollama_endpoint, ollama_model, prompt):
         ollama_endpoint (str): The URL of the Ollama endpoint (e.g., 'http://localhost:11434')
         ollama_model (str): The name of the model to use
         prompt (str): The prompt to send to the model
+        max_tokens (int): The output token limit (Ollama's num_predict)
+        num_ctx (int): The context window to load the model with
+        keep_alive (str or int): How long Ollama keeps the model loaded afterwards
         
     Returns:
         str: The generated mitigations in markdown format
@@ -147,12 +172,11 @@ def get_mitigations_ollama(ollama_endpoint, ollama_model, prompt):
     data = {
         "model": ollama_model,
         "stream": False,
+        **ollama_request_fields(max_tokens, num_ctx, keep_alive),
         "messages": [
             {
                 "role": "system", 
-                "content": """You are a cyber security expert with more than 20 years experience of implementing security controls for a wide range of applications. Your task is to analyze the provided application description and suggest appropriate security controls and mitigations.
-
-Please provide your response in markdown format with appropriate headings and bullet points."""
+                "content": OLLAMA_MITIGATIONS_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -162,7 +186,7 @@ Please provide your response in markdown format with appropriate headings and bu
     }
 
     try:
-        response = requests.post(url, json=data, timeout=60)  # Add timeout
+        response = get_http_session().post(url, json=data, timeout=60)  # Add timeout
         response.raise_for_status()  # Raise exception for bad status codes
         outer_json = response.json()
         
@@ -181,8 +205,8 @@ Please provide your response in markdown format with appropriate headings and bu
         raise
 
 # Function to get mitigations from the Anthropic model's response.
-def get_mitigations_anthropic(anthropic_api_key, anthropic_model, prompt):
-    client = Anthropic(api_key=anthropic_api_key)
+def get_mitigations_anthropic(anthropic_api_key, anthropic_model, prompt, max_tokens=4096):
+    client = get_anthropic_client(anthropic_api_key)
         
     # Check if we're using extended thinking mode
     is_thinking_mode = "thinking" in anthropic_model.lower()
@@ -195,27 +219,29 @@ def get_mitigations_anthropic(anthropic_api_key, anthropic_model, prompt):
         if is_thinking_mode:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=24000,
+                max_tokens=THINKING_BUDGET_TOKENS + max_tokens,
                 thinking={
                     "type": "enabled",
-                    "budget_tokens": 16000
+                    "budget_tokens": THINKING_BUDGET_TOKENS
                 },
                 system="You are a helpful assistant that provides threat mitigation strategies in Markdown format.",
                 messages=[
-                    {"role": "user", "content": prompt}
+                    {"role": "user", "content": anthropic_content(prompt)}
                 ],
                 timeout=600  # 10-minute timeout
             )
+            record_usage(response)
         else:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=4096,
+                max_tokens=max_tokens,
                 system="You are a helpful assistant that provides threat mitigation strategies in Markdown format.",
                 messages=[
-                    {"role": "user", "content": prompt}
+                    {"role": "user", "content": anthropic_content(prompt)}
                 ],
                 timeout=300  # 5-minute timeout
             )
+            record_usage(response)
  
         # Access the text content
         if is_thinking_mode:
@@ -232,6 +258,11 @@ def get_mitigations_anthropic(anthropic_api_key, anthropic_model, prompt):
  
         return mitigations
     except Exception as e:
+        # Let retry_policy retry rate limits, timeouts and overloads
+        if is_retryable_error(e):
+            raise
+        # The fallback answer hides the failure from the caller, so record it
+        record_error(e)
         # Handle timeout and other errors
         error_message = str(e)
         st.error(f"Error with Anthropic API: {error_message}")
@@ -250,19 +281,18 @@ def get_mitigations_anthropic(anthropic_api_key, anthropic_model, prompt):
         return fallback_mitigations
 
 # Function to get mitigations from LM Studio Server response.
-def get_mitigations_lm_studio(lm_studio_endpoint, model_name, prompt):
-    client = OpenAI(
-        base_url=f"{lm_studio_endpoint}/v1",
-        api_key="not-needed"  # LM Studio Server doesn't require an API key
-    )
+def get_mitigations_lm_studio(lm_studio_endpoint, model_name, prompt, max_tokens=4000):
+    client = get_lm_studio_client(lm_studio_endpoint)
 
     response = client.chat.completions.create(
         model=model_name,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides threat mitigation strategies in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Access the content directly as the response will be in text format
     mitigations = response.choices[0].message.content
@@ -270,15 +300,17 @@ def get_mitigations_lm_studio(lm_studio_endpoint, model_name, prompt):
     return mitigations
 
 # Function to get mitigations from the Groq model's response.
-def get_mitigations_groq(groq_api_key, groq_model, prompt):
-    client = Groq(api_key=groq_api_key)
+def get_mitigations_groq(groq_api_key, groq_model, prompt, max_tokens=4000):
+    client = get_groq_client(groq_api_key)
     response = client.chat.completions.create(
         model=groq_model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides threat mitigation strategies in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Process the response using our utility function
     reasoning, mitigations = process_groq_response(
@@ -292,4 +324,26 @@ def get_mitigations_groq(groq_api_key, groq_model, prompt):
         with st.expander("View model's reasoning process", expanded=False):
             st.write(reasoning)
 
-    return mitigations
\ No newline at end of file
+    return mitigations
+
+# Function to stream mitigations from the selected model provider.
+def stream_mitigations(config, prompt, max_tokens=None):
+    """
+    Stream mitigations from any supported provider, using the same system prompts as the get_mitigations* functions.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        prompt (str): The prompt to send to the model
+        max_tokens (int): Optional cap on the number of output tokens
+
+    Returns:
+        generator: (kind, text) events from streaming.stream_completion()
+    """
+    if config["provider"] == "OpenAI API" and config["model"] in ["o1", "o3-mini"]:
+        system_prompt = create_mitigations_reasoning_system_prompt()
+    elif config["provider"] == "Ollama":
+        system_prompt = OLLAMA_MITIGATIONS_SYSTEM_PROMPT
+    else:
+        system_prompt = "You are a helpful assistant that provides threat mitigation strategies in Markdown format."
+
+    return stream_completion(config, system_prompt, prompt, max_tokens=max_tokens)
\ No newline at end of file
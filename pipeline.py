@@ -0,0 +1,63 @@
+import asyncio
+
+from threat_model import create_threat_model_prompt, json_to_markdown
+from attack_tree import create_attack_tree_prompt
+from mitigations import create_mitigations_prompt
+from dread import create_dread_assessment_prompt
+from test_cases import create_test_cases_prompt
+from providers import call_stage_async
+from similarity import similarity_text
+
+# --------- Full Pipeline --------- #
+
+# Stages that only need the threat model, and run concurrently once it exists
+THREAT_DEPENDENT_STAGES = {
+    "mitigations": create_mitigations_prompt,
+    "dread_assessment": create_dread_assessment_prompt,
+    "test_cases": create_test_cases_prompt,
+}
+
+
+async def run_full_pipeline_async(config, app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment):
+    """
+    Generate every pipeline output with as much concurrency as the stage dependencies allow.
+    The attack tree only needs the application description, so it runs alongside the threat
+    model; mitigations, DREAD and test cases fan out as soon as the threat model is ready.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment:
+            The application details entered in the Threat Model tab
+
+    Returns:
+        dict: Maps each stage name to its output, or to the exception raised by that stage
+    """
+    threat_model_prompt = create_threat_model_prompt(app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment)
+    attack_tree_prompt = create_attack_tree_prompt(app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment)
+
+    threat_model_similarity_text = similarity_text(app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment)
+
+    attack_tree_task = asyncio.ensure_future(call_stage_async("attack_tree", attack_tree_prompt, config))
+    results = {}
+
+    try:
+        results["threat_model"] = await call_stage_async("threat_model", threat_model_prompt, config, threat_model_similarity_text)
+    except Exception as e:
+        results["threat_model"] = e
+
+    threats = results["threat_model"].get("threat_model", []) if isinstance(results["threat_model"], dict) else []
+    if threats:
+        threats_markdown = json_to_markdown(threats, [])
+        stage_names = list(THREAT_DEPENDENT_STAGES)
+        outputs = await asyncio.gather(
+            *(call_stage_async(stage, THREAT_DEPENDENT_STAGES[stage](threats_markdown), config, threats_markdown) for stage in stage_names),
+            return_exceptions=True,
+        )
+        results.update(zip(stage_names, outputs))
+
+    try:
+        results["attack_tree"] = await attack_tree_task
+    except Exception as e:
+        results["attack_tree"] = e
+
+    return results
@@ -0,0 +1,116 @@
+import threading
+
+from instrumentation import record_tokens
+
+# --------- Provider Prompt Caching --------- #
+
+# Prompt builders put their long, unchanging instructions first and the per-application details
+# last, so providers can reuse the processed prefix from earlier requests. OpenAI (and Azure)
+# do this automatically for prompts of 1024 tokens or more; Anthropic caches a prefix once it
+# is marked with cache_control (prefixes shorter than the model's minimum are not cached).
+
+# Static prompt prefixes registered by the prompt builders, longest first
+_static_prefixes = []
+_lock = threading.Lock()
+_stats = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0}
+
+
+def register_static_prefix(prefix):
+    """
+    Register the static instructions a prompt builder starts its prompts with.
+
+    Args:
+        prefix (str): The instructions
+
+    Returns:
+        str: The same prefix, so module constants can be defined in one statement
+    """
+    with _lock:
+        _static_prefixes.append(prefix)
+        _static_prefixes.sort(key=len, reverse=True)
+    return prefix
+
+
+def split_static_prefix(prompt):
+    """
+    Split a prompt into its registered static prefix and the variable rest.
+
+    Args:
+        prompt (str): The prompt
+
+    Returns:
+        tuple: (static prefix, or "" if the prompt has none; the rest of the prompt)
+    """
+    for prefix in _static_prefixes:
+        if prompt.startswith(prefix):
+            return prefix, prompt[len(prefix):]
+    return "", prompt
+
+
+def anthropic_content(prompt):
+    """
+    Build the content of an Anthropic user message with the prompt's static prefix marked for caching.
+
+    Args:
+        prompt (str): The prompt
+
+    Returns:
+        list or str: Text blocks with a cache breakpoint after the prefix, or the prompt unchanged
+            if it has no registered prefix
+    """
+    prefix, rest = split_static_prefix(prompt)
+    if not prefix:
+        return prompt
+    blocks = [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+    if rest:
+        blocks.append({"type": "text", "text": rest})
+    return blocks
+
+
+def record_usage(response):
+    """
+    Record how many prompt tokens a provider served from its prompt cache, and the call's
+    token usage for instrumentation. Understands OpenAI-compatible and Anthropic usage;
+    responses without usage are ignored.
+
+    Args:
+        response: The provider response, or its usage object
+    """
+    usage = getattr(response, "usage", response)
+    if usage is None:
+        return
+
+    # Anthropic reports uncached, cache-read and cache-write input tokens separately
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    input_tokens = getattr(usage, "input_tokens", None)
+    if isinstance(input_tokens, int):
+        prompt_tokens = input_tokens + cache_read + cache_write
+        cached_tokens = cache_read
+        output_tokens = getattr(usage, "output_tokens", None)
+    else:
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if not isinstance(prompt_tokens, int):
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        output_tokens = getattr(usage, "completion_tokens", None)
+
+    with _lock:
+        _stats["calls"] += 1
+        _stats["prompt_tokens"] += prompt_tokens
+        _stats["cached_tokens"] += cached_tokens
+        _stats["cache_write_tokens"] += cache_write
+    record_tokens(prompt_tokens, output_tokens if isinstance(output_tokens, int) else None, cached_tokens)
+
+
+def get_prompt_cache_stats():
+    """
+    Returns:
+        dict: Calls with usage data, prompt tokens, prompt tokens read from and written to provider
+              caches, and the share of prompt tokens that were cached
+    """
+    with _lock:
+        stats = dict(_stats)
+    stats["cached_ratio"] = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+    return stats
@@ -0,0 +1,305 @@
+import time
+
+import streamlit as st
+
+from threat_model import get_threat_model, get_threat_model_azure, get_threat_model_google, get_threat_model_mistral, get_threat_model_ollama, get_threat_model_anthropic, get_threat_model_lm_studio, get_threat_model_groq
+from attack_tree import get_attack_tree, get_attack_tree_azure, get_attack_tree_mistral, get_attack_tree_ollama, get_attack_tree_anthropic, get_attack_tree_lm_studio, get_attack_tree_groq, get_attack_tree_google
+from mitigations import get_mitigations, get_mitigations_azure, get_mitigations_google, get_mitigations_mistral, get_mitigations_ollama, get_mitigations_anthropic, get_mitigations_lm_studio, get_mitigations_groq
+from test_cases import get_test_cases, get_test_cases_azure, get_test_cases_google, get_test_cases_mistral, get_test_cases_ollama, get_test_cases_anthropic, get_test_cases_lm_studio, get_test_cases_groq
+from dread import get_dread_assessment, get_dread_assessment_azure, get_dread_assessment_google, get_dread_assessment_mistral, get_dread_assessment_ollama, get_dread_assessment_anthropic, get_dread_assessment_lm_studio, get_dread_assessment_groq
+from expert_red_agent import get_expert_analysis, get_expert_analysis_azure, get_expert_analysis_google, get_expert_analysis_mistral, get_expert_analysis_ollama, get_expert_analysis_anthropic, get_expert_analysis_lm_studio, get_expert_analysis_groq
+from concurrency import make_async
+from llm_cache import cached_call, cache_get, cache_put, cache_key, is_fallback_response
+from singleflight import run_once
+from retry_policy import call_with_retries, stream_with_retries, EmptyResponseError
+from circuit_breaker import guarded_call, guarded_stream, is_upstream_failure
+from hedging import hedged_call, hedge_delay, record_latency
+from streaming import TEXT
+from token_budget import plan_request
+from local_models import get_ollama_options
+from endpoint_pool import pooled_call, pooled_stream
+from instrumentation import instrument_call, mark_attempt, mark_first_token
+
+# --------- Provider Dispatch --------- #
+
+AZURE_API_VERSION = "2023-12-01-preview"
+
+# The provider function to call for each pipeline stage
+STAGE_FUNCTIONS = {
+    "threat_model": {
+        "OpenAI API": get_threat_model,
+        "Azure OpenAI Service": get_threat_model_azure,
+        "Google AI API": get_threat_model_google,
+        "Mistral API": get_threat_model_mistral,
+        "Ollama": get_threat_model_ollama,
+        "Anthropic API": get_threat_model_anthropic,
+        "LM Studio Server": get_threat_model_lm_studio,
+        "Groq API": get_threat_model_groq,
+    },
+    "attack_tree": {
+        "OpenAI API": get_attack_tree,
+        "Azure OpenAI Service": get_attack_tree_azure,
+        "Google AI API": get_attack_tree_google,
+        "Mistral API": get_attack_tree_mistral,
+        "Ollama": get_attack_tree_ollama,
+        "Anthropic API": get_attack_tree_anthropic,
+        "LM Studio Server": get_attack_tree_lm_studio,
+        "Groq API": get_attack_tree_groq,
+    },
+    "mitigations": {
+        "OpenAI API": get_mitigations,
+        "Azure OpenAI Service": get_mitigations_azure,
+        "Google AI API": get_mitigations_google,
+        "Mistral API": get_mitigations_mistral,
+        "Ollama": get_mitigations_ollama,
+        "Anthropic API": get_mitigations_anthropic,
+        "LM Studio Server": get_mitigations_lm_studio,
+        "Groq API": get_mitigations_groq,
+    },
+    "dread_assessment": {
+        "OpenAI API": get_dread_assessment,
+        "Azure OpenAI Service": get_dread_assessment_azure,
+        "Google AI API": get_dread_assessment_google,
+        "Mistral API": get_dread_assessment_mistral,
+        "Ollama": get_dread_assessment_ollama,
+        "Anthropic API": get_dread_assessment_anthropic,
+        "LM Studio Server": get_dread_assessment_lm_studio,
+        "Groq API": get_dread_assessment_groq,
+    },
+    "test_cases": {
+        "OpenAI API": get_test_cases,
+        "Azure OpenAI Service": get_test_cases_azure,
+        "Google AI API": get_test_cases_google,
+        "Mistral API": get_test_cases_mistral,
+        "Ollama": get_test_cases_ollama,
+        "Anthropic API": get_test_cases_anthropic,
+        "LM Studio Server": get_test_cases_lm_studio,
+        "Groq API": get_test_cases_groq,
+    },
+    "expert_analysis": {
+        "OpenAI API": get_expert_analysis,
+        "Azure OpenAI Service": get_expert_analysis_azure,
+        "Google AI API": get_expert_analysis_google,
+        "Mistral API": get_expert_analysis_mistral,
+        "Ollama": get_expert_analysis_ollama,
+        "Anthropic API": get_expert_analysis_anthropic,
+        "LM Studio Server": get_expert_analysis_lm_studio,
+        "Groq API": get_expert_analysis_groq,
+    },
+}
+
+
+def get_provider_config(model_provider, session_state=None, model=None, include_fallback=True):
+    """
+    Collect the settings needed to call a model provider from the session state.
+
+    Args:
+        model_provider (str): The provider name as shown in the sidebar (e.g. 'OpenAI API')
+        session_state: Mapping to read the settings from (defaults to st.session_state)
+        model (str): The model (Azure: deployment) to use instead of the one selected in the sidebar
+        include_fallback (bool): Whether to attach the configured fallback provider
+
+    Returns:
+        dict: The provider, model, credential and endpoint, 'args', the leading
+              positional arguments of that provider's get_* functions, 'options', extra
+              keyword arguments for them (Ollama: num_ctx and keep_alive), 'use_cache',
+              'fallback', the settings of the fallback provider (or None), and the
+              hedging settings 'hedge' and 'hedge_percentile'
+    """
+    if session_state is None:
+        session_state = st.session_state
+
+    model_override = model
+    model = model_override or session_state.get("selected_model", "")
+    credential = None
+    endpoint = None
+    options = {}
+
+    if model_provider == "Azure OpenAI Service":
+        endpoint = session_state.get("azure_api_endpoint", "")
+        credential = session_state.get("azure_api_key", "")
+        api_version = session_state.get("azure_api_version", AZURE_API_VERSION)
+        model = model_override or session_state.get("azure_deployment_name", "")
+        args = (endpoint, credential, api_version, model)
+    elif model_provider == "Ollama":
+        endpoint = session_state.get("ollama_endpoint", "http://localhost:11434")
+        args = (endpoint, model)
+        # Context size and keep_alive, sent with every request and the preload (see local_models)
+        options = get_ollama_options(session_state, model)
+    elif model_provider == "LM Studio Server":
+        endpoint = session_state.get("lm_studio_endpoint", "http://localhost:1234")
+        args = (endpoint, model)
+    else:
+        credential_keys = {
+            "OpenAI API": "openai_api_key",
+            "Anthropic API": "anthropic_api_key",
+            "Google AI API": "google_api_key",
+            "Mistral API": "mistral_api_key",
+            "Groq API": "groq_api_key",
+        }
+        credential = session_state.get(credential_keys.get(model_provider, ""), "")
+        args = (credential, model)
+
+    config = {
+        "provider": model_provider,
+        "model": model,
+        "credential": credential,
+        "endpoint": endpoint,
+        "args": args,
+        "options": options,
+        "use_cache": session_state.get("use_response_cache", True),
+        "fallback": None,
+        "hedge": session_state.get("hedge_requests", False),
+        "hedge_percentile": session_state.get("hedge_percentile", 95),
+    }
+
+    # The fallback provider takes over when this one is unavailable (see circuit_breaker)
+    fallback_provider = session_state.get("fallback_provider", "None")
+    fallback_model = session_state.get("fallback_model", "")
+    if include_fallback and fallback_provider != "None" and fallback_model:
+        fallback = get_provider_config(fallback_provider, session_state, model=fallback_model, include_fallback=False)
+        if (fallback["provider"], fallback["model"]) != (model_provider, model):
+            config["fallback"] = fallback
+
+    return config
+
+
+def _call_provider_stage(stage, prompt, config, similarity_text, on_retry):
+    stage_functions = STAGE_FUNCTIONS[stage]
+    if config["provider"] not in stage_functions:
+        raise ValueError(f"Unsupported model provider for {stage}: {config['provider']}")
+    provider_function = stage_functions[config["provider"]]
+    # Size the request for this provider's model; the fallback may have a smaller context window
+    prompt, max_tokens = plan_request(stage, prompt, config)
+
+    def call_provider():
+        mark_attempt()
+        started = time.monotonic()
+        # Local servers: one server of the endpoint pool takes the request (see endpoint_pool)
+        output = pooled_call(config, lambda host_config: provider_function(*host_config["args"], prompt, max_tokens=max_tokens, **host_config["options"]))
+        if output is None:
+            raise EmptyResponseError(f"{config['provider']} returned no {stage.replace('_', ' ')}")
+        record_latency(config, stage, time.monotonic() - started)
+        return output
+
+    def instrumented_call():
+        # One record per upstream request, covering its retries (see instrumentation)
+        with instrument_call(config, stage, max_tokens=max_tokens):
+            return call_with_retries(config, prompt, lambda: guarded_call(config, call_provider), on_retry)
+
+    request_key = cache_key(stage, prompt, config)
+    return cached_call(
+        stage,
+        prompt,
+        config,
+        lambda: run_once(request_key, instrumented_call),
+        similarity_text,
+    )
+
+
+def call_stage(stage, prompt, config, similarity_text=None, on_retry=None, on_failover=None):
+    """
+    Call the configured provider's function for a pipeline stage, answering from the
+    response cache when the same request has been made before. Identical requests that
+    are in flight at the same time, from any session, share a single upstream call, which
+    is rate limited and retried by retry_policy and guarded by circuit_breaker. If the
+    provider is unavailable, the call is repeated against the fallback provider. Each call is
+    sized for its model by token_budget, which sets the output limit and shortens or rejects
+    prompts that would not fit the context window. With
+    hedging enabled, the fallback provider is also called when the provider is slower than
+    its usual latency percentile, and the first valid result wins.
+
+    Args:
+        stage (str): One of the keys of STAGE_FUNCTIONS (e.g. 'threat_model')
+        prompt (str): The prompt to send to the model
+        config (dict): Provider settings from get_provider_config()
+        similarity_text (str): Optional input text stored with the cached response for similarity lookups
+        on_retry (callable): Optional callback(next_attempt, max_attempts, error) run before each retry
+        on_failover (callable): Optional callback(config, fallback_config, error) run before switching to the fallback
+
+    Returns:
+        The stage output as returned by the provider function
+    """
+    fallback = config.get("fallback")
+    hedge_started = []
+
+    def call_hedge():
+        hedge_started.append(True)
+        return _call_provider_stage(stage, prompt, fallback, similarity_text, None)
+
+    try:
+        if config.get("hedge") and fallback is not None:
+            output, _ = hedged_call(
+                lambda: _call_provider_stage(stage, prompt, config, similarity_text, on_retry),
+                call_hedge,
+                hedge_delay(config, stage, config.get("hedge_percentile", 95)),
+                lambda output: not is_fallback_response(output),
+            )
+            return output
+        return _call_provider_stage(stage, prompt, config, similarity_text, on_retry)
+    except Exception as e:
+        # Once the hedge has run, the fallback provider has already been tried
+        if fallback is None or hedge_started or not is_upstream_failure(e):
+            raise
+        if on_failover is not None:
+            on_failover(config, fallback, e)
+        return _call_provider_stage(stage, prompt, fallback, similarity_text, on_retry)
+
+
+def _stream_provider_stage(stage, prompt, config, stream_function, similarity_text, on_retry):
+    prompt, max_tokens = plan_request(stage, prompt, config)
+    if config.get("use_cache", True):
+        hit, output = cache_get(stage, prompt, config)
+        if hit:
+            yield TEXT, output
+            return
+
+    def open_stream():
+        mark_attempt()
+        return guarded_stream(config, lambda: pooled_stream(config, lambda host_config: stream_function(host_config, prompt, max_tokens)))
+
+    text = ""
+    with instrument_call(config, stage, streaming=True, max_tokens=max_tokens):
+        for kind, delta in stream_with_retries(config, prompt, open_stream, on_retry):
+            mark_first_token()
+            if kind == TEXT:
+                text += delta
+            yield kind, delta
+
+    if config.get("use_cache", True):
+        cache_put(stage, prompt, config, text, similarity_text)
+
+
+def stream_stage(stage, prompt, config, stream_function, similarity_text=None, on_retry=None, on_failover=None):
+    """
+    Stream a stage's output, replaying a cached response as a single delta when there is one.
+    Like call_stage(), the stream switches to the fallback provider if the provider is
+    unavailable, as long as nothing has been streamed yet.
+
+    Args:
+        stage (str): The pipeline stage the streamed text is cached under
+        prompt (str): The prompt to send to the model
+        config (dict): Provider settings from get_provider_config()
+        stream_function (callable): Called as stream_function(config, prompt, max_tokens), yields (kind, text) events
+        similarity_text (str): Optional input text stored with the cached response for similarity lookups
+        on_retry (callable): Optional callback(next_attempt, max_attempts, error) run before each retry
+        on_failover (callable): Optional callback(config, fallback_config, error) run before switching to the fallback
+
+    Yields:
+        tuple: (kind, text) events as produced by streaming.stream_completion()
+    """
+    streamed = False
+    try:
+        for event in _stream_provider_stage(stage, prompt, config, stream_function, similarity_text, on_retry):
+            streamed = True
+            yield event
+    except Exception as e:
+        fallback = config.get("fallback")
+        if streamed or fallback is None or not is_upstream_failure(e):
+            raise
+        if on_failover is not None:
+            on_failover(config, fallback, e)
+        yield from _stream_provider_stage(stage, prompt, fallback, stream_function, similarity_text, on_retry)
+
+
+call_stage_async = make_async(call_stage)
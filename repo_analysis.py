@@ -0,0 +1,846 @@
+import base64
+import contextlib
+import io
+import math
+import mmap
+import os
+import subprocess
+import tarfile
+import zipfile
+from collections import defaultdict
+
+from clients import get_http_session
+from concurrency import map_ordered
+from token_budget import estimate_tokens
+from summary_cache import git_blob_sha, summary_key, get_summaries, put_summaries
+from source_extractors import extract_declarations, EXTRACTORS, EXTRACTION_TIME_LIMIT_SECONDS
+
+# --------- Repository Analysis --------- #
+
+# The GitHub analysis turns a repository into a system description: its README, then short
+# summaries of the code files that say the most about the system within the configured token
+# limit (see select_files). Files are read from the GitHub API one at a time, or from a single
+# archive of the repository that is streamed through tarfile/zipfile without being extracted.
+# Repositories that are not on GitHub can be read from a local directory or git repository.
+# Summaries are cached by the git blob SHA of each file (see summary_cache), so unchanged files
+# are neither downloaded again nor summarized again.
+
+# File types that are summarized
+CODE_EXTENSIONS = ('.py', '.js', '.ts', '.html', '.css', '.java', '.go', '.rb', '.c', '.cpp', '.h', '.cs', '.php')
+
+README_NAMES = ("README.md", "readme.md")
+
+# Files downloaded at the same time when reading through the GitHub API
+GITHUB_FETCH_CONCURRENCY = int(os.getenv("GITHUB_FETCH_CONCURRENCY", "8"))
+
+# How repositories are read by default: "archive" (one download) or "api" (one request per file)
+GITHUB_INGESTION = os.getenv("GITHUB_INGESTION", "archive")
+
+# Stored with cached summaries; bump it whenever summarize_content changes its output
+SUMMARIZER_VERSION = 2
+
+# Files of an archive whose cached summaries are looked up together
+ARCHIVE_LOOKUP_BATCH = 64
+
+# Files larger than this are skipped rather than read into memory
+MAX_FILE_BYTES = int(os.getenv("REPO_MAX_FILE_BYTES", str(1024 * 1024)))
+
+# Directories local repositories may be read from, separated by os.pathsep. Local analysis is
+# disabled when this is empty, since it reads files on the machine running the app.
+LOCAL_REPOSITORY_ROOTS = [root for root in os.getenv("LOCAL_REPOSITORY_ROOTS", "").split(os.pathsep) if root]
+
+# Local files at least this large are memory-mapped instead of read into a buffer
+MMAP_THRESHOLD_BYTES = 64 * 1024
+
+# Local files read at the same time
+LOCAL_READ_CONCURRENCY = 4
+
+
+def is_hidden_path(path):
+    # Inside a directory such as .git or .github, which every reader skips alike
+    return any(part.startswith(".") for part in path.split("/")[:-1])
+
+
+def is_code_file(path):
+    return path.endswith(CODE_EXTENSIONS) and not is_hidden_path(path)
+
+
+# Sort files by importance (you can customize this logic)
+# For example, prioritize main files, configuration files, etc.
+def file_importance(path):
+    # Lower score means higher importance
+    if path.lower() in ['main.py', 'app.py', 'index.js', 'package.json', 'config.json']:
+        return 0
+    if 'test' in path.lower() or 'spec' in path.lower():
+        return 3
+    if path.endswith(('.py', '.js', '.ts', '.java', '.go')):
+        return 1
+    return 2
+
+
+def summarize_file(file_path, content):
+    """
+    Summarize a file's content by extracting key components.
+    Adapts the level of detail based on file size and importance.
+     
+    Args:
+        file_path: Path to the file
+        content: Content of the file
+         
+    Returns:
+        A string summary of the file
+    """
+    return f"File: {file_path}\n" + summarize_content(file_path, content)
+
+
+def summarize_content(file_path, content):
+    """
+    Summarize a file's content, without the "File: <path>" header that summarize_file adds.
+    Apart from the content, the result only depends on the file type and on whether the file
+    is a README (see _summary_kind), which is what makes it cacheable by blob SHA.
+
+    Args:
+        file_path: Path to the file
+        content: Content of the file
+
+    Returns:
+        A string summary of the content
+    """
+    return _summarize_content(file_path, content)[0]
+
+
+# Function to summarize a file's content, also returning False if extraction hit its time limit
+def _summarize_content(file_path, content):
+    # Determine file type
+    file_ext = file_path.split('.')[-1].lower() if '.' in file_path else ''
+     
+     # Initialize summary
+    summary = ""
+    
+    # For very large files, be more selective
+    is_large_file = len(content) > 10000
+     
+    # Extract imports, functions and classes based on file type
+    declarations, complete = extract_declarations(file_ext, content)
+    imports = declarations["imports"]
+    functions = declarations["functions"]
+    classes = declarations["classes"]
+     
+    # Add imports to summary (limit based on file size)
+    import_limit = 5 if not is_large_file else 3
+    
+    if imports: 
+        summary += "Imports:\n" + "\n".join(imports[:import_limit])
+        if len(imports) > import_limit:
+            summary += f"\n... ({len(imports) - import_limit} more imports)"
+        summary += "\n"
+     
+    # Add classes to summary (limit based on file size)
+    class_limit = 5 if not is_large_file else 3
+    if classes:
+        summary += "Classes:\n" + "\n".join(classes[:class_limit])
+        if len(classes) > class_limit:
+            summary += f"\n... ({len(classes) - class_limit} more classes)"
+        summary += "\n"
+     
+    # Add functions to summary (limit based on file size)
+    function_limit = 10 if not is_large_file else 5
+    if functions:
+        summary += "Functions:\n" + "\n".join(functions[:function_limit])
+        if len(functions) > function_limit:
+            summary += f"\n... ({len(functions) - function_limit} more functions)"
+        summary += "\n"
+     
+    # For configuration files (JSON, YAML, etc.), try to extract key information
+    if file_ext in ['json', 'yaml', 'yml', 'toml', 'ini']:
+        # Just include a snippet of the beginning for config files
+        config_preview = content[:500] + ("..." if len(content) > 500 else "")
+        summary += "Configuration Content Preview:\n" + config_preview + "\n"
+     
+    # For README or documentation files, include a brief excerpt
+    if 'readme' in file_path.lower() or file_ext in ['md', 'rst', 'txt']:
+        doc_preview = content[:300] + ("..." if len(content) > 300 else "")
+        summary += "Content Preview:\n" + doc_preview + "\n"
+
+    if not complete:
+        summary += f"(Declarations after the first {EXTRACTION_TIME_LIMIT_SECONDS}s of extraction not listed)\n"
+
+    return summary, complete
+
+
+def analyze_files(repo_label, readme_content, files, read_files, token_limit, token_estimation_model="gpt-4o", progress=None):
+    """
+    Compile a system description from a README and file summaries. The files whose summaries
+    fit the token limit are chosen up front (see select_files), and only those are read.
+
+    Args:
+        repo_label (str): How the repository is named in the description, e.g. its URL
+        readme_content (str): The README, or "" if there is none
+        files (list): (path, size, tokens) per code file, see select_files()
+        read_files (callable): Given a list of paths, returns their (path, (summary, tokens), error)
+                               results in that order; consumed lazily and closed when done
+        token_limit (int): The configured token limit for the analysis
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+        progress (callable): Optional callback(fraction, text)
+
+    Returns:
+        tuple: (system description, estimated tokens of the description)
+    """
+    file_summaries = defaultdict(list)
+
+    # Reserve some tokens for the model's response (typically 20-30% of the context window)
+    # This ensures the model has enough space to generate a response
+    analysis_token_limit = int(token_limit * 0.7)
+
+    readme_tokens = estimate_tokens(readme_content, token_estimation_model) if readme_content else 0
+
+    # If README is too large, truncate it
+    if readme_tokens > analysis_token_limit * 0.7:
+        # Truncate README to 70% of the analysis token limit
+        truncation_ratio = (analysis_token_limit * 0.7) / readme_tokens
+        max_readme_chars = int(len(readme_content) * truncation_ratio)
+        readme_content = readme_content[:max_readme_chars] + "...\n(README truncated due to length)\n\n"
+        readme_tokens = estimate_tokens(readme_content, token_estimation_model)
+
+    # Read the files chosen for what is left of the token limit. When a summary turns out not
+    # to fit, the estimates were short: the round stops, and the next one chooses again from
+    # the unread files. What summaries smaller than estimated leave unused is also filled then.
+    total_tokens = readme_tokens
+    processed_files = 0
+    skipped_files = 0
+    remaining = list(files)
+    for _ in range(MAX_SELECTION_ROUNDS):
+        selected = select_files(remaining, analysis_token_limit - total_tokens, token_estimation_model)
+        if not selected:
+            break
+        unread = set(selected)
+        remaining = [file for file in remaining if file[0] not in unread]
+        selected_files = [file for file in files if file[0] in unread]
+
+        results = read_files(selected)
+        try:
+            for i, (path, result, error) in enumerate(results):
+                unread.discard(path)
+                # Update progress
+                if progress is not None:
+                    progress(0.2 + (0.8 * ((i + 1) / len(selected))), f"Analyzed file {i+1}/{len(selected)}: {path}")
+
+                if error is not None:
+                    # Skip files that can't be downloaded or decoded
+                    continue
+                summary, summary_tokens = result
+
+                # Check if adding this summary would exceed our token limit
+                if total_tokens + summary_tokens > analysis_token_limit:
+                    skipped_files += 1
+                    break
+
+                file_summaries[path.split('.')[-1]].append(summary)
+                total_tokens += summary_tokens
+                processed_files += 1
+        finally:
+            # Stop the downloads that are no longer needed
+            if hasattr(results, "close"):
+                results.close()
+        remaining.extend(file for file in selected_files if file[0] in unread)
+
+    # Files too large to read at all are not counted as left out for the token limit
+    skipped_files += sum(1 for _, size, tokens in remaining if tokens is not None or size <= MAX_FILE_BYTES)
+    if skipped_files:
+        file_summaries["info"].append(f"Analysis truncated: {skipped_files} more files not analyzed due to token limit.")
+
+    # Compile the analysis into a system description
+    system_description = f"Repository: {repo_label}\n\n"
+
+    if readme_content:
+        system_description += "README.md Content:\n"
+        system_description += readme_content + "\n\n"
+
+    for file_type, summaries in file_summaries.items():
+        system_description += f"{file_type.upper()} Files:\n"
+        for summary in summaries:
+            system_description += summary + "\n"
+        system_description += "\n"
+
+    # Add token usage information
+    estimated_total_tokens = estimate_tokens(system_description, token_estimation_model)
+    system_description += f"\nRepository Analysis Summary:\n"
+    system_description += f"- Files analyzed: {processed_files} of {len(files)} total files\n"
+    system_description += f"- Token usage estimate: ~{estimated_total_tokens} tokens\n"
+    system_description += f"- Token limit configured: {token_limit} tokens\n"
+
+    return system_description, estimated_total_tokens
+
+
+def _summary_kind(path):
+    # Besides the content, a summary depends on the file type and on whether it is a README
+    file_ext = path.split('.')[-1].lower() if '.' in path else ''
+    return file_ext + ("+readme" if 'readme' in path.lower() else "")
+
+
+def _cache_key(path, blob_sha):
+    return summary_key(blob_sha, _summary_kind(path), SUMMARIZER_VERSION)
+
+
+# Function to add the file header to a summary and its token estimate
+def _with_header(path, summary, tokens, token_estimation_model):
+    header = f"File: {path}\n"
+    return header + summary, estimate_tokens(header, token_estimation_model) + tokens
+
+
+# Function to summarize a file and estimate the summary's tokens, noting new summaries for the cache
+def _summarize(path, content, token_estimation_model, key=None, new_summaries=None):
+    summary, complete = _summarize_content(path, content)
+    tokens = estimate_tokens(summary, token_estimation_model)
+    # A summary cut short by the time limit depends on the machine's load, so it is not kept
+    if new_summaries is not None and complete:
+        new_summaries.append((key, summary, tokens))
+    return _with_header(path, summary, tokens, token_estimation_model)
+
+
+# Function to use a cached summary, counting its tokens if they were counted for another model
+def _cached_summary(path, cached, token_estimation_model):
+    summary, tokens = cached
+    if tokens is None:
+        tokens = estimate_tokens(summary, token_estimation_model)
+    return _with_header(path, summary, tokens, token_estimation_model)
+
+
+def _store_when_done(results, new_summaries, token_estimation_model):
+    # Pass the results on, then cache the summaries made for them, also when stopped early
+    try:
+        yield from results
+    finally:
+        if hasattr(results, "close"):
+            results.close()
+        put_summaries(list(new_summaries), token_estimation_model)
+
+
+# --------- File Selection --------- #
+
+# Files are chosen before any of them is downloaded: each file's value (its importance and
+# path signals) is weighed against the tokens of its summary, which are known for cached
+# summaries and estimated from the file size (the tree's `size` field) otherwise. Files are
+# packed into the token budget by value per token, skipping the ones that do not fit, so
+# small valuable files further down the list still make it in and files that would not fit
+# are never downloaded. Summaries are small next to the budget, so this is within one file of
+# the best possible packing.
+
+# Summaries list at most 5 imports, 5 classes and 10 functions, so their size levels off:
+# roughly this many tokens per doubling of the file size above SUMMARY_BASE_BYTES, up to the cap
+SUMMARY_BASE_BYTES = 256
+SUMMARY_TOKENS_PER_DOUBLING = 12
+MAX_ESTIMATED_SUMMARY_TOKENS = 150
+
+# Value of a file by its file_importance score
+IMPORTANCE_VALUES = {0: 10.0, 1: 4.0, 2: 2.0, 3: 0.5}
+
+# Path parts of code that usually handles requests, users or secrets
+SECURITY_PATH_SIGNALS = ('auth', 'login', 'session', 'token', 'crypt', 'secret', 'password', 'permission', 'oauth',
+                         'security', 'api', 'route', 'handler', 'controller', 'middleware', 'upload', 'admin')
+SECURITY_SIGNAL_WEIGHT = 2.0
+
+# Vendored, generated or bundled code, which says little about the system itself
+LOW_VALUE_PATH_SIGNALS = ('vendor/', 'node_modules/', 'third_party/', 'dist/', 'build/', '.min.', 'migrations/', 'generated')
+LOW_VALUE_WEIGHT = 0.1
+
+# Each directory level makes a file a little less central
+DEPTH_DISCOUNT = 0.15
+
+# Files this small (e.g. an empty __init__.py) have little to summarize
+TINY_FILE_BYTES = 200
+TINY_FILE_WEIGHT = 0.3
+
+# Rounds of selection; later rounds correct for summaries larger or smaller than estimated
+MAX_SELECTION_ROUNDS = 5
+
+
+def estimate_summary_tokens(path, size):
+    """
+    Estimate the tokens of a file's summary, without its header, before reading the file.
+
+    Args:
+        path (str): Path of the file
+        size (int): Size of the file in bytes
+
+    Returns:
+        int: The estimated tokens
+    """
+    file_ext = path.split('.')[-1].lower() if '.' in path else ''
+    # Types without an extractor (see source_extractors) are summarized by their header alone
+    if file_ext not in EXTRACTORS or size <= 0:
+        return 0
+    doublings = math.log2(max(size, SUMMARY_BASE_BYTES) / SUMMARY_BASE_BYTES)
+    return min(MAX_ESTIMATED_SUMMARY_TOKENS, int(SUMMARY_TOKENS_PER_DOUBLING * (1 + doublings)))
+
+
+def file_value(path, size):
+    """
+    Score how much a file's summary says about the system.
+
+    Args:
+        path (str): Path of the file
+        size (int): Size of the file in bytes
+
+    Returns:
+        float: The value; higher is more useful
+    """
+    lower_path = path.lower()
+    value = IMPORTANCE_VALUES[file_importance(path)]
+    if any(signal in lower_path for signal in SECURITY_PATH_SIGNALS):
+        value *= SECURITY_SIGNAL_WEIGHT
+    if any(signal in lower_path for signal in LOW_VALUE_PATH_SIGNALS):
+        value *= LOW_VALUE_WEIGHT
+    if size < TINY_FILE_BYTES:
+        value *= TINY_FILE_WEIGHT
+    return value / (1 + DEPTH_DISCOUNT * path.count('/'))
+
+
+def select_files(files, budget, token_estimation_model="gpt-4o"):
+    """
+    Choose the files whose summaries fit the token budget and are worth the most.
+
+    Args:
+        files (list): (path, size, tokens) per candidate file; tokens is the exact size of its
+                      summary with header if known (e.g. cached), otherwise None
+        budget (int): Tokens available for summaries
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+
+    Returns:
+        list: The paths of the chosen files, most important first
+    """
+    candidates = []
+    for path, size, tokens in files:
+        if tokens is None:
+            if size > MAX_FILE_BYTES:
+                # Would only be skipped after reading
+                continue
+            tokens = estimate_tokens(f"File: {path}\n", token_estimation_model) + estimate_summary_tokens(path, size)
+        candidates.append((file_value(path, size) / max(tokens, 1), path, tokens))
+
+    selected = []
+    for _, path, tokens in sorted(candidates, key=lambda candidate: candidate[0], reverse=True):
+        if tokens <= budget:
+            selected.append(path)
+            budget -= tokens
+    return sorted(selected, key=file_importance)
+
+
+# --------- Reading Through the GitHub API --------- #
+
+def read_github_api(repo, ref, token_estimation_model="gpt-4o"):
+    """
+    Read a repository through the GitHub API: the tree in one request, then one request per
+    chosen file, GITHUB_FETCH_CONCURRENCY at a time.
+
+    Args:
+        repo: The PyGithub repository
+        ref (str): The branch to read
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+
+    Returns:
+        tuple: (README content or "", files, read_files), see analyze_files()
+    """
+    # Get the tree of the branch
+    tree = repo.get_git_tree(ref, recursive=True)
+
+    # First, get the README to prioritize it
+    readme_content = ""
+    for name in README_NAMES:
+        try:
+            readme_file = repo.get_contents(name, ref=ref)
+            readme_content = base64.b64decode(readme_file.content).decode()
+            break
+        except Exception:
+            continue
+
+    # Get all code files, with their sizes from the tree
+    code_files = [file for file in tree.tree if file.type == "blob" and is_code_file(file.path)]
+
+    # Files whose content was summarized before are not downloaded
+    keys = {file.path: _cache_key(file.path, file.sha) for file in code_files}
+    cached = get_summaries(keys.values(), token_estimation_model)
+    ready = {path: _cached_summary(path, cached[key], token_estimation_model) for path, key in keys.items() if key in cached}
+    files = [(file.path, file.size or 0, ready[file.path][1] if file.path in ready else None) for file in code_files]
+
+    def read_files(paths):
+        new_summaries = []
+
+        # Download and summarize a file (runs on the download threads)
+        def fetch_and_summarize(path):
+            if path in ready:
+                return ready[path]
+            content = repo.get_contents(path, ref=ref)
+            return _summarize(path, base64.b64decode(content.content).decode(), token_estimation_model, keys[path], new_summaries)
+
+        # Files are downloaded concurrently but handled in the order given
+        results = map_ordered(fetch_and_summarize, paths, GITHUB_FETCH_CONCURRENCY)
+        return _store_when_done(results, new_summaries, token_estimation_model)
+
+    return readme_content, files, read_files
+
+
+# --------- Reading From an Archive --------- #
+
+def _strip_top_directory(name):
+    # GitHub archives put every file under "<owner>-<repo>-<sha>/"
+    return name.split("/", 1)[1] if "/" in name else name
+
+
+def iter_archive(fileobj, archive_format="tar"):
+    """
+    Stream the README and code files out of a repository archive, one member at a time,
+    without extracting anything to disk.
+
+    Args:
+        fileobj: A binary file object; tar archives (optionally compressed) are read
+                 sequentially, so this can be a network stream. Zip archives need a seekable
+                 file and are read into memory otherwise.
+        archive_format (str): "tar" or "zip"
+
+    Yields:
+        tuple: (path relative to the repository root, content as bytes, or None if the file
+               is larger than MAX_FILE_BYTES)
+    """
+    def wanted(path):
+        return path in README_NAMES or is_code_file(path)
+
+    if archive_format == "zip":
+        if not (hasattr(fileobj, "seekable") and fileobj.seekable()):
+            fileobj = io.BytesIO(fileobj.read())
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                path = _strip_top_directory(info.filename)
+                if info.is_dir() or not wanted(path):
+                    continue
+                if info.file_size > MAX_FILE_BYTES:
+                    yield path, None
+                    continue
+                with archive.open(info) as f:
+                    yield path, f.read()
+        return
+
+    # "r|*" reads the stream front to back and detects the compression
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            path = _strip_top_directory(member.name)
+            if not member.isfile() or not wanted(path):
+                continue
+            if member.size > MAX_FILE_BYTES:
+                yield path, None
+                continue
+            yield path, archive.extractfile(member).read()
+
+
+def read_archive(fileobj, archive_format="tar", token_estimation_model="gpt-4o", progress=None):
+    """
+    Read a repository from an archive. Archives are read front to back, so every code file is
+    summarized as it streams past (unless its summary is cached); only the summaries are
+    kept, and the files are chosen from them with their exact token counts.
+
+    Args:
+        fileobj: The archive, see iter_archive()
+        archive_format (str): "tar" or "zip"
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+        progress (callable): Optional callback(fraction, text)
+
+    Returns:
+        tuple: (README content or "", files, read_files), see analyze_files()
+    """
+    readme_content = ""
+    summaries = {}
+    sizes = {}
+    new_summaries = []
+    pending = []
+
+    # Summarize a batch of files, with one cache lookup for the whole batch
+    def summarize_pending():
+        cached = get_summaries([key for _, key, _ in pending], token_estimation_model)
+        for path, key, data in pending:
+            try:
+                if key in cached:
+                    summaries[path] = (_cached_summary(path, cached[key], token_estimation_model), None)
+                else:
+                    summaries[path] = (_summarize(path, data.decode(), token_estimation_model, key, new_summaries), None)
+            except Exception as e:
+                summaries[path] = (None, e)
+        pending.clear()
+
+    for path, data in iter_archive(fileobj, archive_format):
+        if path in README_NAMES:
+            if data and not readme_content:
+                readme_content = data.decode(errors="replace")
+            continue
+        if progress is not None:
+            progress(0.1, f"Reading archive: {len(summaries) + len(pending) + 1} files")
+        if data is None:
+            summaries[path] = (None, ValueError(f"{path} is larger than {MAX_FILE_BYTES} bytes"))
+            sizes[path] = MAX_FILE_BYTES + 1
+            continue
+        sizes[path] = len(data)
+        pending.append((path, _cache_key(path, git_blob_sha(data)), data))
+        if len(pending) >= ARCHIVE_LOOKUP_BATCH:
+            summarize_pending()
+    summarize_pending()
+    put_summaries(new_summaries, token_estimation_model)
+
+    files = [(path, sizes[path], result[1] if result is not None else None) for path, (result, _) in summaries.items()]
+
+    def read_files(paths):
+        return [(path, *summaries[path]) for path in paths]
+
+    return readme_content, files, read_files
+
+
+def read_github_archive(repo, ref, token_estimation_model="gpt-4o", progress=None):
+    """
+    Read a repository from the tarball of a branch, downloaded in a single request and
+    streamed, so API quota and memory use do not grow with the size of the repository.
+
+    Args:
+        repo: The PyGithub repository
+        ref (str): The branch to read
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+        progress (callable): Optional callback(fraction, text)
+
+    Returns:
+        tuple: See read_archive()
+    """
+    # A short-lived download URL, which works for private repositories too
+    url = repo.get_archive_link("tarball", ref=ref)
+    with get_http_session().get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        # Undo any transfer encoding; tarfile handles the archive's own compression
+        response.raw.decode_content = True
+        return read_archive(response.raw, "tar", token_estimation_model, progress)
+
+
+# --------- Reading a Local Directory or Git Repository --------- #
+
+def resolve_local_repository(path):
+    """
+    Check that a path may be analyzed as a local repository.
+
+    Args:
+        path (str): A directory, as entered by the user
+
+    Returns:
+        str: The absolute, resolved path
+
+    Raises:
+        ValueError: If local analysis is disabled, the path is outside LOCAL_REPOSITORY_ROOTS
+                    or it is not a directory
+    """
+    if not LOCAL_REPOSITORY_ROOTS:
+        raise ValueError("Local repositories are disabled. Set LOCAL_REPOSITORY_ROOTS to the directories that may be analyzed.")
+    resolved = os.path.realpath(os.path.expanduser(path))
+    roots = [os.path.realpath(os.path.expanduser(root)) for root in LOCAL_REPOSITORY_ROOTS]
+    if not any(os.path.commonpath([resolved, root]) == root for root in roots):
+        raise ValueError(f"{path} is not inside the directories allowed by LOCAL_REPOSITORY_ROOTS")
+    if not os.path.isdir(resolved):
+        raise ValueError(f"{path} is not a directory")
+    return resolved
+
+
+def _walk(root, prefix=""):
+    # Depth-first, skipping .git and other hidden directories (see is_hidden_path) and not following symlinks
+    with os.scandir(root) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith("."):
+                    yield from _walk(entry.path, prefix + entry.name + "/")
+            elif entry.is_file(follow_symlinks=False):
+                yield prefix + entry.name, entry.path, entry.stat(follow_symlinks=False).st_size
+
+
+@contextlib.contextmanager
+def _local_file_data(path, size):
+    # The file's content as bytes, or for large files a memoryview of the file mapped into memory
+    with open(path, "rb") as f:
+        if size < MMAP_THRESHOLD_BYTES:
+            yield f.read()
+            return
+        # Hash and decode straight from the page cache, without copying the file into a buffer first
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            yield view
+
+
+def read_local_directory(root, token_estimation_model="gpt-4o"):
+    """
+    Read a repository from a directory on disk, e.g. a working copy including uncommitted changes.
+
+    Args:
+        root (str): The directory, see resolve_local_repository()
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+
+    Returns:
+        tuple: (README content or "", files, read_files), see analyze_files()
+    """
+    readme_content = ""
+    code_files = []
+    for path, full_path, size in _walk(root):
+        if path in README_NAMES and not readme_content:
+            try:
+                with _local_file_data(full_path, size) as data:
+                    readme_content = str(data, "utf-8")
+            except (OSError, ValueError):
+                # Unreadable, empty (which cannot be mapped) or not UTF-8
+                pass
+        elif is_code_file(path):
+            code_files.append((path, full_path, size))
+    local_files = {path: (full_path, size) for path, full_path, size in code_files}
+    # The cache is keyed by content, so whether a summary is cached is only known once the file is read
+    files = [(path, size, None) for path, _, size in code_files]
+
+    def read_files(paths):
+        new_summaries = []
+
+        def read_and_summarize(path):
+            full_path, size = local_files[path]
+            if size > MAX_FILE_BYTES:
+                raise ValueError(f"{path} is larger than {MAX_FILE_BYTES} bytes")
+            with _local_file_data(full_path, size) as data:
+                # The file is only decoded and summarized if its summary is not cached
+                key = _cache_key(path, git_blob_sha(data))
+                cached = get_summaries([key], token_estimation_model)
+                if key in cached:
+                    return _cached_summary(path, cached[key], token_estimation_model)
+                content = str(data, "utf-8")
+            return _summarize(path, content, token_estimation_model, key, new_summaries)
+
+        results = map_ordered(read_and_summarize, paths, LOCAL_READ_CONCURRENCY)
+        return _store_when_done(results, new_summaries, token_estimation_model)
+
+    return readme_content, files, read_files
+
+
+def _git(repository, *args):
+    try:
+        return subprocess.run(["git", "-C", repository, *args], capture_output=True, check=True).stdout
+    except FileNotFoundError:
+        raise ValueError("git is not installed")
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"git {args[0]} failed: {e.stderr.decode(errors='replace').strip()}")
+
+
+def _read_blobs(repository, blobs):
+    # Read blobs through one `git cat-file --batch` process, in the order given
+    process = subprocess.Popen(["git", "-C", repository, "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for sha in blobs:
+            process.stdin.write(sha.encode() + b"\n")
+            process.stdin.flush()
+            header = process.stdout.readline().split()
+            if len(header) != 3:
+                raise ValueError(f"git object {sha} could not be read")
+            size = int(header[2])
+            data = process.stdout.read(size)
+            process.stdout.read(1)  # The newline after each object
+            yield data
+    finally:
+        process.stdin.close()
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def read_git_repository(repository, ref="HEAD", token_estimation_model="gpt-4o"):
+    """
+    Read a repository at a commit from its git objects, so any branch, tag or commit of a
+    working copy or bare repository can be analyzed without checking it out.
+
+    Args:
+        repository (str): The working copy or bare repository, see resolve_local_repository()
+        ref (str): The branch, tag or commit to read
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+
+    Returns:
+        tuple: (README content or "", files, read_files), see analyze_files()
+
+    Raises:
+        ValueError: If git is not installed or the ref does not exist
+    """
+    if ref.startswith("-"):
+        raise ValueError(f"Invalid git ref: {ref}")
+    # One "<mode> <type> <sha> <size>\t<path>" entry per file
+    listing = _git(repository, "ls-tree", "-r", "-l", "-z", ref, "--")
+    readme_sha = None
+    code_files = []
+    for entry in listing.split(b"\0"):
+        if not entry:
+            continue
+        info, path = entry.split(b"\t", 1)
+        _, object_type, sha, size = info.split()
+        path = path.decode(errors="replace")
+        if object_type != b"blob":
+            continue
+        if path in README_NAMES and readme_sha is None:
+            readme_sha = sha.decode()
+        elif is_code_file(path):
+            code_files.append((path, sha.decode(), int(size)))
+
+    readme_content = ""
+    if readme_sha is not None:
+        for data in _read_blobs(repository, [readme_sha]):
+            readme_content = data.decode(errors="replace")
+
+    # Blobs whose summaries are cached are not read
+    keys = {path: _cache_key(path, sha) for path, sha, _ in code_files}
+    cached = get_summaries(keys.values(), token_estimation_model)
+    ready = {path: _cached_summary(path, cached[key], token_estimation_model) for path, key in keys.items() if key in cached}
+    blob_files = {path: (sha, size) for path, sha, size in code_files}
+    files = [(path, size, ready[path][1] if path in ready else None) for path, _, size in code_files]
+
+    def results(paths, new_summaries):
+        wanted = [path for path in paths if path not in ready and blob_files[path][1] <= MAX_FILE_BYTES]
+        blobs = _read_blobs(repository, [blob_files[path][0] for path in wanted])
+        try:
+            for path in paths:
+                if path in ready:
+                    yield path, ready[path], None
+                    continue
+                if blob_files[path][1] > MAX_FILE_BYTES:
+                    yield path, None, ValueError(f"{path} is larger than {MAX_FILE_BYTES} bytes")
+                    continue
+                data = next(blobs)
+                try:
+                    yield path, _summarize(path, data.decode(), token_estimation_model, keys[path], new_summaries), None
+                except Exception as e:
+                    yield path, None, e
+        finally:
+            blobs.close()
+
+    def read_files(paths):
+        new_summaries = []
+        return _store_when_done(results(paths, new_summaries), new_summaries, token_estimation_model)
+
+    return readme_content, files, read_files
+
+
+def read_local_repository(path, ref="", token_estimation_model="gpt-4o"):
+    """
+    Read a repository from the local file system: the files on disk, or the given ref of a
+    git repository. Bare repositories are always read from git, at HEAD by default.
+
+    Args:
+        path (str): The directory, as entered by the user
+        ref (str): Optional branch, tag or commit to read from git
+        token_estimation_model (str): The model whose tokenizer estimates are based on
+
+    Returns:
+        tuple: (README content or "", files, read_files), see analyze_files()
+
+    Raises:
+        ValueError: If the path may not be read, or the ref cannot be read
+    """
+    repository = resolve_local_repository(path)
+    if ref or _git_is_bare(repository):
+        return read_git_repository(repository, ref or "HEAD", token_estimation_model)
+    return read_local_directory(repository, token_estimation_model)
+
+
+def _git_is_bare(repository):
+    try:
+        return _git(repository, "rev-parse", "--is-bare-repository").strip() == b"true"
+    except ValueError:
+        return False
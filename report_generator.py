@@ -1,6 +1,9 @@
-import markdown # pip install markdown
-from weasyprint import HTML # pip install weasyprint
 import streamlit as st # pip install streamlit
+from lazy_imports import lazy_import
+
+# Only needed for the PDF export, so imported on first use
+markdown = lazy_import("markdown") # pip install markdown
+weasyprint = lazy_import("weasyprint") # pip install weasyprint
 
 # --------- Report Generation --------- #
 
@@ -156,5 +159,5 @@ def generate_pdf(report_md):
     </body>
     </html>
     """
-    pdf_bytes = HTML(string=full_html).write_pdf()
+    pdf_bytes = weasyprint.HTML(string=full_html).write_pdf()
     return pdf_bytes
\ No newline at end of file
@@ -0,0 +1,337 @@
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from clients import credential_fingerprint
+
+# --------- Rate Limiting and Retries --------- #
+
+# Default (requests per minute, input tokens per minute) for each provider; 0 disables the limit.
+# Override with LLM_RPM_<PROVIDER> / LLM_TPM_<PROVIDER>, e.g. LLM_RPM_GROQ=60.
+DEFAULT_RATE_LIMITS = {
+    "OpenAI API": (500, 200000),
+    "Azure OpenAI Service": (300, 120000),
+    "Anthropic API": (50, 40000),
+    "Google AI API": (60, 1000000),
+    "Mistral API": (60, 500000),
+    "Groq API": (30, 6000),
+    "Ollama": (0, 0),
+    "LM Studio Server": (0, 0),
+}
+
+# Environment variable suffix for each provider
+PROVIDER_ENV_NAMES = {
+    "OpenAI API": "OPENAI",
+    "Azure OpenAI Service": "AZURE",
+    "Anthropic API": "ANTHROPIC",
+    "Google AI API": "GOOGLE",
+    "Mistral API": "MISTRAL",
+    "Groq API": "GROQ",
+    "Ollama": "OLLAMA",
+    "LM Studio Server": "LM_STUDIO",
+}
+
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX", "30.0"))
+
+# HTTP status codes worth retrying: timeouts, conflicts, rate limits, server errors and Anthropic's "overloaded"
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Exception class names (from any SDK) that indicate a transient network or server problem
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+    "TimeoutError",
+    "TransportError",
+    "RateLimitError",
+    "InternalServerError",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "TooManyRequests",
+    "EmptyResponseError",
+}
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class EmptyResponseError(Exception):
+    """Raised when a provider call returns no output, e.g. because the model's JSON could not be parsed."""
+
+
+class TokenBucket:
+    """
+    Refills `capacity` units per minute. Callers block in acquire() until enough units are
+    available, and pause() stops every caller until a rate limit reported by the server has passed.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _wait_time(self, amount):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.capacity / 60.0)
+        self.updated_at = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.available >= amount:
+            self.available -= amount
+            return 0.0
+        return (amount - self.available) * 60.0 / self.capacity
+
+    def acquire(self, amount=1):
+        # A single request larger than the whole budget would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                wait = self._wait_time(amount)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def get_rate_limits(provider):
+    """
+    Get the configured limits for a provider.
+
+    Args:
+        provider (str): The provider name as shown in the sidebar
+
+    Returns:
+        tuple: (requests per minute, input tokens per minute), 0 meaning unlimited
+    """
+    default_rpm, default_tpm = DEFAULT_RATE_LIMITS.get(provider, (0, 0))
+    env_name = PROVIDER_ENV_NAMES.get(provider, "")
+    rpm = int(os.getenv(f"LLM_RPM_{env_name}", default_rpm))
+    tpm = int(os.getenv(f"LLM_TPM_{env_name}", default_tpm))
+    return rpm, tpm
+
+
+def _get_buckets(config):
+    # Limits apply per API key (or per endpoint for local servers)
+    namespace = credential_fingerprint(config["credential"]) if config.get("credential") else config.get("endpoint") or ""
+    key = (config["provider"], namespace)
+    with _buckets_lock:
+        buckets = _buckets.get(key)
+        if buckets is None:
+            rpm, tpm = get_rate_limits(config["provider"])
+            buckets = {
+                "requests": TokenBucket(rpm) if rpm > 0 else None,
+                "tokens": TokenBucket(tpm) if tpm > 0 else None,
+            }
+            _buckets[key] = buckets
+    return buckets
+
+
+def _estimate_prompt_tokens(prompt):
+    # Roughly four characters per token; good enough for budgeting
+    return max(1, len(prompt or "") // 4)
+
+
+def wait_for_capacity(config, prompt):
+    """
+    Block until the provider's request and token budgets allow another call.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        prompt (str): The prompt about to be sent
+    """
+    buckets = _get_buckets(config)
+    if buckets["requests"] is not None:
+        buckets["requests"].acquire(1)
+    if buckets["tokens"] is not None:
+        buckets["tokens"].acquire(_estimate_prompt_tokens(prompt))
+
+
+def _get_response(error):
+    # requests responses are falsy for error statuses, so compare with None explicitly
+    response = getattr(error, "response", None)
+    if response is None:
+        response = getattr(error, "raw_response", None)
+    return response
+
+
+def get_status_code(error):
+    """
+    Extract the HTTP status code from an SDK or requests exception.
+
+    Args:
+        error (Exception): The exception raised by a provider call
+
+    Returns:
+        int: The status code, or None if the error has none
+    """
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    status_code = getattr(_get_response(error), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def get_retry_after(error):
+    """
+    Read the delay requested by the server from Retry-After style headers.
+
+    Args:
+        error (Exception): The exception raised by a provider call
+
+    Returns:
+        float: Seconds to wait, or None if the server did not say
+    """
+    headers = getattr(_get_response(error), "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        # Retry-After may also be an HTTP date
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_error(error):
+    """
+    Decide whether a failed provider call is worth retrying.
+    Rate limits, timeouts, connection problems, server errors and unparseable model output
+    are retryable; authentication, permission, bad request and not-found errors are fatal.
+
+    Args:
+        error (Exception): The exception raised by a provider call
+
+    Returns:
+        bool: True if the call should be retried
+    """
+    status_code = get_status_code(error)
+    if status_code is not None and 100 <= status_code < 600:
+        return status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, json.JSONDecodeError):
+        # The model produced malformed JSON; another sample usually parses
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def backoff_delay(attempt, error=None):
+    """
+    Compute how long to wait before the next attempt: exponential backoff with full jitter,
+    but never less than the server's Retry-After.
+
+    Args:
+        attempt (int): The number of attempts made so far (1 after the first failure)
+        error (Exception): The exception raised by the last attempt
+
+    Returns:
+        float: Seconds to wait
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+    retry_after = get_retry_after(error) if error is not None else None
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _handle_failure(config, attempt, max_attempts, error, on_retry):
+    if attempt >= max_attempts or not is_retryable_error(error):
+        raise error
+    delay = backoff_delay(attempt, error)
+    if get_status_code(error) == 429:
+        # Hold back every other call to this provider too, instead of letting them hit the limit
+        buckets = _get_buckets(config)
+        for bucket in buckets.values():
+            if bucket is not None:
+                bucket.pause(delay)
+    if on_retry is not None:
+        on_retry(attempt + 1, max_attempts, error)
+    time.sleep(delay)
+
+
+def call_with_retries(config, prompt, func, on_retry=None, max_attempts=None):
+    """
+    Call a provider within its rate limits, retrying transient failures with jittered backoff.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        prompt (str): The prompt being sent (used for token budgeting)
+        func (callable): Makes the provider call
+        on_retry (callable): Optional callback(next_attempt, max_attempts, error) run before each retry
+        max_attempts (int): Total attempts including the first one (defaults to LLM_MAX_ATTEMPTS)
+
+    Returns:
+        The result of func
+
+    Raises:
+        Exception: The last error, once it is fatal or the attempts are used up
+    """
+    max_attempts = max_attempts or MAX_ATTEMPTS
+    attempt = 0
+    while True:
+        attempt += 1
+        wait_for_capacity(config, prompt)
+        try:
+            return func()
+        except Exception as e:
+            _handle_failure(config, attempt, max_attempts, e, on_retry)
+
+
+def stream_with_retries(config, prompt, open_stream, on_retry=None, max_attempts=None):
+    """
+    Streaming counterpart of call_with_retries(). Failures before the first event are retried;
+    once output has been yielded, errors are raised so that text is never duplicated.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        prompt (str): The prompt being sent (used for token budgeting)
+        open_stream (callable): Returns a new iterator of (kind, text) events
+        on_retry (callable): Optional callback(next_attempt, max_attempts, error) run before each retry
+        max_attempts (int): Total attempts including the first one (defaults to LLM_MAX_ATTEMPTS)
+
+    Yields:
+        tuple: The (kind, text) events of the first stream that starts successfully
+    """
+    max_attempts = max_attempts or MAX_ATTEMPTS
+    attempt = 0
+    while True:
+        attempt += 1
+        wait_for_capacity(config, prompt)
+        events = iter(open_stream())
+        try:
+            first_event = next(events)
+        except StopIteration:
+            return
+        except Exception as e:
+            _handle_failure(config, attempt, max_attempts, e, on_retry)
+            continue
+        yield first_event
+        yield from events
+        return
@@ -0,0 +1,298 @@
+import copy
+
+# --------- Structured Output Schemas --------- #
+
+# JSON schemas for the pipeline's JSON payloads, translated below into each provider's
+# constrained-decoding feature so models cannot return malformed or incomplete structures.
+# Mitigations, test cases and the expert analysis are Markdown and have no schema.
+
+THREAT_MODEL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "threat_model": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "Threat Type": {"type": "string"},
+                    "Scenario": {"type": "string"},
+                    "Potential Impact": {"type": "string"},
+                    "Mitigation Consideration": {"type": "string"}
+                },
+                "required": ["Threat Type", "Scenario", "Potential Impact", "Mitigation Consideration"],
+                "additionalProperties": False
+            }
+        },
+        "improvement_suggestions": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    },
+    "required": ["threat_model", "improvement_suggestions"],
+    "additionalProperties": False
+}
+
+DREAD_SCORE = {"type": "integer", "minimum": 1, "maximum": 10}
+
+DREAD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Risk Assessment": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "Threat Type": {"type": "string"},
+                    "Scenario": {"type": "string"},
+                    "Damage Potential": DREAD_SCORE,
+                    "Reproducibility": DREAD_SCORE,
+                    "Exploitability": DREAD_SCORE,
+                    "Affected Users": DREAD_SCORE,
+                    "Discoverability": DREAD_SCORE
+                },
+                "required": ["Threat Type", "Scenario", "Damage Potential", "Reproducibility", "Exploitability", "Affected Users", "Discoverability"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["Risk Assessment"],
+    "additionalProperties": False
+}
+
+# Attack tree nodes nest recursively; providers without $ref support get a root node plus
+# ATTACK_TREE_DEPTH levels of children instead
+ATTACK_TREE_DEPTH = 3
+
+ATTACK_TREE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {"$ref": "#/$defs/node"}
+        }
+    },
+    "$defs": {
+        "node": {
+            "type": "object",
+            "properties": {
+                "id": {
+                    "type": "string",
+                    "description": "Simple alphanumeric identifier for the node"
+                },
+                "label": {
+                    "type": "string",
+                    "description": "Description of the attack vector or goal"
+                },
+                "children": {
+                    "type": "array",
+                    "items": {"$ref": "#/$defs/node"}
+                }
+            },
+            "required": ["id", "label", "children"],
+            "additionalProperties": False
+        }
+    },
+    "required": ["nodes"],
+    "additionalProperties": False
+}
+
+SCHEMAS = {
+    "threat_model": ("threat_model_response", "A STRIDE threat model with improvement suggestions", THREAT_MODEL_SCHEMA),
+    "attack_tree": ("attack_tree", "A structured representation of an attack tree", ATTACK_TREE_SCHEMA),
+    "dread_assessment": ("dread_assessment_response", "A DREAD risk assessment of the identified threats", DREAD_SCHEMA),
+}
+
+# Keywords Gemini's response_schema accepts; everything else is removed
+GEMINI_SCHEMA_KEYS = {"type", "format", "description", "nullable", "enum", "properties", "required", "items"}
+
+# OpenAI models that predate structured outputs and only support JSON mode
+OPENAI_JSON_MODE_ONLY_MODELS = ("gpt-3.5", "gpt-4-", "o1-mini", "o1-preview")
+
+# First Azure OpenAI API version that accepts json_schema response formats
+AZURE_JSON_SCHEMA_API_VERSION = "2024-08-01-preview"
+
+
+def get_schema(name, inline_refs=False):
+    """
+    Get the JSON schema registered for a payload.
+
+    Args:
+        name (str): The payload name, e.g. "threat_model"
+        inline_refs (bool): Replace recursive $ref definitions with a fixed-depth copy, for
+            providers whose constrained decoding cannot follow references
+
+    Returns:
+        dict: A copy of the schema, safe to modify
+    """
+    schema = copy.deepcopy(SCHEMAS[name][2])
+    if inline_refs and "$defs" in schema:
+        definitions = schema.pop("$defs")
+        schema = _inline_refs(schema, definitions, ATTACK_TREE_DEPTH)
+    return schema
+
+
+def _inline_refs(schema, definitions, depth):
+    if isinstance(schema, list):
+        return [_inline_refs(item, definitions, depth) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        definition = copy.deepcopy(definitions[schema["$ref"].rsplit("/", 1)[-1]])
+        if depth == 0:
+            # The deepest level drops its recursive properties (e.g. a leaf node has no children)
+            recursive = [key for key, value in definition.get("properties", {}).items() if "$ref" in repr(value)]
+            for key in recursive:
+                del definition["properties"][key]
+            definition["required"] = [key for key in definition.get("required", []) if key not in recursive]
+            return definition
+        return _inline_refs(definition, definitions, depth - 1)
+    return {key: _inline_refs(value, definitions, depth) for key, value in schema.items()}
+
+
+def _clean_for_gemini(schema):
+    if isinstance(schema, list):
+        return [_clean_for_gemini(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    cleaned = {key: value for key, value in schema.items() if key in GEMINI_SCHEMA_KEYS}
+    if "properties" in cleaned:
+        cleaned["properties"] = {key: _clean_for_gemini(value) for key, value in cleaned["properties"].items()}
+    if "items" in cleaned:
+        cleaned["items"] = _clean_for_gemini(cleaned["items"])
+    return cleaned
+
+
+def supports_json_schema(model_name):
+    """
+    Check whether an OpenAI model supports json_schema response formats.
+
+    Args:
+        model_name (str): The OpenAI model name
+
+    Returns:
+        bool: False for models that only support JSON mode
+    """
+    return not any(model_name == prefix.rstrip("-") or model_name.startswith(prefix) for prefix in OPENAI_JSON_MODE_ONLY_MODELS)
+
+
+def openai_response_format(name, inline_refs=False):
+    """
+    Get an OpenAI-style strict json_schema response_format (also used by LM Studio).
+
+    Args:
+        name (str): The payload name, e.g. "threat_model"
+        inline_refs (bool): Expand recursive definitions, for servers that cannot follow references
+
+    Returns:
+        dict: The response_format argument
+    """
+    schema_name, description, _ = SCHEMAS[name]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema_name,
+            "description": description,
+            "schema": get_schema(name, inline_refs),
+            "strict": True
+        }
+    }
+
+
+def openai_model_response_format(name, model_name):
+    """
+    Get the best response_format an OpenAI model supports: a strict schema, or JSON mode for older models.
+
+    Args:
+        name (str): The payload name, e.g. "threat_model"
+        model_name (str): The OpenAI model name
+
+    Returns:
+        dict: The response_format argument
+    """
+    if supports_json_schema(model_name):
+        return openai_response_format(name)
+    return {"type": "json_object"}
+
+
+def azure_response_format(name, api_version):
+    """
+    Get the best response_format for an Azure OpenAI deployment. json_schema needs API version
+    2024-08-01-preview or later; older versions fall back to JSON mode.
+
+    Args:
+        name (str): The payload name, e.g. "threat_model"
+        api_version (str): The Azure OpenAI API version, e.g. "2024-10-21"
+
+    Returns:
+        dict: The response_format argument
+    """
+    # API versions are ISO dates, optionally with a "-preview" suffix, so they compare as strings
+    if (api_version or "")[:10] >= AZURE_JSON_SCHEMA_API_VERSION[:10]:
+        return openai_response_format(name)
+    return {"type": "json_object"}
+
+
+def anthropic_tool_kwargs(name):
+    """
+    Get the messages.create() arguments that force Claude to answer through a tool whose input
+    schema is the payload schema. Forced tool use is not allowed with extended thinking, so only
+    use this outside thinking mode.
+
+    Args:
+        name (str): The payload name, e.g. "threat_model"
+
+    Returns:
+        dict: The tools and tool_choice arguments
+    """
+    schema_name, description, _ = SCHEMAS[name]
+    return {
+        "tools": [{"name": schema_name, "description": description, "input_schema": get_schema(name)}],
+        "tool_choice": {"type": "tool", "name": schema_name},
+    }
+
+
+def get_anthropic_output(response):
+    """
+    Get the structured output of a Claude response: the forced tool call's input if there is
+    one, otherwise the concatenated text blocks.
+
+    Args:
+        response: The Anthropic messages response
+
+    Returns:
+        dict or str: The tool input, or the response text to be parsed as JSON
+    """
+    for block in response.content:
+        if block.type == "tool_use":
+            return block.input
+    return ''.join(block.text for block in response.content if block.type == "text")
+
+
+def gemini_generation_config(name):
+    """
+    Get a Gemini generation_config that constrains output to the payload schema, reduced to the
+    subset of JSON schema Gemini accepts.
+
+    Args:
+        name (str): The payload name, e.g. "threat_model"
+
+    Returns:
+        dict: The generation_config argument
+    """
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": _clean_for_gemini(get_schema(name, inline_refs=True)),
+    }
+
+
+def ollama_format(name):
+    """
+    Get the Ollama `format` value that constrains output to the payload schema (Ollama 0.5+).
+
+    Args:
+        name (str): The payload name, e.g. "threat_model"
+
+    Returns:
+        dict: The JSON schema to send as `format`
+    """
+    return get_schema(name, inline_refs=True)
@@ -0,0 +1,72 @@
+import hashlib
+import re
+
+# --------- Near-Duplicate Detection --------- #
+
+# Number of hashes kept in a bottom-k MinHash signature
+SIGNATURE_SIZE = 128
+# Number of consecutive words per shingle
+SHINGLE_SIZE = 3
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def similarity_text(*parts):
+    """
+    Join the user-supplied inputs of a prompt into the text that is fingerprinted.
+    Prompt templates are left out because their shared boilerplate would make
+    unrelated inputs look similar.
+
+    Args:
+        *parts: The inputs (application description, settings, threat list, ...)
+
+    Returns:
+        str: The text to fingerprint
+    """
+    return "\n".join(str(part) for part in parts if part)
+
+
+def _shingles(text):
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(text):
+    """
+    Compute a bottom-k MinHash signature: the SIGNATURE_SIZE smallest 64-bit hashes of the
+    text's word shingles. Everything is computed locally.
+
+    Args:
+        text (str): The text to fingerprint
+
+    Returns:
+        list: Sorted hash values
+    """
+    hashes = {
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in _shingles(text)
+    }
+    return sorted(hashes)[:SIGNATURE_SIZE]
+
+
+def estimate_jaccard(signature_a, signature_b):
+    """
+    Estimate the Jaccard similarity of the shingle sets behind two bottom-k signatures.
+
+    Args:
+        signature_a (list): Signature from minhash_signature()
+        signature_b (list): Signature from minhash_signature()
+
+    Returns:
+        float: Estimated similarity between 0.0 and 1.0
+    """
+    if not signature_a or not signature_b:
+        return 0.0
+    set_a = set(signature_a)
+    set_b = set(signature_b)
+    # The k smallest hashes of the union are a uniform sample of the union
+    union_sample = sorted(set_a | set_b)[:SIGNATURE_SIZE]
+    shared = sum(1 for value in union_sample if value in set_a and value in set_b)
+    return shared / len(union_sample)
@@ -0,0 +1,63 @@
+import threading
+
+# --------- Single-Flight Request Coalescing --------- #
+
+# Calls currently in flight in this process, keyed by request key. Streamlit runs every
+# browser session in the same process, so identical requests from different sessions meet here.
+_in_flight = {}
+_lock = threading.Lock()
+_stats = {"calls": 0, "shared": 0}
+
+
+def run_once(key, func):
+    """
+    Run func, unless a call with the same key is already in flight, in which case wait for
+    that call and return its result (or raise its exception) instead of starting another one.
+
+    Args:
+        key (str): Identifies the request, e.g. llm_cache.cache_key(stage, prompt, config)
+        func (callable): Makes the request
+
+    Returns:
+        The result of func, possibly produced by another thread's call
+    """
+    with _lock:
+        call = _in_flight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = {"done": threading.Event(), "finished": False, "result": None, "error": None}
+            _in_flight[key] = call
+            _stats["calls"] += 1
+        else:
+            _stats["shared"] += 1
+
+    if not is_leader:
+        call["done"].wait()
+        if not call["finished"]:
+            # The leading call was interrupted (e.g. its Streamlit session stopped), so make our own
+            return run_once(key, func)
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    try:
+        call["result"] = func()
+        call["finished"] = True
+        return call["result"]
+    except Exception as e:
+        call["error"] = e
+        call["finished"] = True
+        raise
+    finally:
+        with _lock:
+            del _in_flight[key]
+        call["done"].set()
+
+
+def get_singleflight_stats():
+    """
+    Returns:
+        dict: Number of upstream calls made and of calls that shared another call's result
+    """
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,197 @@
+import ast
+import os
+import re
+import time
+
+# --------- Source Extractors --------- #
+
+# The repository analysis summarizes a code file by its imports, classes and functions. Each
+# language has an extractor in EXTRACTORS: Python files are parsed with ast, other languages
+# are scanned line by line with precompiled patterns anchored at the start of the line, so the
+# work grows linearly with the size of the file. Lines longer than MAX_LINE_CHARS (minified or
+# generated code) are skipped, and extraction stops after EXTRACTION_TIME_LIMIT_SECONDS, so a
+# single pathological file cannot stall the analysis of a repository.
+
+# Seconds spent extracting declarations from one file before its summary is cut short
+EXTRACTION_TIME_LIMIT_SECONDS = float(os.getenv("EXTRACTION_TIME_LIMIT", "0.5"))
+
+# Longer lines are not scanned
+MAX_LINE_CHARS = 1000
+
+# Declarations are cut to this many characters
+MAX_ENTRY_CHARS = 200
+
+# Larger Python files are scanned line by line rather than parsed into a syntax tree
+AST_MAX_BYTES = 256 * 1024
+
+# Lines or syntax tree nodes handled between checks of the time limit
+_CHECK_INTERVAL = 256
+
+CATEGORIES = ("imports", "classes", "functions")
+
+
+class _TimeLimitReached(Exception):
+    pass
+
+
+def _entry(text):
+    text = text.strip()
+    return text if len(text) <= MAX_ENTRY_CHARS else text[:MAX_ENTRY_CHARS] + "..."
+
+
+def _lines(content, deadline):
+    # The lines of a file short enough to scan
+    for number, line in enumerate(content.splitlines()):
+        if number % _CHECK_INTERVAL == 0 and time.monotonic() > deadline:
+            raise _TimeLimitReached()
+        if len(line) <= MAX_LINE_CHARS:
+            yield line
+
+
+def _scan(content, declarations, deadline, patterns):
+    # Add each line matching one of the (category, pattern) pairs to that category
+    for line in _lines(content, deadline):
+        for category, pattern in patterns:
+            if pattern.match(line):
+                declarations[category].append(_entry(line))
+                break
+
+
+# Start of a C-style method declaration: a word (not an attribute or annotation), but not a
+# keyword that starts a statement that looks like one
+_C_STATEMENTS = r"(?=[\w~])(?!(?:if|for|foreach|while|switch|return|else|new|catch|throw|do|using|lock|case|goto|delete|sizeof)\b)"
+
+PYTHON_PATTERNS = (
+    ("imports", re.compile(r"(?:import\s|from\s+\S+\s+import\s)")),
+    ("classes", re.compile(r"\s*class\s+\w+")),
+    ("functions", re.compile(r"\s*(?:async\s+)?def\s+\w+\s*\(")),
+)
+
+JAVASCRIPT_PATTERNS = (
+    ("imports", re.compile(r"(?:import[\s{*'\"]|(?:const|let|var)\s+[^=]+=\s*require\s*\()")),
+    ("classes", re.compile(r"\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+[\w$]+")),
+    ("functions", re.compile(
+        r"\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\b"  # function declarations
+        r"|\s*(?:export\s+)?(?:const|let|var)\s+[\w$]+\s*(?::[^=]+)?=\s*(?:async\s+)?(?:\([^)]*\)|[\w$]+)\s*(?::[^=]+)?=>"  # arrow functions
+        r"|\s*[\w$]+\s*:\s*(?:async\s+)?function\b"  # object methods
+    )),
+)
+
+JAVA_PATTERNS = (
+    ("imports", re.compile(r"import\s+[\w.*]+\s*;")),
+    ("classes", re.compile(r"\s*(?:(?:public|private|protected|static|abstract|final|sealed|partial|internal)\s+)*(?:class|interface|enum|record)\s+\w+")),
+    ("functions", re.compile(r"\s*" + _C_STATEMENTS + r"(?:[\w<>\[\],.?]+\s+)+\w+\s*\([^;]*$")),
+)
+
+C_PATTERNS = (
+    ("classes", re.compile(r"\s*(?:(?:public|private|protected|static|abstract|sealed|partial|internal|template\s*<[^>]*>)\s+)*(?:class|interface|struct)\s+\w+\s*(?:[:{]|$)")),
+    ("functions", re.compile(r"\s*" + _C_STATEMENTS + r"(?:[\w<>\[\],.:*&?~]+\s+)+[*&]*[\w:~]+\s*\([^;]*$")),
+)
+
+GO_PATTERNS = (
+    ("imports", re.compile(r"import\s+(?:\w+\s+)?\"")),
+    ("functions", re.compile(r"func\s")),
+)
+
+
+def extract_python(content, declarations, deadline):
+    """Python: module-level imports, every class and every function or method, from the syntax tree."""
+    if len(content) > AST_MAX_BYTES:
+        return _scan(content, declarations, deadline, PYTHON_PATTERNS)
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        # Python 2 or otherwise unparseable: fall back to the patterns
+        return _scan(content, declarations, deadline, PYTHON_PATTERNS)
+
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            declarations["imports"].append(_entry(ast.unparse(node)))
+
+    definitions = []
+    for count, node in enumerate(ast.walk(tree)):
+        if count % _CHECK_INTERVAL == 0 and time.monotonic() > deadline:
+            raise _TimeLimitReached()
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            definitions.append(node)
+
+    # ast.walk is breadth first; list the definitions in the order they appear in the file
+    for node in sorted(definitions, key=lambda node: (node.lineno, node.col_offset)):
+        if isinstance(node, ast.ClassDef):
+            bases = ", ".join(ast.unparse(base) for base in node.bases + node.keywords)
+            declarations["classes"].append(_entry(f"class {node.name}({bases}):" if bases else f"class {node.name}:"))
+        else:
+            prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+            returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+            declarations["functions"].append(_entry(f"{prefix} {node.name}({ast.unparse(node.args)}){returns}:"))
+
+
+def extract_javascript(content, declarations, deadline):
+    """JavaScript and TypeScript: imports and requires, classes, function declarations, arrow functions and object methods."""
+    _scan(content, declarations, deadline, JAVASCRIPT_PATTERNS)
+
+
+def extract_java(content, declarations, deadline):
+    """Java: imports, classes and interfaces, and method declarations."""
+    _scan(content, declarations, deadline, JAVA_PATTERNS)
+
+
+def extract_c(content, declarations, deadline):
+    """C, C++ and C#: classes and structs, and function or method definitions."""
+    _scan(content, declarations, deadline, C_PATTERNS)
+
+
+def extract_go(content, declarations, deadline):
+    """Go: single imports and import blocks, and functions and methods."""
+    block = None
+    for line in _lines(content, deadline):
+        if block is not None:
+            block.append(line)
+            if line.strip() == ")":
+                declarations["imports"].append("\n".join(block))
+                block = None
+        elif line.startswith("import (") or line.startswith("import("):
+            block = [line]
+        else:
+            for category, pattern in GO_PATTERNS:
+                if pattern.match(line):
+                    declarations[category].append(_entry(line))
+                    break
+
+
+# File extension -> extractor
+EXTRACTORS = {
+    "py": extract_python,
+    "js": extract_javascript,
+    "ts": extract_javascript,
+    "java": extract_java,
+    "c": extract_c,
+    "cpp": extract_c,
+    "cs": extract_c,
+    "go": extract_go,
+}
+
+
+def extract_declarations(file_ext, content, time_limit=None):
+    """
+    Extract the imports, classes and functions of a source file.
+
+    Args:
+        file_ext (str): The file's extension in lower case, without the dot
+        content (str): The file's content
+        time_limit (float): Seconds to spend at most; EXTRACTION_TIME_LIMIT_SECONDS by default
+
+    Returns:
+        tuple: (dict with a list per category in CATEGORIES, False if the time limit cut the
+               extraction short, else True). Files without an extractor have empty lists.
+    """
+    declarations = {category: [] for category in CATEGORIES}
+    extractor = EXTRACTORS.get(file_ext)
+    if extractor is None:
+        return declarations, True
+    deadline = time.monotonic() + (EXTRACTION_TIME_LIMIT_SECONDS if time_limit is None else time_limit)
+    try:
+        extractor(content, declarations, deadline)
+    except _TimeLimitReached:
+        return declarations, False
+    return declarations, True
@@ -0,0 +1,256 @@
+import json
+
+from prompt_cache import anthropic_content, record_usage
+from token_budget import THINKING_BUDGET_TOKENS
+from clients import get_openai_client, get_azure_openai_client, get_anthropic_client, get_mistral_client, get_groq_client, get_lm_studio_client, get_http_session, configure_google
+from local_models import ollama_request_fields
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
+
+# --------- Streaming Completions --------- #
+
+# Events yielded by the stream functions are (kind, text) tuples where kind is one of:
+TEXT = "text"
+REASONING = "reasoning"
+
+
+class ThinkTagSplitter:
+    """
+    Incrementally separate <think>...</think> reasoning (DeepSeek R1 and similar models) from the
+    answer text while the response is streaming. Tags may be split across deltas, so any trailing
+    text that could be the start of a tag is held back until the next delta arrives.
+    """
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+
+    def feed(self, text):
+        """
+        Add a text delta.
+
+        Args:
+            text (str): The new text from the model
+
+        Returns:
+            list: (kind, text) events that are safe to emit
+        """
+        self.buffer += text
+        events = []
+        while self.buffer:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = self.buffer.find(tag)
+            if index != -1:
+                if index:
+                    events.append((REASONING if self.in_think else TEXT, self.buffer[:index]))
+                self.buffer = self.buffer[index + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            # Keep back a suffix that might be the beginning of the tag
+            keep = 0
+            for length in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if tag.startswith(self.buffer[-length:]):
+                    keep = length
+                    break
+            emit = self.buffer[:len(self.buffer) - keep]
+            if emit:
+                events.append((REASONING if self.in_think else TEXT, emit))
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            break
+        return events
+
+    def flush(self):
+        """
+        Emit whatever is still buffered at the end of the stream.
+
+        Returns:
+            list: (kind, text) events
+        """
+        events = []
+        if self.buffer:
+            events.append((REASONING if self.in_think else TEXT, self.buffer))
+        self.buffer = ""
+        return events
+
+
+def _openai_compatible_stream(client, model, system_prompt, prompt, max_tokens=None, reasoning_model=False, include_usage=False):
+    kwargs = {}
+    if max_tokens:
+        # Reasoning models (o1, o3-mini) use max_completion_tokens instead of max_tokens
+        kwargs["max_completion_tokens" if reasoning_model else "max_tokens"] = max_tokens
+    if include_usage:
+        # Ask for a final chunk with token usage, including cached prompt tokens
+        kwargs["stream_options"] = {"include_usage": True}
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        stream=True,
+        **kwargs
+    )
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            record_usage(chunk.usage)
+        # Azure sends chunks without choices (e.g. content filter results)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        # Some OpenAI-compatible servers return reasoning separately from the answer
+        reasoning = getattr(delta, "reasoning_content", None)
+        if reasoning:
+            yield REASONING, reasoning
+        if delta.content:
+            yield TEXT, delta.content
+
+
+def _anthropic_stream(anthropic_api_key, anthropic_model, system_prompt, prompt, max_tokens=None):
+    client = get_anthropic_client(anthropic_api_key)
+
+    # Check if we're using extended thinking mode
+    is_thinking_mode = "thinking" in anthropic_model.lower()
+
+    # If using thinking mode, use the actual model name without the "thinking" suffix
+    actual_model = "claude-3-7-sonnet-latest" if is_thinking_mode else anthropic_model
+
+    kwargs = {}
+    if is_thinking_mode:
+        kwargs["thinking"] = {"type": "enabled", "budget_tokens": THINKING_BUDGET_TOKENS}
+        max_tokens = THINKING_BUDGET_TOKENS + (max_tokens or 8000)
+    else:
+        max_tokens = max_tokens or 4096
+
+    with client.messages.stream(
+        model=actual_model,
+        max_tokens=max_tokens,
+        system=system_prompt,
+        messages=[{"role": "user", "content": anthropic_content(prompt)}],
+        **kwargs
+    ) as stream:
+        for event in stream:
+            if event.type != "content_block_delta":
+                continue
+            if event.delta.type == "text_delta":
+                yield TEXT, event.delta.text
+            elif event.delta.type == "thinking_delta":
+                yield REASONING, event.delta.thinking
+        record_usage(stream.get_final_message())
+
+
+def _mistral_stream(mistral_api_key, mistral_model, system_prompt, prompt, max_tokens=None):
+    client = get_mistral_client(mistral_api_key)
+    kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+    stream = client.chat.stream(
+        model=mistral_model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        **kwargs
+    )
+    for event in stream:
+        if event.data.choices and event.data.choices[0].delta.content:
+            yield TEXT, event.data.choices[0].delta.content
+
+
+def _google_stream(google_api_key, google_model, system_prompt, prompt, max_tokens=None):
+    configure_google(google_api_key)
+    generation_config = {"max_output_tokens": max_tokens} if max_tokens else None
+    model = genai.GenerativeModel(google_model, system_instruction=system_prompt)
+    response = model.generate_content(prompt, generation_config=generation_config, stream=True)
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. safety ratings only)
+            continue
+        if text:
+            yield TEXT, text
+
+
+def _ollama_stream(ollama_endpoint, ollama_model, system_prompt, prompt, max_tokens=None, num_ctx=None, keep_alive=None):
+    if not ollama_endpoint.endswith('/'):
+        ollama_endpoint = ollama_endpoint + '/'
+
+    data = {
+        "model": ollama_model,
+        "stream": True,
+        **ollama_request_fields(max_tokens, num_ctx, keep_alive),
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+    # The timeout applies between streamed lines rather than to the whole response
+    with get_http_session().post(ollama_endpoint + "api/chat", json=data, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("error"):
+                raise RuntimeError(f"Ollama error: {event['error']}")
+            message = event.get("message", {})
+            if message.get("thinking"):
+                yield REASONING, message["thinking"]
+            if message.get("content"):
+                yield TEXT, message["content"]
+            if event.get("done"):
+                break
+
+
+def stream_completion(config, system_prompt, prompt, max_tokens=None):
+    """
+    Stream a plain-text completion from any supported provider.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        system_prompt (str): The system prompt
+        prompt (str): The user prompt
+        max_tokens (int): Optional cap on the number of output tokens, excluding any Anthropic thinking budget
+
+    Yields:
+        tuple: (kind, text) where kind is TEXT for answer deltas or REASONING for model
+               reasoning (<think> blocks, Anthropic thinking blocks)
+    """
+    provider = config["provider"]
+    args = config["args"]
+
+    if provider == "OpenAI API":
+        api_key, model_name = args
+        events = _openai_compatible_stream(get_openai_client(api_key), model_name, system_prompt, prompt, max_tokens, reasoning_model=model_name in ["o1", "o3-mini"], include_usage=True)
+    elif provider == "Azure OpenAI Service":
+        azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name = args
+        events = _openai_compatible_stream(get_azure_openai_client(azure_api_endpoint, azure_api_key, azure_api_version), azure_deployment_name, system_prompt, prompt, max_tokens)
+    elif provider == "LM Studio Server":
+        lm_studio_endpoint, model_name = args
+        events = _openai_compatible_stream(get_lm_studio_client(lm_studio_endpoint), model_name, system_prompt, prompt, max_tokens)
+    elif provider == "Groq API":
+        groq_api_key, groq_model = args
+        events = _openai_compatible_stream(get_groq_client(groq_api_key), groq_model, system_prompt, prompt, max_tokens)
+    elif provider == "Anthropic API":
+        events = _anthropic_stream(*args, system_prompt, prompt, max_tokens)
+    elif provider == "Mistral API":
+        events = _mistral_stream(*args, system_prompt, prompt, max_tokens)
+    elif provider == "Google AI API":
+        events = _google_stream(*args, system_prompt, prompt, max_tokens)
+    elif provider == "Ollama":
+        events = _ollama_stream(*args, system_prompt, prompt, max_tokens, **config.get("options", {}))
+    else:
+        raise ValueError(f"Unsupported model provider for streaming: {provider}")
+
+    # Split <think> reasoning out of the answer text on the fly
+    splitter = ThinkTagSplitter()
+    for kind, text in events:
+        if kind == REASONING:
+            yield kind, text
+        else:
+            yield from splitter.feed(text)
+    yield from splitter.flush()
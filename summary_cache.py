@@ -0,0 +1,161 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# --------- File Summary Cache --------- #
+
+# Summaries of repository files are stored by the git blob SHA of the file's content, so
+# re-analysing a repository only downloads and summarizes the files that changed, and a file
+# that appears in several repositories (e.g. vendored code) is summarized once. Summaries are
+# stored without their "File: <path>" header, since the same content can live at any path.
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", os.path.join(".cache", "file_summaries.sqlite3"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "200000"))
+
+# SQLite's default limit on the number of parameters in one statement is 999
+_QUERY_BATCH = 500
+
+_lock = threading.Lock()
+_initialized = False
+_stats = {"hits": 0, "misses": 0}
+
+
+def _connect():
+    global _initialized
+    directory = os.path.dirname(SUMMARY_CACHE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(SUMMARY_CACHE_PATH, timeout=30)
+    if not _initialized:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                token_model TEXT NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS summaries_accessed_at ON summaries (accessed_at)")
+        connection.commit()
+        _initialized = True
+    return connection
+
+
+def git_blob_sha(data):
+    """
+    Compute the SHA git gives a file's content, as listed in GitHub and git trees.
+
+    Args:
+        data (bytes): The file's content, or any bytes-like object such as a memoryview of a mapped file
+
+    Returns:
+        str: The hex SHA-1 of the git blob
+    """
+    blob = hashlib.sha1(b"blob %d\0" % len(data))
+    blob.update(data)
+    return blob.hexdigest()
+
+
+def summary_key(blob_sha, kind, version):
+    """
+    Args:
+        blob_sha (str): The git blob SHA of the file's content
+        kind (str): What, besides the content, the summary depends on (e.g. the file type)
+        version (int): The summarizer version; bumping it invalidates older summaries
+
+    Returns:
+        str: The cache key
+    """
+    return f"{version}:{kind}:{blob_sha}"
+
+
+def get_summaries(keys, token_model):
+    """
+    Look up cached summaries.
+
+    Args:
+        keys (list): Keys from summary_key()
+        token_model (str): The model token counts are estimated for; summaries counted for
+                           another model are returned with a token count of None
+
+    Returns:
+        dict: key -> (summary, tokens) for the keys that are cached
+    """
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    now = time.time()
+    with _lock:
+        connection = _connect()
+        try:
+            for start in range(0, len(keys), _QUERY_BATCH):
+                batch = keys[start:start + _QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(f"SELECT key, summary, tokens, token_model FROM summaries WHERE key IN ({placeholders})", batch).fetchall()
+                for key, summary, tokens, stored_model in rows:
+                    found[key] = (summary, tokens if stored_model == token_model else None)
+                connection.executemany("UPDATE summaries SET accessed_at = ? WHERE key = ?", [(now, key) for key, *_ in rows])
+            connection.commit()
+        finally:
+            connection.close()
+        _stats["hits"] += len(found)
+        _stats["misses"] += len(keys) - len(found)
+    return found
+
+
+def put_summaries(entries, token_model):
+    """
+    Store summaries, then evict the least recently used ones beyond SUMMARY_CACHE_MAX_ENTRIES.
+
+    Args:
+        entries (list): (key, summary, tokens) per summary
+        token_model (str): The model the token counts were estimated for
+    """
+    if not entries:
+        return
+    now = time.time()
+    with _lock:
+        connection = _connect()
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO summaries (key, summary, tokens, token_model, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                [(key, summary, tokens, token_model, now) for key, summary, tokens in entries],
+            )
+            count = connection.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+            if count > SUMMARY_CACHE_MAX_ENTRIES:
+                connection.execute(
+                    "DELETE FROM summaries WHERE key IN (SELECT key FROM summaries ORDER BY accessed_at LIMIT ?)",
+                    (count - SUMMARY_CACHE_MAX_ENTRIES,),
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+
+def get_summary_cache_stats():
+    """
+    Returns:
+        dict: Hit and miss counts for this process, plus the number of stored summaries
+    """
+    with _lock:
+        connection = _connect()
+        try:
+            entries = connection.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        finally:
+            connection.close()
+        return {"hits": _stats["hits"], "misses": _stats["misses"], "entries": entries}
+
+
+def clear_summary_cache():
+    """Delete every cached summary."""
+    with _lock:
+        connection = _connect()
+        try:
+            connection.execute("DELETE FROM summaries")
+            connection.commit()
+        finally:
+            connection.close()
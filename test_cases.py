@@ -1,23 +1,25 @@
 import requests
-from anthropic import Anthropic
-from mistralai import Mistral
-from openai import OpenAI, AzureOpenAI
 import streamlit as st
 
-import google.generativeai as genai
-from groq import Groq
 from utils import process_groq_response, create_reasoning_system_prompt
-
-# Function to create a prompt to generate mitigating controls
-def create_test_cases_prompt(threats):
-    prompt = f"""
+from clients import get_openai_client, get_azure_openai_client, get_anthropic_client, get_mistral_client, get_groq_client, get_lm_studio_client, get_http_session, configure_google
+from local_models import ollama_request_fields
+from token_budget import THINKING_BUDGET_TOKENS
+from prompt_cache import register_static_prefix, anthropic_content, record_usage
+from retry_policy import is_retryable_error
+from instrumentation import record_error
+from streaming import stream_completion
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
+
+# Static instructions every test cases prompt starts with; the threats follow them so
+# providers can cache this prefix
+TEST_CASES_INSTRUCTIONS = register_static_prefix("""
 Act as a cyber security expert with more than 20 years experience of using the STRIDE threat modelling methodology. 
 Your task is to provide Gherkin test cases for the threats identified in a threat model. It is very important that 
 your responses are tailored to reflect the details of the threats. 
 
-Below is the list of identified threats:
-{threats}
-
 Use the threat descriptions in the 'Given' steps so that the test cases are specific to the threats identified.
 Put the Gherkin syntax inside triple backticks (```) to format the test cases in Markdown. Add a title for each test case.
 For example:
@@ -28,20 +30,33 @@ For example:
     Then the user should be able to access the system
     ```
 
+Below is the list of identified threats:
+""")
+
+# Function to create a prompt to generate test cases
+def create_test_cases_prompt(threats):
+    prompt = f"""{TEST_CASES_INSTRUCTIONS}{threats}
+
 YOUR RESPONSE (do not add introductory text, just provide the Gherkin test cases):
 """
     return prompt
 
 
-# Function to get test cases from the GPT response.
-def get_test_cases(api_key, model_name, prompt):
-    client = OpenAI(api_key=api_key)
+# System prompt used with Ollama hosted LLMs
+OLLAMA_TEST_CASES_SYSTEM_PROMPT = """You are a cyber security expert with more than 20 years experience of security testing applications. Your task is to analyze the provided application description and suggest appropriate security test cases.
 
-    # For reasoning models (o1, o3-mini), use a structured system prompt
-    if model_name in ["o1", "o3-mini"]:
-        system_prompt = create_reasoning_system_prompt(
-            task_description="Generate comprehensive security test cases in Gherkin format for the identified threats.",
-            approach_description="""1. Analyze each threat in the provided threat model:
+Please provide your response in markdown format with appropriate headings and bullet points. For each test case, include:
+- Test objective
+- Prerequisites
+- Test steps
+- Expected results
+- Pass/fail criteria"""
+
+# Function to create the system prompt used with reasoning models (o1, o3-mini).
+def create_test_cases_reasoning_system_prompt():
+    return create_reasoning_system_prompt(
+        task_description="Generate comprehensive security test cases in Gherkin format for the identified threats.",
+        approach_description="""1. Analyze each threat in the provided threat model:
    - Understand the threat type and scenario
    - Identify critical security aspects to test
    - Consider both positive and negative test cases
@@ -59,7 +74,16 @@ def get_test_cases(api_key, model_name, prompt):
    - Use proper code block syntax
    - Ensure consistent indentation
    - Add clear scenario descriptions"""
-        )
+    )
+
+
+# Function to get test cases from the GPT response.
+def get_test_cases(api_key, model_name, prompt, max_tokens=4000):
+    client = get_openai_client(api_key)
+
+    # For reasoning models (o1, o3-mini), use a structured system prompt
+    if model_name in ["o1", "o3-mini"]:
+        system_prompt = create_test_cases_reasoning_system_prompt()
         # Create completion with max_completion_tokens for o1/o3-mini
         response = client.chat.completions.create(
             model = model_name,
@@ -67,8 +91,9 @@ def get_test_cases(api_key, model_name, prompt):
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            max_completion_tokens=4000
+            max_completion_tokens=max_tokens
         )
+        record_usage(response)
     else:
         system_prompt = "You are a helpful assistant that provides Gherkin test cases in Markdown format."
         # Create completion with max_tokens for other models
@@ -78,8 +103,9 @@ def get_test_cases(api_key, model_name, prompt):
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=4000
+            max_tokens=max_tokens
         )
+        record_usage(response)
 
     # Access the content directly as the response will be in text format
     test_cases = response.choices[0].message.content
@@ -87,20 +113,18 @@ def get_test_cases(api_key, model_name, prompt):
     return test_cases
 
 # Function to get mitigations from the Azure OpenAI response.
-def get_test_cases_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt):
-    client = AzureOpenAI(
-        azure_endpoint = azure_api_endpoint,
-        api_key = azure_api_key,
-        api_version = azure_api_version,
-    )
+def get_test_cases_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt, max_tokens=4000):
+    client = get_azure_openai_client(azure_api_endpoint, azure_api_key, azure_api_version)
 
     response = client.chat.completions.create(
         model = azure_deployment_name,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides Gherkin test cases in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Access the content directly as the response will be in text format
     test_cases = response.choices[0].message.content
@@ -108,11 +132,12 @@ def get_test_cases_azure(azure_api_endpoint, azure_api_key, azure_api_version, a
     return test_cases
 
 # Function to get test cases from the Google model's response.
-def get_test_cases_google(google_api_key, google_model, prompt):
-    genai.configure(api_key=google_api_key)
+def get_test_cases_google(google_api_key, google_model, prompt, max_tokens=4000):
+    configure_google(google_api_key)
     model = genai.GenerativeModel(
         google_model,
         system_instruction="You are a helpful assistant that provides Gherkin test cases in Markdown format.",
+        generation_config={"max_output_tokens": max_tokens},
     )
     response = model.generate_content(prompt)
     
@@ -122,16 +147,18 @@ def get_test_cases_google(google_api_key, google_model, prompt):
     return test_cases
 
 # Function to get test cases from the Mistral model's response.
-def get_test_cases_mistral(mistral_api_key, mistral_model, prompt):
-    client = Mistral(api_key=mistral_api_key)
+def get_test_cases_mistral(mistral_api_key, mistral_model, prompt, max_tokens=4000):
+    client = get_mistral_client(mistral_api_key)
 
     response = client.chat.complete(
         model = mistral_model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides Gherkin test cases in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Access the content directly as the response will be in text format
     test_cases = response.choices[0].message.content
@@ -139,7 +166,7 @@ def get_test_cases_mistral(mistral_api_key, mistral_model, prompt):
     return test_cases
 
 # Function to get test cases from Ollama hosted LLM.
-def get_test_cases_ollama(ollama_endpoint, ollama_model, prompt):
+def get_test_cases_ollama(ollama_endpoint, ollama_model, prompt, max_tokens=4000, num_ctx=None, keep_alive=None):
     """
     Get test cases from Ollama hosted LLM.
     
@@ -147,6 +174,9 @@ def get_test_cases_ollama(ollama_endpoint, ollama_model, prompt):
         ollama_endpoint (str): The URL of the Ollama endpoint (e.g., 'http://localhost:11434')
         ollama_model (str): The name of the model to use
         prompt (str): The prompt to send to the model
+        max_tokens (int): The output token limit (Ollama's num_predict)
+        num_ctx (int): The context window to load the model with
+        keep_alive (str or int): How long Ollama keeps the model loaded afterwards
         
     Returns:
         str: The generated test cases in markdown format
@@ -163,17 +193,11 @@ def get_test_cases_ollama(ollama_endpoint, ollama_model, prompt):
     data = {
         "model": ollama_model,
         "stream": False,
+        **ollama_request_fields(max_tokens, num_ctx, keep_alive),
         "messages": [
             {
                 "role": "system", 
-                "content": """You are a cyber security expert with more than 20 years experience of security testing applications. Your task is to analyze the provided application description and suggest appropriate security test cases.
-
-Please provide your response in markdown format with appropriate headings and bullet points. For each test case, include:
-- Test objective
-- Prerequisites
-- Test steps
-- Expected results
-- Pass/fail criteria"""
+                "content": OLLAMA_TEST_CASES_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -183,7 +207,7 @@ Please provide your response in markdown format with appropriate headings and bu
     }
 
     try:
-        response = requests.post(url, json=data, timeout=60)  # Add timeout
+        response = get_http_session().post(url, json=data, timeout=60)  # Add timeout
         response.raise_for_status()  # Raise exception for bad status codes
         outer_json = response.json()
         
@@ -201,8 +225,8 @@ Please provide your response in markdown format with appropriate headings and bu
         raise
 
 # Function to get test cases from the Anthropic model's response.
-def get_test_cases_anthropic(anthropic_api_key, anthropic_model, prompt):
-    client = Anthropic(api_key=anthropic_api_key)
+def get_test_cases_anthropic(anthropic_api_key, anthropic_model, prompt, max_tokens=4096):
+    client = get_anthropic_client(anthropic_api_key)
         
      # Check if we're using extended thinking mode
     is_thinking_mode = "thinking" in anthropic_model.lower()
@@ -215,27 +239,29 @@ def get_test_cases_anthropic(anthropic_api_key, anthropic_model, prompt):
         if is_thinking_mode:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=24000,
+                max_tokens=THINKING_BUDGET_TOKENS + max_tokens,
                 thinking={
                     "type": "enabled",
-                    "budget_tokens": 16000
+                    "budget_tokens": THINKING_BUDGET_TOKENS
                 },
                 system="You are a helpful assistant that provides Gherkin test cases in Markdown format.",
                 messages=[
-                    {"role": "user", "content": prompt}
+                    {"role": "user", "content": anthropic_content(prompt)}
                 ],
                 timeout=600  # 10-minute timeout
             )
+            record_usage(response)
         else:
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=4096,
+                max_tokens=max_tokens,
                 system="You are a helpful assistant that provides Gherkin test cases in Markdown format.",
                 messages=[
-                    {"role": "user", "content": prompt}
+                    {"role": "user", "content": anthropic_content(prompt)}
                 ],
                 timeout=300  # 5-minute timeout
             )
+            record_usage(response)
  
         # Access the text content
         if is_thinking_mode:
@@ -252,6 +278,11 @@ def get_test_cases_anthropic(anthropic_api_key, anthropic_model, prompt):
  
         return test_cases
     except Exception as e:
+        # Let retry_policy retry rate limits, timeouts and overloads
+        if is_retryable_error(e):
+            raise
+        # The fallback answer hides the failure from the caller, so record it
+        record_error(e)
         # Handle timeout and other errors
         error_message = str(e)
         st.error(f"Error with Anthropic API: {error_message}")
@@ -270,19 +301,18 @@ def get_test_cases_anthropic(anthropic_api_key, anthropic_model, prompt):
         return fallback_test_cases
 
 # Function to get test cases from LM Studio Server response.
-def get_test_cases_lm_studio(lm_studio_endpoint, model_name, prompt):
-    client = OpenAI(
-        base_url=f"{lm_studio_endpoint}/v1",
-        api_key="not-needed"  # LM Studio Server doesn't require an API key
-    )
+def get_test_cases_lm_studio(lm_studio_endpoint, model_name, prompt, max_tokens=4000):
+    client = get_lm_studio_client(lm_studio_endpoint)
 
     response = client.chat.completions.create(
         model=model_name,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides Gherkin test cases in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Access the content directly as the response will be in text format
     test_cases = response.choices[0].message.content
@@ -290,15 +320,17 @@ def get_test_cases_lm_studio(lm_studio_endpoint, model_name, prompt):
     return test_cases
 
 # Function to get test cases from the Groq model's response.
-def get_test_cases_groq(groq_api_key, groq_model, prompt):
-    client = Groq(api_key=groq_api_key)
+def get_test_cases_groq(groq_api_key, groq_model, prompt, max_tokens=4000):
+    client = get_groq_client(groq_api_key)
     response = client.chat.completions.create(
         model=groq_model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant that provides Gherkin test cases in Markdown format."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Process the response using our utility function
     reasoning, test_cases = process_groq_response(
@@ -312,4 +344,26 @@ def get_test_cases_groq(groq_api_key, groq_model, prompt):
         with st.expander("View model's reasoning process", expanded=False):
             st.write(reasoning)
 
-    return test_cases
\ No newline at end of file
+    return test_cases
+
+# Function to stream test cases from the selected model provider.
+def stream_test_cases(config, prompt, max_tokens=None):
+    """
+    Stream test cases from any supported provider, using the same system prompts as the get_test_cases* functions.
+
+    Args:
+        config (dict): Provider settings from providers.get_provider_config()
+        prompt (str): The prompt to send to the model
+        max_tokens (int): Optional cap on the number of output tokens
+
+    Returns:
+        generator: (kind, text) events from streaming.stream_completion()
+    """
+    if config["provider"] == "OpenAI API" and config["model"] in ["o1", "o3-mini"]:
+        system_prompt = create_test_cases_reasoning_system_prompt()
+    elif config["provider"] == "Ollama":
+        system_prompt = OLLAMA_TEST_CASES_SYSTEM_PROMPT
+    else:
+        system_prompt = "You are a helpful assistant that provides Gherkin test cases in Markdown format."
+
+    return stream_completion(config, system_prompt, prompt, max_tokens=max_tokens)
\ No newline at end of file
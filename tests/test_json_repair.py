@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from json_repair import parse_json_response
+from threat_model import THREAT_MODEL_KEYS
+
+ROW = {"Threat Type": "Spoofing", "Scenario": "s", "Potential Impact": "p", "Mitigation Consideration": "m"}
+
+
+def test_prefers_the_object_over_a_bracketed_aside():
+    text = 'The answer is [1] and then {"threat_model": [' + json.dumps(ROW) + '], "improvement_suggestions": []}'
+    result = parse_json_response(text, THREAT_MODEL_KEYS, "threat_model")
+    assert result["threat_model"] == [ROW]
+
+
+def test_rejects_an_aside_when_the_object_has_no_complete_rows():
+    text = 'The answer is [1] and then {"threat_model": [{"Threat Type":"S"}], "improvement_suggestions": []}'
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_response(text, THREAT_MODEL_KEYS, "threat_model")
+
+
+def test_drops_the_row_cut_off_by_truncation():
+    text = '{"threat_model": [' + json.dumps(ROW) + ', {"Threat Type": "Tampering", "Scen'
+    result = parse_json_response(text, THREAT_MODEL_KEYS, "threat_model")
+    assert result["threat_model"] == [ROW]
+
+
+def test_rejects_truncated_output_without_a_value():
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_response('{"a": 12')
@@ -1,14 +1,23 @@
 import json
 import requests
-from anthropic import Anthropic
-from mistralai import Mistral, UserMessage
-from openai import OpenAI, AzureOpenAI
 import streamlit as st
-import re
 
-import google.generativeai as genai
-from groq import Groq
 from utils import process_groq_response, create_reasoning_system_prompt
+from clients import get_openai_client, get_azure_openai_client, get_anthropic_client, get_mistral_client, get_groq_client, get_lm_studio_client, get_http_session, configure_google
+from local_models import ollama_request_fields
+from retry_policy import is_retryable_error
+from instrumentation import instrument_call, record_error
+from json_repair import parse_json_response
+from token_budget import THINKING_BUDGET_TOKENS
+from prompt_cache import register_static_prefix, anthropic_content, record_usage
+from schemas import openai_model_response_format, openai_response_format, azure_response_format, anthropic_tool_kwargs, get_anthropic_output, gemini_generation_config, ollama_format
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
+mistralai = lazy_import("mistralai")
+
+# Top-level keys every threat model response must contain
+THREAT_MODEL_KEYS = ("threat_model",)
 
 # Function to convert JSON to Markdown for display.    
 def json_to_markdown(threat_model, improvement_suggestions):
@@ -28,9 +37,9 @@ def json_to_markdown(threat_model, improvement_suggestions):
     
     return markdown_output
 
-# Function to create a prompt for generating a threat model
-def create_threat_model_prompt(app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment):
-    prompt = f"""
+# Static instructions every threat model prompt starts with; the application details follow
+# them so providers can cache this prefix across applications
+THREAT_MODEL_INSTRUCTIONS = register_static_prefix("""
 Act as a cyber security expert with more than 20 years experience of using the STRIDE threat modelling methodology to produce comprehensive threat models for a wide range of applications. Your task is to analyze the provided code summary, README content, and application description to produce a list of specific threats for the application.
 
 Pay special attention to the README content as it often provides valuable context about the project's purpose, architecture, and potential security considerations.
@@ -59,30 +68,22 @@ Under "improvement_suggestions", include an array of strings that suggest what a
 
 Do not provide general security recommendations - focus only on what additional information would help create a better threat model.
 
-APPLICATION TYPE: {app_type}
-AUTHENTICATION METHODS: {authentication}
-INTERNET FACING: {internet_facing}
-SENSITIVE DATA: {sensitive_data}
-OPERATION ENVIRONMENT: {operation_environment}
-CODE SUMMARY, README CONTENT, AND APPLICATION DESCRIPTION:
-{app_input}
-
 Example of expected JSON response format:
   
-    {{
+    {
       "threat_model": [
-        {{
+        {
           "Threat Type": "Spoofing",
           "Scenario": "An attacker could impersonate a legitimate user by exploiting session hijacking due to missing session expiration.",
           "Potential Impact": "High if no session management controls exist.",
           "Mitigation Consideration": "Impact reduced to Medium due to enforced session timeouts and MFA."
-        }},
-        {{
+        },
+        {
           "Threat Type": "Tampering",
           "Scenario": "An attacker modifies API request parameters to escalate privileges.",
           "Potential Impact": "Critical if no input validation exists.",
           "Mitigation Consideration": "Impact reduced to Low due to strict role-based access control (RBAC) and parameterized input handling."
-        }},
+        },
         // ... more threats
       ],
       "improvement_suggestions": [
@@ -92,7 +93,21 @@ Example of expected JSON response format:
         "Clarify the data encryption methods in use to better assess confidentiality risks."
         // ... more suggestions for improving the threat model input
       ]
-    }}
+    }
+
+The application to analyze is described below.
+
+""")
+
+# Function to create a prompt for generating a threat model
+def create_threat_model_prompt(app_type, authentication, internet_facing, sensitive_data, app_input, operation_environment):
+    prompt = f"""{THREAT_MODEL_INSTRUCTIONS}APPLICATION TYPE: {app_type}
+AUTHENTICATION METHODS: {authentication}
+INTERNET FACING: {internet_facing}
+SENSITIVE DATA: {sensitive_data}
+OPERATION ENVIRONMENT: {operation_environment}
+CODE SUMMARY, README CONTENT, AND APPLICATION DESCRIPTION:
+{app_input}
 """
     return prompt
 
@@ -148,23 +163,22 @@ def get_image_analysis(api_key, model_name, prompt, base64_image):
         "max_tokens": 4000
     }
 
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+    with instrument_call({"provider": "OpenAI API", "model": model_name}, "image_analysis", max_tokens=4000):
+        response = get_http_session().post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
 
-    # Log the response for debugging
-    try:
-        response.raise_for_status()  # Raise an HTTPError for bad responses
-        response_content = response.json()
-        return response_content
-    except requests.exceptions.HTTPError:
-        pass
-    except Exception:
-        pass
+        # The caller reports failures by checking for None; the error class is kept in the call metrics
+        try:
+            response.raise_for_status()  # Raise an HTTPError for bad responses
+            response_content = response.json()
+            return response_content
+        except Exception as e:
+            record_error(e)
     return None
 
 
 # Function to get threat model from the GPT response.
-def get_threat_model(api_key, model_name, prompt):
-    client = OpenAI(api_key=api_key)
+def get_threat_model(api_key, model_name, prompt, max_tokens=4000):
+    client = get_openai_client(api_key)
 
     # For reasoning models (o1, o3-mini), use a structured system prompt
     if model_name in ["o1", "o3-mini"]:
@@ -187,61 +201,61 @@ def get_threat_model(api_key, model_name, prompt):
         # Create completion with max_completion_tokens for o1/o3-mini
         response = client.chat.completions.create(
             model=model_name,
-            response_format={"type": "json_object"},
+            response_format=openai_model_response_format("threat_model", model_name),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            max_completion_tokens=4000
+            max_completion_tokens=max_tokens
         )
+        record_usage(response)
     else:
         system_prompt = "You are a helpful assistant designed to output JSON."
         # Create completion with max_tokens for other models
         response = client.chat.completions.create(
             model=model_name,
-            response_format={"type": "json_object"},
+            response_format=openai_model_response_format("threat_model", model_name),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=4000
+            max_tokens=max_tokens
         )
+        record_usage(response)
 
     # Convert the JSON string in the 'content' field to a Python dictionary
-    response_content = json.loads(response.choices[0].message.content)
+    response_content = parse_json_response(response.choices[0].message.content, THREAT_MODEL_KEYS, "threat_model")
 
     return response_content
 
 
 # Function to get threat model from the Azure OpenAI response.
-def get_threat_model_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt):
-    client = AzureOpenAI(
-        azure_endpoint = azure_api_endpoint,
-        api_key = azure_api_key,
-        api_version = azure_api_version,
-    )
+def get_threat_model_azure(azure_api_endpoint, azure_api_key, azure_api_version, azure_deployment_name, prompt, max_tokens=4000):
+    client = get_azure_openai_client(azure_api_endpoint, azure_api_key, azure_api_version)
 
     response = client.chat.completions.create(
         model = azure_deployment_name,
-        response_format={"type": "json_object"},
+        response_format=azure_response_format("threat_model", azure_api_version),
         messages=[
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Convert the JSON string in the 'content' field to a Python dictionary
-    response_content = json.loads(response.choices[0].message.content)
+    response_content = parse_json_response(response.choices[0].message.content, THREAT_MODEL_KEYS, "threat_model")
 
     return response_content
 
 
 # Function to get threat model from the Google response.
-def get_threat_model_google(google_api_key, google_model, prompt):
-    genai.configure(api_key=google_api_key)
+def get_threat_model_google(google_api_key, google_model, prompt, max_tokens=4000):
+    configure_google(google_api_key)
     model = genai.GenerativeModel(
         google_model,
-        generation_config={"response_mime_type": "application/json"})
+        generation_config={**gemini_generation_config("threat_model"), "max_output_tokens": max_tokens})
     response = model.generate_content(
         prompt,
         safety_settings={
@@ -249,31 +263,33 @@ def get_threat_model_google(google_api_key, google_model, prompt):
         })
     try:
         # Access the JSON content from the 'parts' attribute of the 'content' object
-        response_content = json.loads(response.candidates[0].content.parts[0].text)
+        response_content = parse_json_response(response.candidates[0].content.parts[0].text, THREAT_MODEL_KEYS, "threat_model")
     except json.JSONDecodeError:
         return None
 
     return response_content
 
 # Function to get threat model from the Mistral response.
-def get_threat_model_mistral(mistral_api_key, mistral_model, prompt):
-    client = Mistral(api_key=mistral_api_key)
+def get_threat_model_mistral(mistral_api_key, mistral_model, prompt, max_tokens=4000):
+    client = get_mistral_client(mistral_api_key)
 
     response = client.chat.complete(
         model = mistral_model,
         response_format={"type": "json_object"},
         messages=[
-            UserMessage(content=prompt)
-        ]
+            mistralai.UserMessage(content=prompt)
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Convert the JSON string in the 'content' field to a Python dictionary
-    response_content = json.loads(response.choices[0].message.content)
+    response_content = parse_json_response(response.choices[0].message.content, THREAT_MODEL_KEYS, "threat_model")
 
     return response_content
 
 # Function to get threat model from Ollama hosted LLM.
-def get_threat_model_ollama(ollama_endpoint, ollama_model, prompt):
+def get_threat_model_ollama(ollama_endpoint, ollama_model, prompt, max_tokens=4000, num_ctx=None, keep_alive=None):
     """
     Get threat model from Ollama hosted LLM.
     
@@ -281,6 +297,9 @@ def get_threat_model_ollama(ollama_endpoint, ollama_model, prompt):
         ollama_endpoint (str): The URL of the Ollama endpoint (e.g., 'http://localhost:11434')
         ollama_model (str): The name of the model to use
         prompt (str): The prompt to send to the model
+        max_tokens (int): The output token limit (Ollama's num_predict)
+        num_ctx (int): The context window to load the model with
+        keep_alive (str or int): How long Ollama keeps the model loaded afterwards
         
     Returns:
         dict: The parsed JSON response from the model
@@ -301,17 +320,18 @@ def get_threat_model_ollama(ollama_endpoint, ollama_model, prompt):
         "model": ollama_model,
         "prompt": full_prompt,
         "stream": False,
-        "format": "json"
+        **ollama_request_fields(max_tokens, num_ctx, keep_alive),
+        "format": ollama_format("threat_model")
     }
 
     try:
-        response = requests.post(url, json=data, timeout=60)  # Add timeout
+        response = get_http_session().post(url, json=data, timeout=60)  # Add timeout
         response.raise_for_status()  # Raise exception for bad status codes
         outer_json = response.json()
         
         try:
             # Parse the JSON response from the model's response field
-            inner_json = json.loads(outer_json['response'])
+            inner_json = parse_json_response(outer_json['response'], THREAT_MODEL_KEYS, "threat_model")
             return inner_json
         except (json.JSONDecodeError, KeyError):
             raise
@@ -320,8 +340,8 @@ def get_threat_model_ollama(ollama_endpoint, ollama_model, prompt):
         raise
 
 # Function to get threat model from the Claude response.
-def get_threat_model_anthropic(anthropic_api_key, anthropic_model, prompt):
-    client = Anthropic(api_key=anthropic_api_key)
+def get_threat_model_anthropic(anthropic_api_key, anthropic_model, prompt, max_tokens=4096):
+    client = get_anthropic_client(anthropic_api_key)
         # Check if we're using Claude 3.7
     is_claude_3_7 = "claude-3-7" in anthropic_model.lower()
      
@@ -341,38 +361,43 @@ def get_threat_model_anthropic(anthropic_api_key, anthropic_model, prompt):
             if is_thinking_mode:
                 response = client.messages.create(
                     model=actual_model,
-                    max_tokens=24000,
+                    max_tokens=THINKING_BUDGET_TOKENS + max_tokens,
                     thinking={
                         "type": "enabled",
-                        "budget_tokens": 16000
+                        "budget_tokens": THINKING_BUDGET_TOKENS
                     },
                     system="You are a JSON-generating assistant. You must ONLY output valid, parseable JSON with no additional text or formatting.",
                     messages=[
-                        {"role": "user", "content": json_prompt}
+                        {"role": "user", "content": anthropic_content(json_prompt)}
                     ],
                     timeout=600  # 10-minute timeout
                 )
+                record_usage(response)
             else:
                 response = client.messages.create(
                     model=actual_model,
-                    max_tokens=4096,
+                    max_tokens=max_tokens,
                     system="You are a JSON-generating assistant. You must ONLY output valid, parseable JSON with no additional text or formatting.",
                     messages=[
-                        {"role": "user", "content": json_prompt}
+                        {"role": "user", "content": anthropic_content(json_prompt)}
                     ],
-                    timeout=300  # 5-minute timeout
+                    timeout=300,  # 5-minute timeout
+                    **anthropic_tool_kwargs("threat_model")
                 )
+                record_usage(response)
         else:
             # Standard handling for other Claude models
             response = client.messages.create(
                 model=actual_model,
-                max_tokens=4096,
+                max_tokens=max_tokens,
                 system="You are a helpful assistant designed to output JSON. Your response must be a valid, parseable JSON object with no additional text, markdown formatting, or explanation. Do not include ```json code blocks or any other formatting - just return the raw JSON object.",
                 messages=[
-                    {"role": "user", "content": prompt}
+                    {"role": "user", "content": anthropic_content(prompt)}
                 ],
-                timeout=300  # 5-minute timeout
+                timeout=300,  # 5-minute timeout
+                **anthropic_tool_kwargs("threat_model")
             )
+            record_usage(response)
          
         # Combine all text blocks into a single string
         if is_thinking_mode:
@@ -384,20 +409,13 @@ def get_threat_model_anthropic(anthropic_api_key, anthropic_model, prompt):
             if thinking_content:
                 st.session_state['last_thinking_content'] = thinking_content
         else:
-            # Standard handling for regular responses
-            full_content = ''.join(block.text for block in response.content)
+            # Outside thinking mode the answer arrives as the forced tool call's input
+            full_content = get_anthropic_output(response)
          
         # Parse the JSON response
         try:
-            # Check for and fix common JSON formatting issues
-            if is_claude_3_7:
-                # Sometimes Claude 3.7 adds trailing commas which are invalid in JSON
-                full_content = full_content.replace(",\n  ]", "\n  ]").replace(",\n]", "\n]")
-                 
-                # Sometimes it adds comments which are invalid in JSON
-                full_content = re.sub(r'//.*?\n', '\n', full_content)
-             
-            response_content = json.loads(full_content)
+            # Trailing commas, comments and truncated output are repaired by the parser
+            response_content = parse_json_response(full_content, THREAT_MODEL_KEYS, "threat_model")
             return response_content
         except json.JSONDecodeError as e:
             # Create a fallback response
@@ -417,6 +435,11 @@ def get_threat_model_anthropic(anthropic_api_key, anthropic_model, prompt):
             return fallback_response
              
     except Exception as e:
+        # Let retry_policy retry rate limits, timeouts and overloads
+        if is_retryable_error(e):
+            raise
+        # The fallback answer hides the failure from the caller, so record it
+        record_error(e)
         # Handle timeout and other errors
         error_message = str(e)
         st.error(f"Error with Anthropic API: {error_message}")
@@ -439,60 +462,28 @@ def get_threat_model_anthropic(anthropic_api_key, anthropic_model, prompt):
         return fallback_response
 
 # Function to get threat model from LM Studio Server response.
-def get_threat_model_lm_studio(lm_studio_endpoint, model_name, prompt):
-    client = OpenAI(
-        base_url=f"{lm_studio_endpoint}/v1",
-        api_key="not-needed"  # LM Studio Server doesn't require an API key
-    )
-
-    # Define the expected response structure
-    threat_model_schema = {
-        "type": "json_schema",
-        "json_schema": {
-            "name": "threat_model_response",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "threat_model": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "Threat Type": {"type": "string"},
-                                "Scenario": {"type": "string"},
-                                "Potential Impact": {"type": "string"}
-                            },
-                            "required": ["Threat Type", "Scenario", "Potential Impact"]
-                        }
-                    },
-                    "improvement_suggestions": {
-                        "type": "array",
-                        "items": {"type": "string"}
-                    }
-                },
-                "required": ["threat_model", "improvement_suggestions"]
-            }
-        }
-    }
+def get_threat_model_lm_studio(lm_studio_endpoint, model_name, prompt, max_tokens=4000):
+    client = get_lm_studio_client(lm_studio_endpoint)
 
     response = client.chat.completions.create(
         model=model_name,
-        response_format=threat_model_schema,
+        response_format=openai_response_format("threat_model", inline_refs=True),
         messages=[
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
         ],
-        max_tokens=4000,
+        max_tokens=max_tokens,
     )
+    record_usage(response)
 
     # Convert the JSON string in the 'content' field to a Python dictionary
-    response_content = json.loads(response.choices[0].message.content)
+    response_content = parse_json_response(response.choices[0].message.content, THREAT_MODEL_KEYS, "threat_model")
 
     return response_content
 
 # Function to get threat model from the Groq response.
-def get_threat_model_groq(groq_api_key, groq_model, prompt):
-    client = Groq(api_key=groq_api_key)
+def get_threat_model_groq(groq_api_key, groq_model, prompt, max_tokens=4000):
+    client = get_groq_client(groq_api_key)
 
     response = client.chat.completions.create(
         model=groq_model,
@@ -500,8 +491,10 @@ def get_threat_model_groq(groq_api_key, groq_model, prompt):
         messages=[
             {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        max_tokens=max_tokens
     )
+    record_usage(response)
 
     # Process the response using our utility function
     reasoning, response_content = process_groq_response(
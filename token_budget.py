@@ -0,0 +1,188 @@
+import functools
+
+from prompt_cache import split_static_prefix
+from lazy_imports import lazy_import
+
+tiktoken = lazy_import("tiktoken")
+
+# --------- Token Budgeting --------- #
+
+# Every request is sized before it is sent: the output limit follows from the stage and the
+# size of its input, and is capped by what is left of the model's context window. Inputs that
+# would not leave room for a useful answer are shortened, or rejected if the fixed instructions
+# alone are too long, instead of failing at the provider after a long wait.
+
+# Define token limits for specific model+provider combinations
+# Format: {"provider:model": {"default": default_value, "max": max_value}}
+# "max" is the model's context window; "default" is the default GitHub analysis limit
+model_token_limits = {
+    # OpenAI models
+    "OpenAI API:gpt-4.5-preview": {"default": 64000, "max": 128000},
+    "OpenAI API:gpt-4o": {"default": 64000, "max": 128000},
+    "OpenAI API:gpt-4o-mini": {"default": 64000, "max": 128000},
+    "OpenAI API:o1": {"default": 64000, "max": 200000},
+    "OpenAI API:o3-mini": {"default": 64000, "max": 200000},
+
+    # Claude models
+    "Anthropic API:claude-3-7-sonnet-latest": {"default": 64000, "max": 200000},
+    "Anthropic API:claude-3-7-sonnet-thinking": {"default": 64000, "max": 200000},
+    "Anthropic API:claude-3-5-sonnet-latest": {"default": 64000, "max": 200000},
+    "Anthropic API:claude-3-5-haiku-latest": {"default": 64000, "max": 200000},
+
+    # Mistral models
+    "Mistral API:mistral-large-latest": {"default": 64000, "max": 131000},
+    "Mistral API:mistral-small-latest": {"default": 16000, "max": 32000},
+
+    # Google models
+    "Google AI API:gemini-2.0-flash": {"default": 120000, "max": 1000000},
+    "Google AI API:gemini-2.0-flash-lite": {"default": 120000, "max": 1000000},
+    "Google AI API:gemini-1.5-pro": {"default": 240000, "max": 2000000},
+
+    # Groq models
+    "Groq API:deepseek-r1-distill-llama-70b": {"default": 64000, "max": 128000},
+    "Groq API:llama-3.3-70b-versatile": {"default": 64000, "max": 128000},
+    "Groq API:llama-3.1-8b-instant": {"default": 64000, "max": 128000},
+    "Groq API:mixtral-8x7b-32768": {"default": 16000, "max": 32000},
+    "Groq API:gemma-9b-it": {"default": 4000, "max": 8192},
+
+    # Azure models - conservative defaults
+    "Azure OpenAI Service:default": {"default": 64000, "max": 128000},
+
+    # Ollama and LM Studio - conservative defaults
+    "Ollama:default": {"default": 8000, "max": 32000},
+    "LM Studio Server:default": {"default": 8000, "max": 32000}
+}
+
+# Limits for models that are not in the table and whose provider has no default
+FALLBACK_TOKEN_LIMITS = {"default": 8000, "max": 32000}
+
+# Output tokens each stage is given: "per_input_token" times the size of the variable part of
+# its prompt (e.g. the threat list), kept between "minimum" and "maximum". Stages that answer
+# per threat grow with the number of threats; the others produce roughly fixed-size output.
+STAGE_OUTPUT_TOKENS = {
+    "threat_model": {"minimum": 4000, "per_input_token": 0.5, "maximum": 4096},
+    "attack_tree": {"minimum": 2000, "per_input_token": 0.5, "maximum": 4096},
+    "mitigations": {"minimum": 1024, "per_input_token": 1.5, "maximum": 8192},
+    "dread_assessment": {"minimum": 1024, "per_input_token": 1.0, "maximum": 8192},
+    "test_cases": {"minimum": 1024, "per_input_token": 2.0, "maximum": 8192},
+    "expert_analysis": {"minimum": 1500, "per_input_token": 0.25, "maximum": 3000},
+}
+
+# Room left for the system prompt, response schema and chat template around the user prompt
+PROMPT_OVERHEAD_TOKENS = 1000
+
+# Extended thinking tokens, which Anthropic counts towards max_tokens on top of the answer
+THINKING_BUDGET_TOKENS = 16000
+
+# Inputs are not shortened below this many tokens; the request is rejected instead
+MIN_VARIABLE_TOKENS = 256
+
+TRUNCATION_MARKER = "\n\n[... {} tokens omitted to fit the model's context window ...]\n\n"
+
+
+class TokenBudgetError(ValueError):
+    """Raised before sending a request that cannot fit the model's context window."""
+
+
+# Function to load (once per model) the tiktoken encoding used for estimates
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # Unknown model, or the encoding could not be downloaded (e.g. offline)
+        return None
+
+
+def estimate_tokens(text, model="gpt-4o"):
+    """
+    Estimate the number of tokens in a text string.
+    Uses tiktoken for OpenAI models, or falls back to a character-based approximation.
+
+    Args:
+        text: The text to estimate tokens for
+        model: The model to use for estimation (default: gpt-4o)
+
+    Returns:
+        Estimated token count
+    """
+    enc = _get_encoding(model)
+    if enc is not None:
+        # Use tiktoken for accurate estimation
+        return len(enc.encode(text))
+    # Fall back to character-based approximation
+    # Different languages have different token densities
+    # English: ~4 chars per token, Chinese: ~1-2 chars per token
+    return len(text) // 4  # Conservative estimate for English text
+
+
+def get_token_limits(model_provider, model_name):
+    """
+    Look up the token limits of a model, falling back to its provider's defaults.
+
+    Args:
+        model_provider (str): The provider name as shown in the sidebar
+        model_name (str): The model (Azure: deployment) name
+
+    Returns:
+        dict: {"default": GitHub analysis limit, "max": context window}
+    """
+    return (
+        model_token_limits.get(f"{model_provider}:{model_name}")
+        or model_token_limits.get(f"{model_provider}:default")
+        or FALLBACK_TOKEN_LIMITS
+    )
+
+
+def _is_thinking_model(config):
+    return config["provider"] == "Anthropic API" and "thinking" in (config["model"] or "").lower()
+
+
+def _shorten(text, max_tokens, text_tokens):
+    # Keep the start and end of the input, where descriptions and conclusions usually are
+    keep_chars = int(len(text) * max_tokens / text_tokens)
+    head = keep_chars * 2 // 3
+    tail = keep_chars - head
+    return text[:head] + TRUNCATION_MARKER.format(text_tokens - max_tokens) + (text[-tail:] if tail else "")
+
+
+def plan_request(stage, prompt, config):
+    """
+    Size a request for the configured model: choose the output token limit for the stage and,
+    if the prompt would not leave room for it, shorten the variable part of the prompt (the
+    part after its static instructions, see prompt_cache).
+
+    Args:
+        stage (str): The pipeline stage, a key of STAGE_OUTPUT_TOKENS
+        prompt (str): The prompt to send to the model
+        config (dict): Provider settings from providers.get_provider_config()
+
+    Returns:
+        tuple: (prompt to send, max output tokens excluding any thinking budget)
+
+    Raises:
+        TokenBudgetError: If the prompt's static instructions alone do not fit the context window
+    """
+    budget = STAGE_OUTPUT_TOKENS[stage]
+    # Ollama loads the model with the context size sent in its options (see local_models)
+    context_window = config.get("options", {}).get("num_ctx") or get_token_limits(config["provider"], config["model"])["max"]
+    reserved = PROMPT_OVERHEAD_TOKENS + (THINKING_BUDGET_TOKENS if _is_thinking_model(config) else 0)
+
+    static, variable = split_static_prefix(prompt)
+    static_tokens = estimate_tokens(static)
+    variable_tokens = estimate_tokens(variable)
+
+    wanted = int(variable_tokens * budget["per_input_token"])
+    wanted = min(budget["maximum"], max(budget["minimum"], wanted))
+    available = context_window - reserved - static_tokens - variable_tokens
+    if available >= budget["minimum"]:
+        return prompt, min(wanted, available)
+
+    # Not enough room for a useful answer: shorten the input to leave the minimum output
+    allowed = context_window - reserved - static_tokens - budget["minimum"]
+    if allowed < MIN_VARIABLE_TOKENS:
+        raise TokenBudgetError(
+            f"The {stage.replace('_', ' ')} prompt needs about {static_tokens + reserved + budget['minimum']} tokens, "
+            f"more than the {context_window} token context window of {config['model'] or config['provider']}"
+        )
+    return static + _shorten(variable, allowed, variable_tokens), budget["minimum"]
@@ -1,5 +1,6 @@
 import re
 import json
+from json_repair import parse_json_response
 
 def extract_deepseek_reasoning(response_text):
     """
@@ -134,8 +135,8 @@ def process_groq_response(response_text, model_name, expect_json=True):
     # Process the final output based on whether we expect JSON
     if expect_json:
         try:
-            processed_output = json.loads(final_output)
-        except json.JSONDecodeError as e:
+            processed_output = parse_json_response(final_output)
+        except json.JSONDecodeError:
             # If JSON parsing fails, return the raw text
             processed_output = final_output
     else: